@@ -0,0 +1,70 @@
+import logging
+import tempfile
+import time
+from logging.handlers import TimedRotatingFileHandler
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from conf.logging import JsonFormatter, QueuedHandler, SamplingFilter
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the logging overhead of an API request: the old setup (f-strings, every access event '
+        'written synchronously by a rotating file handler) against the current one (lazy arguments, '
+        'sampled access events, JSON lines written by a background thread).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000, help='simulated requests per setup')
+        parser.add_argument('--events', type=int, default=3, help='permission/queryset log events per request')
+        parser.add_argument('--sample-rate', type=float, default=settings.LOGGING['filters']['sample_api_access']['rate'])
+
+    def handle(self, *args, **options):
+        requests, events = options['requests'], options['events']
+        username, pk, method = 'bench_user', 42, 'GET'
+        with tempfile.TemporaryDirectory() as directory:
+            logger = self.logger('bench_log.sync')
+            handler = TimedRotatingFileHandler(Path(directory) / 'sync.log', when='midnight')
+            handler.setFormatter(logging.Formatter(
+                settings.LOGGING['formatters']['verbose']['format'], style='{',
+            ))
+            logger.addHandler(handler)
+
+            def old():
+                for _ in range(events):
+                    logger.info(f"Request to {method} user {pk} by {username}.")
+
+            logger_queued = self.logger('bench_log.queued')
+            queued = QueuedHandler({'class': 'logging.FileHandler', 'filename': str(Path(directory) / 'queued.log')})
+            queued.setFormatter(JsonFormatter())
+            logger_queued.addFilter(SamplingFilter(options['sample_rate']))
+            logger_queued.addHandler(queued)
+
+            def new():
+                for _ in range(events):
+                    logger_queued.info("Request to %s user %s by %s.", method, pk, username)
+
+            self.stdout.write(f'{requests} requests of {events} log events, sample rate {options["sample_rate"]}')
+            baseline = None
+            for name, request in [('sync f-string', old), ('queued sampled', new)]:
+                start = time.perf_counter()
+                for _ in range(requests):
+                    request()
+                seconds = time.perf_counter() - start
+                per_request = seconds / requests * 1e6
+                baseline = baseline or per_request
+                self.stdout.write(f'{name}: {per_request:.1f} µs per request ({baseline / per_request:.1f}x)')
+            handler.close()
+            queued.close()
+            if queued.dropped:
+                self.stdout.write(f'{queued.dropped} records dropped, queue full')
+
+    @staticmethod
+    def logger(name):
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        return logger
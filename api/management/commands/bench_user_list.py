@@ -0,0 +1,48 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from api.serializers import UserSerializer, stream_json, values_fields
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures rows/s of the user list serialization paths: ModelSerializer over model instances '
+        '(the old api/users/), .values() rows (the paginated list) and the streamed export.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50000, help='users to serialize (seed_data --users makes more)')
+        parser.add_argument('--repeat', type=int, default=3, help='runs per path, the fastest one is reported')
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('id')[:options['rows']]
+        fields = values_fields(UserSerializer())
+        count = users.count()
+        if not count:
+            raise CommandError('No users, create some with seed_data --movies N --users N.')
+
+        def model_serializer():
+            return JSONRenderer().render(UserSerializer(users, many=True).data)
+
+        def values():
+            return JSONRenderer().render(list(users.values(*fields)))
+
+        def streamed():
+            return ''.join(stream_json(users.values(*fields).iterator(chunk_size=2000))).encode()
+
+        self.stdout.write(f'{count} users, fastest of {options["repeat"]} runs')
+        baseline = None
+        for name, serialize in [('model serializer', model_serializer), ('values', values), ('stream', streamed)]:
+            seconds = min(self.timed(serialize) for _ in range(options['repeat']))
+            rate = count / seconds
+            baseline = baseline or rate
+            self.stdout.write(f'{name}: {rate:,.0f} rows/s, {seconds * 1000:.1f} ms ({rate / baseline:.1f}x)')
+
+    @staticmethod
+    def timed(serialize):
+        start = time.perf_counter()
+        serialize()
+        return time.perf_counter() - start
@@ -0,0 +1,30 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CursorPage(CursorPagination):
+    """
+    Opaque ?cursor= pages: each page is a seek on the ordering columns instead of an OFFSET,
+    so deep pages cost the same and rows added meanwhile don't shift them.
+    """
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class IdPage(CursorPage):
+    # admin lists, larger pages
+    page_size = 100
+    ordering = 'id'
+
+
+class TitlePage(CursorPage):
+    # same order as the catalog, served by the (title, id) index
+    ordering = ('title', 'id')
+
+
+class NewestPage(CursorPage):
+    ordering = ('-created_at', '-id')
+
+
+class RecentPage(CursorPage):
+    ordering = '-id'
@@ -1,7 +1,14 @@
+from django.conf import settings
 from django.contrib.auth.models import Group
 from rest_framework import serializers
+from rest_framework.utils.encoders import JSONEncoder
 from django.contrib.auth import get_user_model
 
+from movies.batch import OPERATIONS
+from movies.images import current_derivatives
+from movies.models import RATING_VALUES, Favorite, Movie, Rating, Review
+from movies.seeding import chunked
+
 UserModel = get_user_model()
 
 
@@ -9,6 +16,8 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserModel
         fields = ['id', 'username', 'email', 'password']
+        # accepted on create/update, never sent back (not even hashed)
+        extra_kwargs = {'password': {'write_only': True}}
 
     def create(self, validated_data):
         user = UserModel.objects.create_user(**validated_data)
@@ -27,3 +36,141 @@ class GroupSerializer(serializers.ModelSerializer):
     class Meta:
         model = Group
         fields = ['id', 'name', 'permissions']
+
+
+def values_fields(serializer):
+    """
+    Readable fields of a ModelSerializer that are model columns under their own name, so
+    .values() rows are its output already. None when a field needs the serializer itself
+    (nested, method or relation fields, another source).
+    """
+    names = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if field.source != name or isinstance(field, (
+            serializers.BaseSerializer, serializers.SerializerMethodField,
+            serializers.RelatedField, serializers.ManyRelatedField,
+        )):
+            return None
+        names.append(name)
+    return names
+
+
+def stream_json(rows, chunk_size=1000):
+    # JSON array of the rows, encoded a chunk at a time for a StreamingHttpResponse
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    yield '['
+    separator = ''
+    for chunk in chunked(rows, chunk_size):
+        # the chunk's array without its brackets
+        yield separator + encoder.encode(chunk)[1:-1]
+        separator = ','
+    yield ']'
+
+
+def requested_fields(request, available):
+    # names picked with ?fields=a,b that the serializer has, None when the parameter picks nothing
+    names = (request.query_params.get('fields', '') if request else '').split(',')
+    picked = [name.strip() for name in names if name.strip() in available]
+    return picked or None
+
+
+class SparseFieldsMixin:
+    """Leaves out the fields not listed in the request's ?fields= parameter."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        picked = requested_fields(self.context.get('request'), self.fields)
+        if picked:
+            for name in set(self.fields) - set(picked):
+                self.fields.pop(name)
+
+
+class MovieSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # genres are decoded from genre_mask with the genre map of the serializer context, no join
+    genres = serializers.SerializerMethodField()
+    image_derivatives = serializers.SerializerMethodField()
+    rating_histogram = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Movie
+        fields = [
+            'id', 'title', 'description', 'release_date', 'duration', 'genres', 'image', 'image_derivatives',
+            'rating_avg', 'rating_count', 'rating_histogram', 'updated_at',
+        ]
+
+    def get_genres(self, movie):
+        genres = self.context['genres']
+        return [
+            {'id': genre.pk, 'name': genre.name}
+            for bit, genre in sorted(genres.items()) if movie.genre_mask >> bit & 1
+        ]
+
+    def get_image_derivatives(self, movie):
+        # {format: [{width, url}]} of the resized copies, empty until they are generated
+        request = self.context.get('request')
+        storage = movie.image.storage
+        derivatives = current_derivatives(movie)
+        return {
+            fmt: [
+                {'width': width, 'url': request.build_absolute_uri(storage.url(name)) if request else storage.url(name)}
+                for width, name in entries
+            ]
+            for fmt, entries in derivatives.items() if fmt != 'source'
+        }
+
+    def get_rating_histogram(self, movie):
+        return movie.rating_histogram()
+
+
+class MovieReferenceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Movie
+        fields = ['id', 'title']
+
+
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username', read_only=True)
+
+    class Meta:
+        model = Review
+        fields = ['id', 'movie', 'username', 'text', 'created_at', 'updated_at']
+
+
+class RatingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    movie = MovieReferenceSerializer(read_only=True)
+
+    class Meta:
+        model = Rating
+        fields = ['id', 'movie', 'value']
+
+
+class FavoriteSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    movie = MovieReferenceSerializer(read_only=True)
+
+    class Meta:
+        model = Favorite
+        fields = ['id', 'movie', 'created_at']
+
+
+class BatchOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    movie = serializers.IntegerField(min_value=1)
+    value = serializers.ChoiceField(choices=list(RATING_VALUES), required=False)
+
+    def validate(self, data):
+        if data['op'] == 'rate' and 'value' not in data:
+            raise serializers.ValidationError({'value': 'A rating value is required to rate.'})
+        return data
+
+
+class BatchSerializer(serializers.Serializer):
+    operations = BatchOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, operations):
+        if len(operations) > settings.API_BATCH_MAX_OPERATIONS:
+            raise serializers.ValidationError(
+                f'At most {settings.API_BATCH_MAX_OPERATIONS} operations are accepted per request.'
+            )
+        return operations
@@ -1,4 +1,9 @@
+import json
+import logging
+import tempfile
 import unittest
+from pathlib import Path
+from datetime import date
 
 from django.urls import reverse
 from rest_framework import status
@@ -6,7 +11,16 @@ from rest_framework.test import APIClient, APITestCase
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from conf.logging import JsonFormatter, QueuedHandler, SamplingFilter
+from api.serializers import GroupSerializer, UserSerializer, stream_json, values_fields
+from movies.models import Favorite, Genre, Movie, Rating, Review
+from movies.ratings import record_rating
 
 UserModel = get_user_model()
 
@@ -217,6 +231,270 @@ class UserApiTests(APITestCase):
         response = self.user_client.delete(self.group_detail_url)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+    # Условные запросы: ETag без сериализации
+    def test_user_detail_not_modified(self):
+        response = self.user_client.get(self.user_detail_url)
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        response = self.user_client.get(self.user_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        self.user_client.patch(self.user_detail_url, {'email': 'changed@example.com'}, format='json')
+        response = self.user_client.get(self.user_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], 'changed@example.com')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_group_detail_etag_follows_permissions(self):
+        etag = self.admin_client.get(self.group_detail_url)['ETag']
+        response = self.admin_client.get(self.group_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.group.permissions.add(Permission.objects.first())
+        response = self.admin_client.get(self.group_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class UserListApiTests(APITestCase):
+
+    def setUp(self):
+        self.admin_user = UserModel.objects.create_superuser(
+            username='adminuser', email='admin@example.com', password='adminpassword123'
+        )
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.admin_user).access_token))
+        UserModel.objects.bulk_create([
+            UserModel(username=f'user{number}', email=f'user{number}@example.com') for number in range(5)
+        ])
+
+    def test_user_list_pages_from_values(self):
+        response = self.client.get(reverse('user-list'), {'page_size': 4})
+        self.assertEqual(
+            response.data['results'][0], {'id': self.admin_user.pk, 'username': 'adminuser', 'email': 'admin@example.com'}
+        )
+        self.assertEqual(len(response.data['results']), 4)
+        rest = self.client.get(response.data['next']).data['results']
+        self.assertEqual([user['username'] for user in rest], ['user3', 'user4'])
+
+    def test_password_is_write_only(self):
+        response = self.client.get(reverse('user-detail', kwargs={'pk': self.admin_user.pk}))
+        self.assertNotIn('password', response.data)
+
+    def test_values_fields(self):
+        self.assertEqual(values_fields(UserSerializer()), ['id', 'username', 'email'])
+        self.assertIsNone(values_fields(GroupSerializer()))
+
+    def test_export_streams_all_users(self):
+        response = self.client.get(reverse('user-export'))
+        self.assertTrue(response.streaming)
+        users = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([user['username'] for user in users], ['adminuser'] + [f'user{number}' for number in range(5)])
+        self.assertEqual(''.join(stream_json(iter([]))), '[]')
+        self.assertEqual(json.loads(''.join(stream_json(({'n': n} for n in range(5)), chunk_size=2))), [
+            {'n': n} for n in range(5)
+        ])
+
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(
+            UserModel.objects.get(username='user0')).access_token))
+        self.assertEqual(self.client.get(reverse('user-export')).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class MovieApiTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserModel.objects.create_user(username='testuser', password='testpassword123')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.user).access_token))
+        self.drama = Genre.objects.create(name='Drama')
+        self.crime = Genre.objects.create(name='Crime')
+        self.movies = []
+        for number in range(5):
+            movie = Movie.objects.create(title=f'Movie {number}', description='-', release_date=date(2000, 1, number + 1))
+            movie.genres.add(self.drama if number % 2 else self.crime)
+            self.movies.append(movie)
+        record_rating(self.user, self.movies[0], 4)
+        Favorite.objects.create(user=self.user, movie=self.movies[1])
+        Review.objects.create(user=self.user, movie=self.movies[0], text='Great')
+
+    def test_movie_list(self):
+        response = self.client.get(reverse('movie-list'), {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first = response.data['results'][0]
+        self.assertEqual(first['title'], 'Movie 0')
+        self.assertEqual(first['genres'], [{'id': self.crime.pk, 'name': 'Crime'}])
+        self.assertEqual((first['rating_avg'], first['rating_count']), (4, 1))
+        self.assertEqual(first['rating_histogram'][4], 1)
+
+        titles = []
+        url = response.data['next']
+        while url:
+            response = self.client.get(url)
+            titles += [movie['title'] for movie in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(titles, ['Movie 2', 'Movie 3', 'Movie 4'])
+
+    def test_movie_list_is_a_fixed_number_of_queries(self):
+        url = reverse('movie-list')
+        self.client.get(url, {'page_size': 1})
+        # JWT user, page
+        with self.assertNumQueries(2):
+            self.client.get(url, {'page_size': 1})
+        with self.assertNumQueries(2):
+            self.client.get(url, {'page_size': 5})
+
+    def test_sparse_fieldsets_and_filters(self):
+        response = self.client.get(reverse('movie-list'), {'fields': 'id,title,unknown', 'genres': self.drama.pk})
+        self.assertEqual(response.data['results'], [
+            {'id': self.movies[1].pk, 'title': 'Movie 1'}, {'id': self.movies[3].pk, 'title': 'Movie 3'},
+        ])
+        response = self.client.get(reverse('movie-list'), {'search': 'Movie 4', 'fields': 'title'})
+        self.assertEqual(response.data['results'], [{'title': 'Movie 4'}])
+
+    def test_movie_detail_is_public_and_conditional(self):
+        self.client.credentials()
+        url = reverse('movie-detail', kwargs={'pk': self.movies[0].pk})
+        response = self.client.get(url)
+        self.assertEqual(response.data['id'], self.movies[0].pk)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        Review.objects.create(user=UserModel.objects.create_user(username='other'), movie=self.movies[0], text='Meh')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_movie_reviews(self):
+        response = self.client.get(reverse('movie-review-list', kwargs={'pk': self.movies[0].pk}))
+        review = response.data['results'][0]
+        self.assertEqual((review['username'], review['text']), ('testuser', 'Great'))
+
+    def test_my_ratings_and_favorites(self):
+        response = self.client.get(reverse('my-rating-list'))
+        self.assertEqual(response.data['results'][0]['movie'], {'id': self.movies[0].pk, 'title': 'Movie 0'})
+        self.assertEqual(response.data['results'][0]['value'], 4)
+        response = self.client.get(reverse('my-favorite-list'), {'fields': 'movie'})
+        self.assertEqual(response.data['results'], [{'movie': {'id': self.movies[1].pk, 'title': 'Movie 1'}}])
+
+        self.client.credentials()
+        self.assertEqual(self.client.get(reverse('my-rating-list')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class BatchApiTests(APITestCase):
+
+    def setUp(self):
+        self.user = UserModel.objects.create_user(username='testuser', password='testpassword123')
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.user).access_token))
+        self.movies = [
+            Movie.objects.create(title=f'Movie {number}', description='-', release_date=date(2000, 1, 1))
+            for number in range(3)
+        ]
+        record_rating(self.user, self.movies[2], 5)
+        Favorite.objects.create(user=self.user, movie=self.movies[2])
+        self.url = reverse('my-batch')
+
+    def test_batch(self):
+        first, second, third = [movie.pk for movie in self.movies]
+        operations = [
+            {'op': 'rate', 'movie': first, 'value': 2},
+            {'op': 'rate', 'movie': first, 'value': 4},
+            {'op': 'favorite', 'movie': second},
+            {'op': 'unrate', 'movie': third},
+            {'op': 'unfavorite', 'movie': third},
+            {'op': 'favorite', 'movie': 999999},
+        ]
+        response = self.client.post(self.url, {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['superseded', 'ok', 'ok', 'ok', 'ok', 'not_found'],
+        )
+        self.assertEqual(dict(Rating.objects.filter(user=self.user).values_list('movie_id', 'value')), {first: 4})
+        self.assertEqual(list(Favorite.objects.filter(user=self.user).values_list('movie_id', flat=True)), [second])
+        aggregates = Movie.objects.values_list('pk', 'rating_count', 'rating_avg')
+        self.assertEqual(list(aggregates.order_by('pk')), [(first, 1, 4.0), (second, 0, 0.0), (third, 0, 0.0)])
+
+    def test_batch_queries_dont_grow_with_operations(self):
+        def post(movies):
+            operations = [{'op': 'favorite', 'movie': movie.pk} for movie in movies]
+            operations += [{'op': 'rate', 'movie': movie.pk, 'value': 3} for movie in movies]
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(self.url, {'operations': operations}, format='json')
+            return len(queries)
+
+        more = [Movie.objects.create(title='More', description='-', release_date=date(2000, 1, 1)) for _ in range(2)]
+        single = post(self.movies[:1])
+        # the aggregates of each voted movie are shifted with one UPDATE
+        self.assertEqual(post(more), single + 1)
+
+    def test_batch_unrate_shifts_each_movie_once(self):
+        more = [Movie.objects.create(title='More', description='-', release_date=date(2000, 1, 1)) for _ in range(4)]
+        for movie in more:
+            record_rating(self.user, movie, 2)
+        unrated = more + self.movies[2:]
+        operations = [{'op': 'unrate', 'movie': movie.pk} for movie in unrated]
+        operations += [{'op': 'rate', 'movie': movie.pk, 'value': 4} for movie in self.movies[:2]]
+        with self.captureOnCommitCallbacks() as callbacks, CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "movies_movie"')]
+        deletes = [query['sql'] for query in queries if query['sql'].startswith('DELETE FROM "movies_rating"')]
+        locks = [query['sql'] for query in queries if query['sql'].endswith('ORDER BY "movies_movie"."id" ASC')]
+        # the voted movies are locked once, then one UPDATE per movie and one DELETE, no per-row signal queries
+        self.assertEqual(len(locks), 1)
+        self.assertEqual(len(updates), len(unrated) + 2)
+        self.assertEqual(len(deletes), 1)
+        # for the whole batch: one leaderboard update, one bump of the movie pages, one (throttled) of the catalog
+        self.assertEqual(len(callbacks), 3)
+        self.assertFalse(Rating.objects.filter(user=self.user, movie__in=unrated).exists())
+        aggregates = Movie.objects.values_list('rating_count', 'votes_2', 'votes_5', 'rating_avg')
+        self.assertEqual(set(aggregates.filter(pk__in=[movie.pk for movie in unrated])), {(0, 0, 0, 0.0)})
+        self.assertEqual(set(aggregates.filter(pk__in=[movie.pk for movie in self.movies[:2]])), {(1, 0, 0, 4.0)})
+
+    def test_batch_validation(self):
+        response = self.client.post(self.url, {'operations': [{'op': 'rate', 'movie': self.movies[0].pk}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, {'operations': [{'op': 'like', 'movie': 1}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(API_BATCH_MAX_OPERATIONS=1):
+            operations = [{'op': 'favorite', 'movie': movie.pk} for movie in self.movies]
+            response = self.client.post(self.url, {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.credentials()
+        response = self.client.post(self.url, {'operations': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class LoggingTests(unittest.TestCase):
+
+    def record(self, level=logging.INFO, **extra):
+        record = logging.LogRecord('API_log.access', level, __file__, 1, 'Request to %s user %s.', ('GET', 7), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter(self):
+        entry = json.loads(JsonFormatter().format(self.record(user_id=7)))
+        self.assertEqual(entry['message'], 'Request to GET user 7.')
+        self.assertEqual((entry['level'], entry['logger'], entry['user_id']), ('INFO', 'API_log.access', 7))
+
+    def test_sampling_filter(self):
+        self.assertFalse(any(SamplingFilter(0).filter(self.record()) for _ in range(50)))
+        self.assertTrue(SamplingFilter(0).filter(self.record(logging.WARNING)))
+        kept = self.record()
+        self.assertTrue(SamplingFilter(1).filter(kept))
+        self.assertEqual(kept.sample_rate, 1.0)
+
+    def test_queued_handler_writes_in_background(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'api.log'
+            handler = QueuedHandler({'class': 'logging.FileHandler', 'filename': str(path)})
+            handler.setFormatter(JsonFormatter())
+            users = [7]
+            record = logging.LogRecord('API_log', logging.INFO, __file__, 1, 'Request to %s users %s.', ('GET', users), None)
+            handler.handle(record)
+            # the message is taken when logged, not when the thread writes it
+            users.append(8)
+            handler.close()
+            lines = path.read_text().splitlines()
+        self.assertEqual([json.loads(line)['message'] for line in lines], ['Request to GET users [7].'])
+        self.assertEqual(handler.dropped, 0)
+
 
 if __name__ == '__main__':
     unittest.main()
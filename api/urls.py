@@ -26,9 +26,16 @@ def admin_required(user):
 
 urlpatterns = [
     path('api/users/', views.UserList.as_view(), name='user-list'),
+    path('api/users/export/', views.UserExport.as_view(), name='user-export'),
     path('api/users/<int:pk>/', views.UserDetail.as_view(), name='user-detail'),
     path('api/groups/', views.GroupList.as_view(), name='group-list'),
     path('api/groups/<int:pk>/', views.GroupDetail.as_view(), name='group-detail'),
+    path('api/movies/', views.MovieList.as_view(), name='movie-list'),
+    path('api/movies/<int:pk>/', views.MovieDetail.as_view(), name='movie-detail'),
+    path('api/movies/<int:pk>/reviews/', views.MovieReviewList.as_view(), name='movie-review-list'),
+    path('api/me/ratings/', views.MyRatingList.as_view(), name='my-rating-list'),
+    path('api/me/favorites/', views.MyFavoriteList.as_view(), name='my-favorite-list'),
+    path('api/me/batch/', views.MyBatch.as_view(), name='my-batch'),
 
     re_path(r'^swagger/$',
             login_required(user_passes_test(admin_required)(schema_view.with_ui('swagger', cache_timeout=0))),
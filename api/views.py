@@ -1,36 +1,100 @@
+import hashlib
 import logging
+from collections import Counter
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
 from rest_framework import generics
+from rest_framework.response import Response
 from rest_framework.permissions import BasePermission, IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.renderers import JSONRenderer
 
-from api.serializers import UserSerializer, GroupSerializer
+from api.pagination import IdPage, NewestPage, RecentPage, TitlePage
+from api.serializers import (
+    BatchSerializer, FavoriteSerializer, GroupSerializer, MovieSerializer, RatingSerializer, ReviewSerializer,
+    UserSerializer, requested_fields, stream_json, values_fields,
+)
+from movies.batch import apply_batch
+from movies.cache import CATALOG, cached
+from movies.genres import filter_by_genres
+from movies.models import RATING_VALUES, Favorite, Genre, Movie, Rating, Review
+from movies.search import get_search_backend
+from users.activity import record_activity
 
 UserModel = get_user_model()
 
 logger = logging.getLogger('API_log')
+# permission and queryset checks of every request, sampled (LOGGING filters)
+access_logger = logging.getLogger('API_log.access')
 
 
 class IsOwner(BasePermission):
     def has_object_permission(self, request, view, obj):
-        logger.info(f"Checking if user {request.user.username} is the owner of the object.")
+        access_logger.info("Checking if user %s is the owner of the object.", request.user.username)
         return obj == request.user
 
 
 class IsOwnerOrAdmin(BasePermission):
     def has_object_permission(self, request, view, obj):
         # Allow if the user is the owner of the object or an administrator
-        logger.info(f"Checking if user {request.user.username} is the owner or an admin.")
+        access_logger.info("Checking if user %s is the owner or an admin.", request.user.username)
         return request.user.is_staff or obj == request.user
 
 
+class ConditionalRetrieveMixin:
+    """
+    ETag on GET of a single object, hashed from the stored values of the serializer's fields
+    instead of the rendered body: a matching If-None-Match gets 304 without serializing.
+    """
+
+    def get_etag(self, instance):
+        values = []
+        for name in self.get_serializer_class().Meta.fields:
+            field = instance._meta.get_field(name)
+            if field.many_to_many:
+                values.append(sorted(getattr(instance, name).values_list('pk', flat=True)))
+            else:
+                values.append(field.value_from_object(instance))
+        return quote_etag(hashlib.md5(repr(values).encode()).hexdigest())
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = self.get_etag(instance)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(self.get_serializer(instance).data)
+        response['ETag'] = etag
+        # token-authenticated: only the client itself may keep it, and has to revalidate
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
+
+class ValuesListMixin:
+    """
+    Read-only lists built from .values() rows: when every readable serializer field is a plain
+    column, the rows already are the output and the per-object serializer work is skipped.
+    """
+
+    def list(self, request, *args, **kwargs):
+        fields = values_fields(self.get_serializer())
+        if fields is None:
+            return super().list(request, *args, **kwargs)
+        rows = self.filter_queryset(self.get_queryset()).values(*fields)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(list(rows))
+        return self.get_paginated_response(page)
+
+
 # View for listing users and creating a new user
-class UserList(generics.ListCreateAPIView):
+class UserList(ValuesListMixin, generics.ListCreateAPIView):
     queryset = UserModel.objects.all()
     serializer_class = UserSerializer
     renderer_classes = [JSONRenderer]
+    pagination_class = IdPage
 
     def get_permissions(self):
         if self.request.method == 'POST':
@@ -42,11 +106,27 @@ class UserList(generics.ListCreateAPIView):
 
     def perform_create(self, serializer):
         user = serializer.save()
-        logger.info(f"User {user.username} created successfully.")
+        logger.info("User %s created successfully.", user.username)
+        record_activity('user_created', user, actor=self.request.user, message='via API')
+
+
+# Full user list for administrators, streamed: rows are read with iterator() and encoded in chunks
+class UserExport(generics.GenericAPIView):
+    queryset = UserModel.objects.all()
+    serializer_class = UserSerializer
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        rows = self.get_queryset().order_by('id').values(*values_fields(self.get_serializer()))
+        logger.info("User export requested by %s.", request.user.username)
+        record_activity('user_export', request.user)
+        response = StreamingHttpResponse(stream_json(rows.iterator(chunk_size=2000)), content_type='application/json')
+        response['Content-Disposition'] = 'attachment; filename="users.json"'
+        return response
 
 
 # View for retrieving, updating, and deleting a user
-class UserDetail(generics.RetrieveUpdateDestroyAPIView):
+class UserDetail(ConditionalRetrieveMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = UserModel.objects.all()
     serializer_class = UserSerializer
     renderer_classes = [JSONRenderer]
@@ -54,11 +134,11 @@ class UserDetail(generics.RetrieveUpdateDestroyAPIView):
     def get_permissions(self):
         if self.request.method == 'DELETE':
             # Only administrators can delete users
-            logger.info(f"Delete request for user by {self.request.user.username}.")
+            access_logger.info("Delete request for user by %s.", self.request.user.username)
             return [IsAdminUser()]
         elif self.request.method in ['PUT', 'PATCH', 'GET']:
             # Admin or owner can update their information and view details
-            logger.info(f"Request to {self.request.method} user {self.kwargs['pk']} by {self.request.user.username}.")
+            access_logger.info("Request to %s user %s by %s.", self.request.method, self.kwargs['pk'], self.request.user.username)
             return [IsAuthenticated(), IsOwnerOrAdmin()]
         else:
             # Default to denying access
@@ -67,7 +147,8 @@ class UserDetail(generics.RetrieveUpdateDestroyAPIView):
     def delete(self, request, *args, **kwargs):
         # Administrator deletes a user
         user = self.get_object()
-        logger.info(f"User {user.username} is being deleted by admin {request.user.username}.")
+        logger.info("User %s is being deleted by admin %s.", user.username, request.user.username)
+        record_activity('user_deleted', user, actor=request.user, message='via API')
         super().delete(request, *args, **kwargs)
         return JsonResponse({'message': 'Deleted'}, status=200)
 
@@ -81,11 +162,11 @@ class GroupList(generics.ListCreateAPIView):
     def get_permissions(self):
         if self.request.method == 'POST':
             # Only administrators can create new groups
-            logger.info(f"Group creation request received by {self.request.user.username}.")
+            access_logger.info("Group creation request received by %s.", self.request.user.username)
             return [IsAdminUser()]
         elif self.request.method == 'GET':
             # Administrators see all groups, users see only their groups
-            logger.info(f"Group list request by {self.request.user.username}.")
+            access_logger.info("Group list request by %s.", self.request.user.username)
             return [IsAuthenticated()]
         return [IsAuthenticated()]
 
@@ -93,19 +174,20 @@ class GroupList(generics.ListCreateAPIView):
         # Administrators see all groups, users see only their groups
         user = self.request.user
         if user.is_staff:
-            logger.info(f"Admin {user.username} requesting all groups.")
+            access_logger.info("Admin %s requesting all groups.", user.username)
             return Group.objects.all()
         else:
-            logger.info(f"User {user.username} requesting their groups.")
+            access_logger.info("User %s requesting their groups.", user.username)
             return user.groups.all()
 
     def perform_create(self, serializer):
         group = serializer.save()
-        logger.info(f"Group {group.name} created successfully by {self.request.user.username}.")
+        logger.info("Group %s created successfully by %s.", group.name, self.request.user.username)
+        record_activity('group_created', self.request.user, message=group.name, group=group.pk)
 
 
 # View for working with a specific group
-class GroupDetail(generics.RetrieveUpdateDestroyAPIView):
+class GroupDetail(ConditionalRetrieveMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     renderer_classes = [JSONRenderer]
@@ -113,11 +195,13 @@ class GroupDetail(generics.RetrieveUpdateDestroyAPIView):
     def get_permissions(self):
         if self.request.method in ['PUT', 'PATCH', 'DELETE']:
             # Only administrators can modify or delete groups
-            logger.info(f"Request to {self.request.method} group {self.kwargs['pk']} by {self.request.user.username}.")
+            access_logger.info(
+                "Request to %s group %s by %s.", self.request.method, self.kwargs['pk'], self.request.user.username,
+            )
             return [IsAdminUser()]
         elif self.request.method == 'GET':
             # Administrators can see all groups, users can see only their groups
-            logger.info(f"Group detail request by {self.request.user.username}.")
+            access_logger.info("Group detail request by %s.", self.request.user.username)
             return [IsAuthenticated(), IsOwnerOrAdmin()]
         else:
             return [IsAuthenticated()]
@@ -126,16 +210,130 @@ class GroupDetail(generics.RetrieveUpdateDestroyAPIView):
         # Administrators see all groups, users see only their groups
         user = self.request.user
         if user.is_staff:
-            logger.info(f"Admin {user.username} requesting group details.")
+            access_logger.info("Admin %s requesting group details.", user.username)
             return Group.objects.all()
         else:
-            logger.info(f"User {user.username} requesting details for their groups.")
+            access_logger.info("User %s requesting details for their groups.", user.username)
             return user.groups.all()
 
     def perform_update(self, serializer):
         group = serializer.save()
-        logger.info(f"Group {group.name} updated successfully by {self.request.user.username}.")
+        logger.info("Group %s updated successfully by %s.", group.name, self.request.user.username)
+        record_activity('group_updated', self.request.user, message=group.name, group=group.pk)
 
     def perform_destroy(self, instance):
-        logger.info(f"Group {instance.name} is being deleted by admin {self.request.user.username}.")
+        logger.info("Group %s is being deleted by admin %s.", instance.name, self.request.user.username)
+        record_activity('group_deleted', self.request.user, message=instance.name, group=instance.pk)
         instance.delete()
+
+
+# Read-only movie data for API clients. Every page is a fixed number of queries:
+# the page itself (related rows joined), genres come from the cached genre list.
+class MovieQueryMixin:
+    serializer_class = MovieSerializer
+    renderer_classes = [JSONRenderer]
+    permission_classes = [AllowAny]
+    # serializer fields read from other columns than their own name
+    source_columns = {
+        'genres': ['genre_mask'],
+        'image_derivatives': ['image', 'image_derivatives'],
+        'rating_histogram': [f'votes_{value}' for value in RATING_VALUES],
+    }
+
+    def get_genres(self):
+        # shared with the catalog page cache
+        return cached(CATALOG, 'genres', lambda: list(Genre.objects.all()))
+
+    def get_queryset(self):
+        # only the columns of the requested fields; title orders the cursor, updated_at makes the ETag
+        fields = requested_fields(self.request, MovieSerializer.Meta.fields) or MovieSerializer.Meta.fields
+        columns = {'id', 'title', 'updated_at'}
+        for name in fields:
+            columns.update(self.source_columns.get(name, [name]))
+        return Movie.objects.only(*columns)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['genres'] = {genre.bit: genre for genre in self.get_genres()}
+        return context
+
+
+class MovieList(MovieQueryMixin, generics.ListAPIView):
+    pagination_class = TitlePage
+
+    def get_queryset(self):
+        # ?search=, ?genres=1,2 (any of them), like the catalog sidebar
+        movies = super().get_queryset()
+        search = self.request.query_params.get('search', '').strip()
+        if search:
+            movies = get_search_backend().filter(movies, search)
+        genre_ids = self.request.query_params.get('genres', '').split(',')
+        genres = [genre for genre in self.get_genres() if str(genre.pk) in genre_ids]
+        return filter_by_genres(movies, genres)
+
+
+class MovieDetail(ConditionalRetrieveMixin, MovieQueryMixin, generics.RetrieveAPIView):
+    def get_etag(self, instance):
+        # updated_at follows votes, reviews and genre renames; the fieldset changes the body too
+        stamp = [instance.pk, instance.updated_at.isoformat(), self.request.query_params.get('fields', '')]
+        return quote_etag(hashlib.md5(repr(stamp).encode()).hexdigest())
+
+
+class MovieReviewList(generics.ListAPIView):
+    serializer_class = ReviewSerializer
+    renderer_classes = [JSONRenderer]
+    permission_classes = [AllowAny]
+    pagination_class = NewestPage
+
+    def get_queryset(self):
+        return (
+            Review.objects.filter(movie_id=self.kwargs['pk']).select_related('user')
+            .only('movie', 'text', 'created_at', 'updated_at', 'user__username')
+        )
+
+
+# The current user's votes and favorites
+class MyRatingList(generics.ListAPIView):
+    serializer_class = RatingSerializer
+    renderer_classes = [JSONRenderer]
+    pagination_class = RecentPage
+
+    def get_queryset(self):
+        return (
+            Rating.objects.filter(user=self.request.user).select_related('movie')
+            .only('value', 'movie__id', 'movie__title')
+        )
+
+
+class MyFavoriteList(generics.ListAPIView):
+    serializer_class = FavoriteSerializer
+    renderer_classes = [JSONRenderer]
+    pagination_class = NewestPage
+
+    def get_queryset(self):
+        return (
+            Favorite.objects.filter(user=self.request.user).select_related('movie')
+            .only('created_at', 'movie__id', 'movie__title')
+        )
+
+
+class MyBatch(generics.GenericAPIView):
+    """
+    Rates, unrates, favorites and unfavorites movies in one request:
+    {"operations": [{"op": "rate", "movie": 1, "value": 4}, {"op": "unfavorite", "movie": 2}]}.
+    Everything is applied in one transaction, the response has a status per operation.
+    """
+    serializer_class = BatchSerializer
+    renderer_classes = [JSONRenderer]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+        statuses = apply_batch(request.user, operations)
+        logger.info("Batch of %s operations applied for %s.", len(operations), request.user.username)
+        record_activity('batch', request.user, message=f'{len(operations)} operations',
+                        statuses=dict(Counter(statuses)))
+        return Response({'results': [
+            {'op': op['op'], 'movie': op['movie'], 'status': status} for op, status in zip(operations, statuses)
+        ]})
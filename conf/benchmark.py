@@ -0,0 +1,125 @@
+import http.cookiejar
+import json
+import math
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class LatencyStats:
+    """Latencies (seconds) of one kind of request, summarized as throughput and percentiles."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        # SQL queries per request, when the server reports them (X-Query-Count)
+        self.queries = []
+
+    def add(self, seconds, ok=True, queries=None):
+        self.latencies.append(seconds)
+        if not ok:
+            self.errors += 1
+        if queries is not None:
+            self.queries.append(queries)
+
+    def merge(self, other):
+        self.latencies += other.latencies
+        self.errors += other.errors
+        self.queries += other.queries
+
+    def summary(self, elapsed):
+        values = sorted(self.latencies)
+        return {
+            'requests': len(values),
+            'errors': self.errors,
+            'rps': len(values) / elapsed if elapsed else 0.0,
+            'mean_ms': sum(values) / len(values) * 1000 if values else 0.0,
+            'p50_ms': percentile(values, 50) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'queries': sum(self.queries) / len(self.queries) if self.queries else None,
+        }
+
+
+def format_summary(name, summary):
+    line = (
+        f"{name}: {summary['requests']} requests, {summary['errors']} errors, {summary['rps']:.1f} req/s, "
+        f"mean {summary['mean_ms']:.1f} ms, p50 {summary['p50_ms']:.1f} ms, "
+        f"p95 {summary['p95_ms']:.1f} ms, p99 {summary['p99_ms']:.1f} ms"
+    )
+    if summary.get('queries') is not None:
+        line += f", {summary['queries']:.1f} queries"
+    return line
+
+
+class HttpSession:
+    """
+    Minimal HTTP client for load scripts: keeps its own cookies, logs in through the site's
+    login form and sends the CSRF token back, like a browser tab would. API paths are sent
+    with a JWT obtained for the same user.
+    """
+
+    def __init__(self, base_url, timeout=30, api_prefix='/api/'):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.api_prefix = api_prefix
+        self.credentials = None
+        self.token = None
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def cookie(self, name):
+        return next((cookie.value for cookie in self.cookies if cookie.name == name), None)
+
+    def send(self, method, path, body=None, content_type='application/json', headers=None):
+        # (status, headers, body bytes); 4xx/5xx are returned, not raised
+        headers = {'Referer': f'{self.base_url}/', **(headers or {})}
+        if self.cookie('csrftoken'):
+            headers['X-CSRFToken'] = self.cookie('csrftoken')
+        if body is not None:
+            headers['Content-Type'] = content_type
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode()
+        request = urllib.request.Request(f'{self.base_url}{path}', data=body, method=method, headers=headers)
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers, error.read()
+
+    def request(self, method, path, body=None, content_type='application/json'):
+        # (status, headers)
+        is_api = path.startswith(self.api_prefix)
+        headers = {'Authorization': f'Bearer {self.token}'} if is_api and self.token else {}
+        status, response_headers, _ = self.send(method, path, body, content_type, headers)
+        if status == 401 and is_api and self.credentials and self.obtain_token():
+            # access tokens are short-lived, long runs renew them once per expiry
+            headers['Authorization'] = f'Bearer {self.token}'
+            status, response_headers, _ = self.send(method, path, body, content_type, headers)
+        return status, response_headers
+
+    def obtain_token(self, path='/api/token/'):
+        username, password = self.credentials
+        status, _, content = self.send('POST', path, {'username': username, 'password': password})
+        self.token = json.loads(content).get('access') if status == 200 else None
+        return self.token is not None
+
+    def login(self, username, password, path='/login/'):
+        self.credentials = (username, password)
+        self.request('GET', path)
+        form = urllib.parse.urlencode({
+            'username': username,
+            'password': password,
+            'csrfmiddlewaretoken': self.cookie('csrftoken') or '',
+        }).encode()
+        self.request('POST', path, form, content_type='application/x-www-form-urlencoded')
+        self.obtain_token()
+        return self.cookie('sessionid') is not None
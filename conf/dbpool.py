@@ -0,0 +1,72 @@
+from django.db import connections
+from prometheus_client import REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# psycopg_pool get_stats() keys exported as gauges: name -> help
+POOL_GAUGES = {
+    'pool_min': 'Configured minimum size of the database connection pool.',
+    'pool_max': 'Configured maximum size of the database connection pool.',
+    'pool_size': 'Connections currently managed by the pool, in use or idle.',
+    'pool_available': 'Idle connections ready to be handed out.',
+    'requests_waiting': 'Requests currently waiting for a connection.',
+}
+# cumulative get_stats() keys exported as counters
+POOL_COUNTERS = {
+    'requests_num': 'Connections requested from the pool.',
+    'requests_queued': 'Requests that had to wait because no connection was free.',
+    'requests_wait_ms': 'Total time requests waited for a connection, in milliseconds.',
+    'requests_errors': 'Requests that failed, e.g. timed out waiting for a connection.',
+    'connections_num': 'Connections opened by the pool.',
+    'connections_ms': 'Total time spent opening connections, in milliseconds.',
+    'connections_errors': 'Failed attempts to open a connection.',
+    'connections_lost': 'Connections found broken by the health check.',
+    'returns_bad': 'Connections returned to the pool in a bad state.',
+}
+
+
+def pool_stats(alias):
+    # get_stats() of the alias' pool in this process, None without pooling or before the first query
+    connection = connections[alias]
+    if not connection.settings_dict.get('OPTIONS', {}).get('pool'):
+        return None
+    pool = type(connection)._connection_pools.get(alias)
+    return pool.get_stats() if pool is not None else None
+
+
+class PoolStatsCollector:
+    """
+    Exports the psycopg pool statistics of this worker process at scrape time, plus
+    saturation: the share of pool_max in use. Near 1 with requests_waiting above zero,
+    requests queue for connections and DB_POOL_MAX_SIZE (or the database) is the limit.
+    """
+
+    def collect(self):
+        families = {
+            name: GaugeMetricFamily(f'django_db_pool_{name}', description, labels=['alias'])
+            for name, description in POOL_GAUGES.items()
+        }
+        families.update({
+            name: CounterMetricFamily(f'django_db_pool_{name}', description, labels=['alias'])
+            for name, description in POOL_COUNTERS.items()
+        })
+        saturation = GaugeMetricFamily(
+            'django_db_pool_saturation', 'Share of the maximum pool size in use.', labels=['alias'],
+        )
+        for alias in connections:
+            stats = pool_stats(alias)
+            if stats is None:
+                continue
+            # keys still at zero are left out of get_stats()
+            for name, family in families.items():
+                family.add_metric([alias], stats.get(name, 0))
+            in_use = stats.get('pool_size', 0) - stats.get('pool_available', 0)
+            saturation.add_metric([alias], in_use / stats['pool_max'] if stats.get('pool_max') else 0.0)
+        yield from families.values()
+        yield saturation
+
+
+def register_pool_metrics(registry=REGISTRY):
+    # once per process, the collector reads the pools lazily on every scrape
+    if not getattr(registry, '_pool_stats_registered', False):
+        registry.register(PoolStatsCollector())
+        registry._pool_stats_registered = True
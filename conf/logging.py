@@ -0,0 +1,97 @@
+import atexit
+import json
+import logging
+import queue
+import random
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from django.utils.module_loading import import_string
+
+# attributes every LogRecord has, everything else was passed with extra={...}
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, extra={...} fields, exception."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'message': record.getMessage(),
+        }
+        entry.update({name: value for name, value in vars(record).items() if name not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only `rate` (0..1) of the records at or below `level`, for high-volume events.
+    Kept records carry sample_rate, so counts can be scaled back up.
+    """
+
+    def __init__(self, rate=1.0, level='INFO'):
+        super().__init__()
+        self.rate = float(rate)
+        self.level = logging.getLevelName(level) if isinstance(level, str) else level
+
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+        if self.rate >= 1 or random.random() < self.rate:
+            record.sample_rate = self.rate
+            return True
+        return False
+
+
+class QueuedHandler(QueueHandler):
+    """
+    Puts records on an in-memory queue and returns; a background thread formats them and
+    writes them with the wrapped handler, so request threads never wait for disk I/O.
+    `handler` is a handler config like in LOGGING ({'class': ..., **kwargs}); the formatter
+    of this handler is used by it. When the queue is full records are dropped and counted,
+    logging never blocks a request.
+    """
+
+    def __init__(self, handler, queue_size=10000):
+        options = dict(handler)
+        self.target = import_string(options.pop('class'))(**options)
+        super().__init__(queue.Queue(queue_size))
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        self.running = True
+        atexit.register(self.stop)
+
+    def setFormatter(self, fmt):
+        # the target formats, in the listener thread
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # the message is resolved now, while its arguments are unchanged; formatting waits for the thread
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        # writes what is still queued
+        if self.running:
+            self.running = False
+            self.listener.stop()
+            self.target.close()
+
+    def close(self):
+        self.stop()
+        super().close()
@@ -1,25 +1,113 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
 from django.http import HttpResponseForbidden, HttpResponseRedirect
+from conf.dbpool import register_pool_metrics
+from conf.queries import (
+    REPEATED_QUERIES, REQUEST_QUERIES, REQUEST_QUERY_SECONDS, QueryBudgetExceeded, arecord_queries, record_queries,
+)
 from conf.settings import METRICS_ACCESS_TOKEN
 
+logger = logging.getLogger('query_inspector')
+
+
+class AsyncCapableMiddleware:
+    """
+    Base of the project middlewares: under ASGI they run in the event loop instead of making
+    Django adapt the chain (and the async views behind it) through a thread per request.
+    Subclasses implement both __call__ (sync) and __acall__.
+    """
+    sync_capable = True
+    async_capable = True
 
-class MetricsTokenAuthMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+
+class MetricsTokenAuthMiddleware(AsyncCapableMiddleware):
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        # pool gauges are read at scrape time, from the worker process answering /metrics
+        register_pool_metrics()
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.denied(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.denied(request) or await self.get_response(request)
+
+    @staticmethod
+    def denied(request):
         if request.path.startswith('/metrics'):
             auth_header = request.headers.get('Authorization')
             if not auth_header or not auth_header.startswith('Bearer ' + METRICS_ACCESS_TOKEN):
                 return HttpResponseForbidden("Access denied.")
+        return None
 
-        return self.get_response(request)
-
-
-class AdminLoginRequiredMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
 
+class AdminLoginRequiredMiddleware(AsyncCapableMiddleware):
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
         if request.path.startswith('/admin') and not request.user.is_authenticated:
             return HttpResponseRedirect('/')
         return self.get_response(request)
+
+    async def __acall__(self, request):
+        # request.user would load the session synchronously in the event loop
+        if request.path.startswith('/admin') and not (await request.auser()).is_authenticated:
+            return HttpResponseRedirect('/')
+        return await self.get_response(request)
+
+
+class QueryInspectorMiddleware(AsyncCapableMiddleware):
+    """
+    Records SQL statements of every request: exports per-view query histograms,
+    logs repeated statement shapes (N+1) with the template line / code that ran them
+    and checks budgets declared with conf.queries.query_budget.
+    """
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.QUERY_INSPECTOR_ENABLED:
+            return self.get_response(request)
+
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        return self.inspect(request, response, recorder)
+
+    async def __acall__(self, request):
+        if not settings.QUERY_INSPECTOR_ENABLED:
+            return await self.get_response(request)
+
+        async with arecord_queries() as recorder:
+            response = await self.get_response(request)
+        return self.inspect(request, response, recorder)
+
+    @staticmethod
+    def inspect(request, response, recorder):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        REQUEST_QUERIES.labels(view).observe(recorder.count)
+        REQUEST_QUERY_SECONDS.labels(view).observe(recorder.duration)
+        if settings.QUERY_INSPECTOR_HEADER:
+            response['X-Query-Count'] = str(recorder.count)
+
+        if recorder.repeated():
+            REPEATED_QUERIES.labels(view).inc()
+            logger.warning('Possible N+1 in %s %s:\n%s', view, request.path, recorder.report())
+
+        budget = getattr(match.func, 'query_budget', None) if match else None
+        if budget is not None and recorder.count > budget:
+            message = f'{view} ran {recorder.count} queries, budget is {budget}:\n{recorder.report()}'
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
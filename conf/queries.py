@@ -0,0 +1,121 @@
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+from prometheus_client import Counter as MetricCounter, Histogram
+
+REQUEST_QUERIES = Histogram(
+    'django_http_request_queries_by_view',
+    'Number of SQL queries executed per request, by view.',
+    ['view'],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 200, 500, float('inf')),
+)
+REQUEST_QUERY_SECONDS = Histogram(
+    'django_http_request_query_seconds_by_view',
+    'Time spent in SQL queries per request, by view.',
+    ['view'],
+)
+REPEATED_QUERIES = MetricCounter(
+    'django_http_request_repeated_queries_total',
+    'Requests where one SQL statement shape repeated often enough to look like N+1, by view.',
+    ['view'],
+)
+
+# "IN (%s, %s, %s)" of any length is the same statement shape
+IN_LIST = re.compile(r'\((?:\s*%s\s*,)*\s*%s\s*\)')
+PROJECT_DIR = str(settings.BASE_DIR)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries):
+    # declares how many queries a view may run, checked by QueryInspectorMiddleware
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def statement_shape(sql):
+    return IN_LIST.sub('(...)', sql)
+
+
+def query_origin():
+    # innermost template line and project code frame that triggered the current query
+    template, code = None, None
+    frame = sys._getframe(2)
+    while frame is not None and (template is None or code is None):
+        if template is None and frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            if isinstance(node, Node) and getattr(node, 'origin', None) and getattr(node, 'token', None):
+                template = f'{node.origin.template_name}:{node.token.lineno}'
+        filename = frame.f_code.co_filename
+        if code is None and filename.startswith(PROJECT_DIR) and filename != __file__ and 'site-packages' not in filename:
+            code = f'{filename[len(PROJECT_DIR) + 1:]}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return ', '.join(part for part in (template, code) if part) or 'unknown'
+
+
+class QueryRecorder:
+    """
+    connection.execute_wrapper() callable that records every statement of a request.
+    The origin is looked up once per shape, when the shape reaches the repeat threshold,
+    so recording stays cheap for well-behaved requests.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold or settings.QUERY_INSPECTOR_REPEAT_THRESHOLD
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            shape = statement_shape(sql)
+            self.shapes[shape] += 1
+            if self.shapes[shape] == self.threshold:
+                self.origins[shape] = query_origin()
+
+    def repeated(self):
+        # [(shape, times, origin)] for shapes that look like N+1
+        return [
+            (shape, times, self.origins.get(shape, 'unknown'))
+            for shape, times in self.shapes.most_common()
+            if times >= self.threshold
+        ]
+
+    def report(self):
+        return '\n'.join(f'{times}x {shape}\n    from {origin}' for shape, times, origin in self.repeated())
+
+
+@contextmanager
+def record_queries(using='default', threshold=None):
+    recorder = QueryRecorder(threshold)
+    with connections[using].execute_wrapper(recorder):
+        yield recorder
+
+
+@asynccontextmanager
+async def arecord_queries(using='default', threshold=None):
+    # the async ORM runs queries in the request's sync thread (sync_to_async),
+    # so the recorder goes on the connection of that thread, not of the event loop
+    recorder = QueryRecorder(threshold)
+    await sync_to_async(lambda: connections[using].execute_wrappers.append(recorder))()
+    try:
+        yield recorder
+    finally:
+        await sync_to_async(lambda: connections[using].execute_wrappers.remove(recorder))()
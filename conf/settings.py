@@ -71,6 +71,9 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
 }
 
+# operations accepted by one request to api/me/batch/
+API_BATCH_MAX_OPERATIONS = int(os.getenv('API_BATCH_MAX_OPERATIONS', 500))
+
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
         'Bearer': {
@@ -90,6 +93,7 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 MIDDLEWARE = [
     'django_prometheus.middleware.PrometheusBeforeMiddleware',
     'conf.middleware.MetricsTokenAuthMiddleware',
+    'conf.middleware.QueryInspectorMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -140,10 +144,55 @@ else:
             'USER': os.getenv('DB_USER'),
             'PASSWORD': os.getenv('DB_PASSWORD'),
             'HOST': os.getenv('DB_HOST'),
-            'PORT': os.getenv('DB_PORT')
+            'PORT': os.getenv('DB_PORT'),
+            # seconds a worker keeps its connection between requests (0 closes it after each one),
+            # checked before reuse so a dropped connection doesn't fail the next request
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.getenv('DB_POOL', 'False') == 'True':
+        # psycopg 3 pool in every worker process (Django 5.1), replaces persistent connections;
+        # for threaded and ASGI workers, where one process serves many requests at once;
+        # CONN_HEALTH_CHECKS makes the pool check connections before handing them out
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+                # seconds a request waits for a free connection before failing
+                'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+                'max_idle': 300,
+            },
+        }
+    elif os.getenv('ASYNC_VIEWS', 'False') == 'True':
+        # ASGI workers run the ORM in a thread per request, a persistent connection would stay
+        # open for each of those threads; without the pool, close it after every request
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    # in-process stand-in for development and tests
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         }
     }
 
+# lifetime of cached pages and fragments, they are invalidated by version anyway (movies.cache)
+PAGE_CACHE_TIMEOUT = int(os.getenv('PAGE_CACHE_TIMEOUT', 60 * 60))
+# votes refresh the cached catalog pages at most once per this many seconds (0: on every vote)
+CATALOG_RATINGS_REFRESH = int(os.getenv('CATALOG_RATINGS_REFRESH', 60))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -181,10 +230,33 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
+# static build mode: content-hashed names from a manifest plus .gz/.br copies for nginx,
+# pages need `collectstatic` to have run (docker-compose turns it on)
+STATIC_MANIFEST = (os.getenv('STATIC_MANIFEST', 'False') == 'True')
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'conf.storage.CompressedManifestStaticFilesStorage' if STATIC_MANIFEST
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# resized copies of uploaded images for srcset (movies.images), never wider than the original
+IMAGE_DERIVATIVE_WIDTHS = [160, 320, 640, 1280]
+# avif is skipped when Pillow can't encode it, jpeg is the <img> fallback
+IMAGE_DERIVATIVE_FORMATS = ['avif', 'webp', 'jpeg']
+IMAGE_DERIVATIVE_QUALITY = int(os.getenv('IMAGE_DERIVATIVE_QUALITY', 80))
+# threads generating derivatives after uploads, 0 generates them inside the request
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 2))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -203,10 +275,59 @@ else:
 
 METRICS_ACCESS_TOKEN = os.getenv('METRICS_ACCESS_TOKEN')
 
+# SQL query inspection per request (conf.middleware.QueryInspectorMiddleware)
+QUERY_INSPECTOR_ENABLED = (os.getenv('QUERY_INSPECTOR_ENABLED', 'True') == 'True')
+# same statement shape repeated this many times in one request is reported as N+1
+QUERY_INSPECTOR_REPEAT_THRESHOLD = int(os.getenv('QUERY_INSPECTOR_REPEAT_THRESHOLD', 5))
+# X-Query-Count response header, handy for load tests, off in production
+QUERY_INSPECTOR_HEADER = (os.getenv('QUERY_INSPECTOR_HEADER', str(DEBUG)) == 'True')
+# raise instead of logging when a view exceeds its query budget (the test runner turns it on)
+QUERY_BUDGET_STRICT = False
+TEST_RUNNER = 'conf.testing.QueryBudgetTestRunner'
+
+# async rate/favorite endpoints, for ASGI deployments (uvicorn workers)
+ASYNC_VIEWS = (os.getenv('ASYNC_VIEWS', 'False') == 'True')
+
+# "direct": votes are written by the request, "queue": appended to RATING_QUEUE_PATH and
+# written in batches by `manage.py flush_ratings --loop` (movies.ingest)
+RATING_INGEST_MODE = os.getenv('RATING_INGEST_MODE', 'direct')
+RATING_QUEUE_PATH = os.getenv('RATING_QUEUE_PATH', BASE_DIR / 'rating_queue.sqlite3')
+RATING_FLUSH_BATCH_SIZE = int(os.getenv('RATING_FLUSH_BATCH_SIZE', 5000))
+RATING_FLUSH_INTERVAL = float(os.getenv('RATING_FLUSH_INTERVAL', 1.0))
+
+# activity audit log (users.activity): events are queued in the process and written in batches
+# by a background thread; False saves each event in the request
+ACTIVITY_LOG_ASYNC = (os.getenv('ACTIVITY_LOG_ASYNC', 'True') == 'True')
+ACTIVITY_QUEUE_SIZE = int(os.getenv('ACTIVITY_QUEUE_SIZE', 10000))
+ACTIVITY_BATCH_SIZE = int(os.getenv('ACTIVITY_BATCH_SIZE', 500))
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', 1.0))
+# events older than this are deleted by `manage.py prune_activity`
+ACTIVITY_RETENTION_DAYS = int(os.getenv('ACTIVITY_RETENTION_DAYS', 90))
+
+# "Top 250" leaderboard: minimum votes to be ranked (also the weight of the global prior)
+TOP_MOVIES_MIN_VOTES = int(os.getenv('TOP_MOVIES_MIN_VOTES', 3))
+
 LOGS_DIR = os.path.join(BASE_DIR, 'logs')
 if not os.path.exists(LOGS_DIR):
     os.makedirs(LOGS_DIR)
 
+
+def queued_file_handler(filename, level='DEBUG'):
+    # JSON lines in logs/<filename>, written by a background thread (conf.logging.QueuedHandler)
+    return {
+        '()': 'conf.logging.QueuedHandler',
+        'level': level,
+        'formatter': 'json',
+        'handler': {
+            'class': 'logging.handlers.TimedRotatingFileHandler',
+            'filename': os.path.join(BASE_DIR, 'logs', filename),
+            'when': 'midnight',
+            'interval': 1,
+            'backupCount': 7,
+        },
+    }
+
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -219,6 +340,16 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'conf.logging.JsonFormatter',
+        },
+    },
+    'filters': {
+        # per-request permission/queryset events of the API, only a share of them is written
+        'sample_api_access': {
+            '()': 'conf.logging.SamplingFilter',
+            'rate': float(os.getenv('API_ACCESS_LOG_SAMPLE_RATE', 0.1)),
+        },
     },
     'handlers': {
         'console': {
@@ -226,56 +357,17 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'verbose',
         },
-        'file_django': {
-            'level': 'DEBUG',
-            'class': 'logging.handlers.TimedRotatingFileHandler',
-            'filename': os.path.join(BASE_DIR, 'logs', 'django.log'),
-            'formatter': 'verbose',
-            'when': 'midnight',
-            'interval': 1,
-            'backupCount': 7,
-        },
-        'file_request': {
-            'level': 'DEBUG',
-            'class': 'logging.handlers.TimedRotatingFileHandler',
-            'filename': os.path.join(BASE_DIR, 'logs', 'django_request.log'),
-            'formatter': 'verbose',
-            'when': 'midnight',
-            'interval': 1,
-            'backupCount': 7,
-        },
-        'file_prometheus': {
-            'level': 'DEBUG',
-            'class': 'logging.handlers.TimedRotatingFileHandler',
-            'filename': os.path.join(BASE_DIR, 'logs', 'django_prometheus.log'),
-            'formatter': 'verbose',
-            'when': 'midnight',
-            'interval': 1,
-            'backupCount': 7,
-        },
-        'file_user_activity': {
-            'level': 'INFO',
-            'class': 'logging.handlers.TimedRotatingFileHandler',
-            'filename': os.path.join(BASE_DIR, 'logs', 'user_activity.log'),
-            'formatter': 'verbose',
-            'when': 'midnight',
-            'interval': 1,
-            'backupCount': 7,
-        },
-        'file_API_log': {
-            'level': 'INFO',
-            'class': 'logging.handlers.TimedRotatingFileHandler',
-            'filename': os.path.join(BASE_DIR, 'logs', 'API_activity.log'),
-            'formatter': 'verbose',
-            'when': 'midnight',
-            'interval': 1,
-            'backupCount': 7,
-        },
+        'file_django': queued_file_handler('django.log'),
+        'file_request': queued_file_handler('django_request.log'),
+        'file_prometheus': queued_file_handler('django_prometheus.log'),
+        'file_user_activity': queued_file_handler('user_activity.log', 'INFO'),
+        'file_API_log': queued_file_handler('API_activity.log', 'INFO'),
     },
     'loggers': {
         'django': {
             'handlers': ['file_django'],
-            'level': 'DEBUG',
+            # DEBUG logs every SQL statement while DEBUG is on
+            'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
             'propagate': True,
         },
         'django.request': {
@@ -298,5 +390,14 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'API_log.access': {
+            'level': 'INFO',
+            'filters': ['sample_api_access'],
+        },
+        'query_inspector': {
+            'handlers': ['file_django'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
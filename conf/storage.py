@@ -0,0 +1,51 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:  # .br copies are skipped, nginx falls back to the .gz ones
+    brotli = None
+
+# text formats worth compressing, images and fonts are compressed already
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico'}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Manifest storage (content-hashed names, cacheable forever) that also writes .gz and .br
+    copies of the hashed text files during collectstatic, so nginx serves them with
+    gzip_static/brotli_static instead of compressing every response.
+    """
+
+    # copies that don't save at least this share of the original are left out
+    min_saving = 0.05
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for hashed_name in sorted(hashed_names):
+            if os.path.splitext(hashed_name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                self.compress(hashed_name)
+
+    def compress(self, name):
+        with self.open(name) as original:
+            content = original.read()
+        # mtime=0 keeps the .gz byte-identical between builds
+        variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(content, quality=11)
+        for suffix, compressed in variants.items():
+            path = self.path(name + suffix)
+            if len(compressed) > len(content) * (1 - self.min_saving):
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            with open(path, 'wb') as output:
+                output.write(compressed)
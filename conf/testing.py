@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+from conf.queries import record_queries
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    # views that declare a query budget fail the test run instead of just logging
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUERY_BUDGET_STRICT = True
+        # test transactions aren't visible to the background writer's connection
+        settings.ACTIVITY_LOG_ASYNC = False
+
+
+class QueryInspectorMixin:
+    """TestCase mixin to catch N+1 patterns in views."""
+
+    def assertNoRepeatedQueries(self, func, *args, threshold=None, **kwargs):
+        with record_queries(threshold=threshold) as recorder:
+            result = func(*args, **kwargs)
+        if recorder.repeated():
+            self.fail(f'Repeated queries (possible N+1):\n{recorder.report()}')
+        return result
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Movie, Genre, Review, Rating, UserMovieList, MovieImage
+from .models import Movie, Genre, Review, Rating, UserMovieList, MovieImage, TopMovie, Favorite
 
 
 # Inline for additional movie images
@@ -12,15 +12,16 @@ class MovieImageInline(admin.TabularInline):  # Use admin.StackedInline for vert
 
 @admin.register(Movie)
 class MovieAdmin(admin.ModelAdmin):
-    list_display = ['title', 'release_date', 'is_highlight', 'duration']
+    list_display = ['title', 'release_date', 'is_highlight', 'duration', 'rating_avg', 'rating_count']
+    readonly_fields = ['rating_sum', 'rating_count', 'rating_avg', 'votes_1', 'votes_2', 'votes_3', 'votes_4', 'votes_5']
     list_filter = ['release_date', 'is_highlight', 'genres']
-    search_fields = ['title', 'description']
+    search_fields = ['title', 'description', 'external_id']
     inlines = [MovieImageInline]
 
 
 @admin.register(Genre)
 class GenreAdmin(admin.ModelAdmin):
-    list_display = ['name']
+    list_display = ['name', 'bit']
 
 
 @admin.register(Review)
@@ -39,6 +40,12 @@ class RatingAdmin(admin.ModelAdmin):
     autocomplete_fields = ['movie', 'user']
 
 
+@admin.register(TopMovie)
+class TopMovieAdmin(admin.ModelAdmin):
+    list_display = ['movie', 'score']
+    list_select_related = ['movie']
+
+
 @admin.register(UserMovieList)
 class UserMovieListAdmin(admin.ModelAdmin):
     list_display = ['user', 'name']
@@ -48,3 +55,10 @@ class UserMovieListAdmin(admin.ModelAdmin):
 
     # Inline movies in user movie list (optional)
     filter_horizontal = ['movies']
+
+
+@admin.register(Favorite)
+class FavoriteAdmin(admin.ModelAdmin):
+    list_display = ['user', 'movie', 'created_at']
+    search_fields = ['user__username', 'movie__title']
+    autocomplete_fields = ['user', 'movie']
@@ -0,0 +1,55 @@
+from django.db import transaction
+
+from .cache import favorites_namespace, invalidate
+from .ingest import upsert_votes
+from .models import Favorite, Movie, Rating
+from .ratings import shift_votes
+
+OPERATIONS = ['rate', 'unrate', 'favorite', 'unfavorite']
+# what an operation sets; of several operations on the same state of a movie the last one wins
+TARGETS = {'rate': 'rating', 'unrate': 'rating', 'favorite': 'favorite', 'unfavorite': 'favorite'}
+
+
+def apply_batch(user, operations):
+    """
+    Applies a user's operations [{'op', 'movie', 'value'}] in one transaction and returns
+    a status per operation: 'ok', 'not_found' (no such movie) or 'superseded' (a later
+    operation of the batch sets the same rating or favorite). Movies are checked with one
+    IN query, votes and favorites are written in bulk.
+    """
+    found = set(Movie.objects.filter(pk__in={op['movie'] for op in operations}).values_list('pk', flat=True))
+    statuses = []
+    latest = {}
+    for index, op in enumerate(operations):
+        statuses.append('ok' if op['movie'] in found else 'not_found')
+        if op['movie'] in found:
+            key = (TARGETS[op['op']], op['movie'])
+            if key in latest:
+                statuses[latest[key]] = 'superseded'
+            latest[key] = index
+    applied = [operations[index] for index in latest.values()]
+
+    def movies(name):
+        return [op['movie'] for op in applied if op['op'] == name]
+
+    with transaction.atomic():
+        unrated = movies('unrate')
+        _, deltas = upsert_votes(
+            {(user.pk, op['movie']): op['value'] for op in applied if op['op'] == 'rate'}, also_lock=unrated,
+        )
+        if unrated:
+            # one grouped read and one DELETE; the deltas of the removed votes join those of the upsert
+            _, removed = Rating.objects.filter(user=user, movie_id__in=unrated).delete_votes()
+            for movie_id, delta in removed.items():
+                deltas[movie_id].update(delta)
+        # one UPDATE per movie, one leaderboard callback and one cache bump for the whole batch
+        shift_votes(deltas)
+        Favorite.objects.bulk_create(
+            [Favorite(user=user, movie_id=movie_id) for movie_id in movies('favorite')], ignore_conflicts=True,
+        )
+        unfavorited = movies('unfavorite')
+        if unfavorited:
+            Favorite.objects.filter(user=user, movie_id__in=unfavorited).delete()
+    if movies('favorite') or unfavorited:
+        invalidate(favorites_namespace(user.pk))
+    return statuses
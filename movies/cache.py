@@ -0,0 +1,166 @@
+import hashlib
+from functools import wraps
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import HttpResponse, QueryDict
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+# namespaces of cached page data, each invalidated on its own
+HIGHLIGHTS = 'highlights'
+LEADERBOARD = 'leaderboard'
+CATALOG = 'catalog'
+# catalog data that follows the rating aggregates (cards, rating sort and filters),
+# bumped by votes through invalidate_throttled()
+CATALOG_RATINGS = 'catalog:ratings'
+
+
+def movie_namespace(movie_id):
+    return f'movie:{movie_id}'
+
+
+def favorites_namespace(user_id):
+    # no cached data lives here, its version only feeds the ETags of pages showing the user's favorites
+    return f'favorites:{user_id}'
+
+
+def version_key(namespace):
+    return f'version:{namespace}'
+
+
+def throttle_key(namespace):
+    return f'throttle:{namespace}'
+
+
+def pending_key(namespace):
+    return f'pending:{namespace}'
+
+
+def versions(*namespaces):
+    """
+    {namespace: current version} in one cache round trip. Versions are random tokens, not
+    counters, so a version evicted from the cache can never make old entries current again.
+    """
+    keys = {version_key(namespace): namespace for namespace in namespaces}
+    pending = {pending_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many([*keys, *pending])
+    for key, namespace in pending.items():
+        # a change held back by invalidate_throttled() is applied once its interval is over
+        interval = found.pop(key, None)
+        if interval is not None and cache.add(throttle_key(namespace), 1, interval):
+            cache.delete(key)
+            found[version_key(namespace)] = uuid4().hex
+            cache.set(version_key(namespace), found[version_key(namespace)], None)
+    for key in keys.keys() - found.keys():
+        cache.add(key, uuid4().hex, None)
+        found[key] = cache.get(key)
+    return {keys[key]: version for key, version in found.items()}
+
+
+def invalidate(*namespaces):
+    # bumped right away and once more after commit, so a request that read the old rows
+    # while the transaction was open can't keep them cached under the new version
+    def bump():
+        cache.set_many({version_key(namespace): uuid4().hex for namespace in namespaces}, None)
+
+    bump()
+    if connection.in_atomic_block:
+        transaction.on_commit(bump)
+
+
+def invalidate_throttled(namespace, interval):
+    """
+    invalidate() for frequent changes that may show a little late: the namespace is bumped
+    at most once per `interval` seconds. A change within the interval is marked pending
+    (after commit) and the first versions() call after the interval bumps it, so no change
+    stays hidden for longer than that.
+    """
+    if interval <= 0 or cache.add(throttle_key(namespace), 1, interval):
+        invalidate(namespace)
+        return
+
+    def mark():
+        cache.set(pending_key(namespace), interval, None)
+
+    if connection.in_atomic_block:
+        transaction.on_commit(mark)
+    else:
+        mark()
+
+
+def normalized_query(params, ignore=()):
+    # same filters in any order or with blank values give the same key
+    normalized = QueryDict(mutable=True)
+    for name in sorted(params):
+        if name in ignore:
+            continue
+        values = sorted(value.strip() for value in params.getlist(name) if value.strip())
+        if values:
+            normalized.setlist(name, values)
+    return normalized.urlencode()
+
+
+def cached(namespace, key, compute, timeout=None):
+    # compute() result stored under the namespace version, recomputed after invalidate(namespace);
+    # a tuple of namespaces makes it follow each of them
+    namespaces = namespace if isinstance(namespace, tuple) else (namespace,)
+    current = versions(*namespaces)
+    prefix = ':'.join(f'{name}:{current[name]}' for name in namespaces)
+    cache_key = f'{prefix}:{hashlib.md5(key.encode()).hexdigest()}'
+    value = cache.get(cache_key)
+    if value is None:
+        value = compute()
+        cache.set(cache_key, value, settings.PAGE_CACHE_TIMEOUT if timeout is None else timeout)
+    return value
+
+
+def fragment_context(**namespaces):
+    # template context for {% cache cache_timeout <fragment> cache_versions.<name> %}
+    current = versions(*namespaces.values())
+    return {
+        'cache_timeout': settings.PAGE_CACHE_TIMEOUT,
+        'cache_versions': {name: current[namespace] for name, namespace in namespaces.items()},
+    }
+
+
+def conditional_page(stamp):
+    """
+    View decorator for conditional GETs. stamp(request, *args, **kwargs) returns
+    (etag parts, last modified datetime or None) from cheap lookups such as cache versions,
+    or (None, None) to let the view answer. A client already holding that version gets
+    304 Not Modified before the view runs its queries or renders anything.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            parts, last_modified = stamp(request, *args, **kwargs)
+            if parts is None:
+                return view(request, *args, **kwargs)
+            user = request.user
+            # pending flash messages are rendered once, those pages must not match any earlier one
+            parts = [*parts, user.pk, len(get_messages(request))]
+            headers = HttpResponse()
+            headers['ETag'] = quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+            if timestamp is not None:
+                headers['Last-Modified'] = http_date(timestamp)
+            # pages differ per user: browsers may keep them, but have to revalidate every time
+            patch_cache_control(headers, private=True, no_cache=True)
+            # answers 304/412 itself, hands back the headers-only response when the view has to run
+            response = get_conditional_response(
+                request, etag=headers['ETag'], last_modified=timestamp, response=headers,
+            )
+            if response is headers:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    for name, value in headers.items():
+                        response.headers.setdefault(name, value)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,34 @@
+from asgiref.sync import sync_to_async
+
+from .cache import favorites_namespace, invalidate
+from .models import Favorite
+
+
+def is_favorite(user, movie_id):
+    return user.is_authenticated and Favorite.objects.filter(user=user, movie_id=movie_id).exists()
+
+
+def favorite_ids(user, movie_ids):
+    # which of the given movies the user has favorited, one query for a whole page of cards
+    movie_ids = list(movie_ids)
+    if not user.is_authenticated or not movie_ids:
+        return set()
+    return set(Favorite.objects.filter(user=user, movie_id__in=movie_ids).values_list('movie_id', flat=True))
+
+
+def toggle_favorite(user, movie_id):
+    # returns True when the movie was added; the unique index makes double clicks harmless
+    deleted, _ = Favorite.objects.filter(user=user, movie_id=movie_id).delete()
+    if not deleted:
+        Favorite.objects.get_or_create(user=user, movie_id=movie_id)
+    invalidate(favorites_namespace(user.pk))
+    return not deleted
+
+
+async def atoggle_favorite(user, movie_id):
+    deleted, _ = await Favorite.objects.filter(user=user, movie_id=movie_id).adelete()
+    if not deleted:
+        await Favorite.objects.aget_or_create(user=user, movie_id=movie_id)
+    # the cache client blocks, keep it out of the event loop
+    await sync_to_async(invalidate)(favorites_namespace(user.pk))
+    return not deleted
@@ -0,0 +1,40 @@
+from django.db.models import F, Sum
+from django.utils.timezone import now
+
+from .models import Movie
+
+
+def update_genre_masks(movie_ids):
+    # recalculates Movie.genre_mask from the genres m2m table
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return
+    masks = dict.fromkeys(movie_ids, 0)
+    links = Movie.genres.through.objects.filter(movie_id__in=movie_ids).values_list('movie_id', 'genre__bit')
+    for movie_id, bit in links:
+        masks[movie_id] |= 1 << bit
+    changed_at = now()
+    movies = [Movie(pk=movie_id, genre_mask=mask, updated_at=changed_at) for movie_id, mask in masks.items()]
+    Movie.objects.bulk_update(movies, ['genre_mask', 'updated_at'], batch_size=1000)
+
+
+def filter_by_genres(queryset, genres, match_all=False):
+    # bitwise check on Movie.genre_mask instead of a join through the m2m table
+    mask = 0
+    for genre in genres:
+        mask |= genre.mask
+    if not mask:
+        return queryset
+    queryset = queryset.alias(genre_hits=F('genre_mask').bitand(mask))
+    return queryset.filter(genre_hits=mask) if match_all else queryset.filter(genre_hits__gt=0)
+
+
+def genre_facets(queryset, genres):
+    # {genre id: movies of the queryset in that genre}, counted in a single aggregate query
+    genres = list(genres)
+    if not genres:
+        return {}
+    counts = queryset.order_by().aggregate(**{
+        f'genre_{genre.pk}': Sum(F('genre_mask').bitrightshift(genre.bit).bitand(1)) for genre in genres
+    })
+    return {genre.pk: counts[f'genre_{genre.pk}'] or 0 for genre in genres}
@@ -0,0 +1,134 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+from .cache import CATALOG, HIGHLIGHTS, LEADERBOARD, invalidate, movie_namespace
+from .models import Movie, MovieImage
+
+logger = logging.getLogger(__name__)
+
+# format: (Pillow encoder, mime type, file extension)
+FORMATS = {
+    'avif': ('AVIF', 'image/avif', 'avif'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+}
+DERIVATIVES_DIR = 'derivatives'
+
+_executor = None
+
+
+def available_formats():
+    Image.init()
+    return [fmt for fmt in settings.IMAGE_DERIVATIVE_FORMATS if FORMATS[fmt][0] in Image.SAVE]
+
+
+def derivative_widths(width):
+    # configured widths below the original, the original width when it is smaller than all of them
+    return [size for size in settings.IMAGE_DERIVATIVE_WIDTHS if size < width] or [width]
+
+
+def encode(image, fmt, width):
+    encoder = FORMATS[fmt][0]
+    resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+    if encoder == 'JPEG' and resized.mode != 'RGB':
+        resized = resized.convert('RGB')
+    buffer = io.BytesIO()
+    resized.save(buffer, encoder, quality=settings.IMAGE_DERIVATIVE_QUALITY)
+    return buffer.getvalue()
+
+
+def build_derivatives(storage, name):
+    """
+    Writes resized copies of the stored image `name` and returns
+    {'source': name, format: [[width, derivative name], ...]}. Names are derived from the
+    content hash, so they never change for the same picture and can be cached forever;
+    copies that already exist are reused.
+    """
+    with storage.open(name, 'rb') as source:
+        data = source.read()
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    derivatives = {'source': name}
+    for fmt in available_formats():
+        entries = []
+        for width in derivative_widths(image.width):
+            path = f'{DERIVATIVES_DIR}/{digest[:2]}/{digest}-{width}.{FORMATS[fmt][2]}'
+            if not storage.exists(path):
+                path = storage.save(path, ContentFile(encode(image, fmt, width)))
+            entries.append([width, path])
+        derivatives[fmt] = entries
+    return derivatives
+
+
+def current_derivatives(item):
+    # derivatives of item.image, empty while they are missing or belong to a replaced image
+    derivatives = item.image_derivatives or {}
+    return derivatives if item.image and derivatives.get('source') == item.image.name else {}
+
+
+def process_image(model, pk, name):
+    field = model._meta.get_field('image')
+    try:
+        derivatives = build_derivatives(field.storage, name)
+    except Exception:
+        logger.exception('Image derivatives of %s %s (%s) failed', model.__name__, pk, name)
+        return False
+    # the image may have been replaced meanwhile, its own job writes the newer derivatives
+    changes = {'image_derivatives': derivatives}
+    if model is Movie:
+        changes['updated_at'] = Now()
+    if not model.objects.filter(pk=pk, image=name).update(**changes):
+        return False
+    if model is Movie:
+        invalidate(HIGHLIGHTS, LEADERBOARD, CATALOG, movie_namespace(pk))
+    else:
+        invalidate(HIGHLIGHTS)
+    return True
+
+
+def _process_in_worker(model, pk, name):
+    try:
+        return process_image(model, pk, name)
+    finally:
+        # worker threads open their own connections, nothing else would close them
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.IMAGE_DERIVATIVE_WORKERS, thread_name_prefix='image-derivatives')
+    return _executor
+
+
+def schedule_derivatives(item):
+    # generates derivatives of a saved Movie/MovieImage after commit, in the worker pool when configured
+    name = item.image.name if item.image else ''
+    if not name or current_derivatives(item):
+        return
+    model, pk = type(item), item.pk
+
+    def submit():
+        if settings.IMAGE_DERIVATIVE_WORKERS:
+            get_executor().submit(_process_in_worker, model, pk, name)
+        else:
+            process_image(model, pk, name)
+
+    transaction.on_commit(submit)
+
+
+def stale_images(models=(Movie, MovieImage), force=False):
+    # (model, pk, image name) of stored images without current derivatives, all of them with force
+    for model in models:
+        rows = model.objects.exclude(image='').exclude(image=None).values_list('pk', 'image', 'image_derivatives')
+        for pk, name, derivatives in rows.iterator(chunk_size=2000):
+            if force or (derivatives or {}).get('source') != name:
+                yield model, pk, name
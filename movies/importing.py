@@ -0,0 +1,231 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from django.core.files import File
+from django.db import transaction
+
+from .cache import CATALOG, HIGHLIGHTS, LEADERBOARD, invalidate, movie_namespace
+from .images import schedule_derivatives
+from .models import Genre, Movie
+from .search import get_search_backend
+from .seeding import chunked
+
+# columns written by import_movies, everything else of a row is ignored
+MOVIE_FIELDS = ['title', 'description', 'release_date', 'duration', 'is_highlight']
+EXPORT_FIELDS = ['external_id', *MOVIE_FIELDS, 'genres', 'image',
+                 'rating_avg', 'rating_count', 'votes_1', 'votes_2', 'votes_3', 'votes_4', 'votes_5']
+# genres of a CSV row: "Sci-Fi|Action"
+GENRE_SEPARATOR = '|'
+FORMATS = ['csv', 'jsonl']
+TRUE_VALUES = {'1', 'true', 'yes', 'y'}
+GENRE_NAME_LENGTH = Genre._meta.get_field('name').max_length
+
+
+def guess_format(path):
+    return 'csv' if str(path).lower().endswith('.csv') else 'jsonl'
+
+
+def read_rows(stream, fmt):
+    # (line number, row) pairs; rows of broken JSON lines are left as text, parse_row rejects them
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, line
+
+
+class GenreMap:
+    """Genre names to Genre objects, loaded once; unknown names create the genre."""
+
+    def __init__(self):
+        self.genres = {genre.name.lower(): genre for genre in Genre.objects.all()}
+
+    def get(self, name):
+        key = name.lower()
+        if key not in self.genres:
+            self.genres[key] = Genre.objects.create(name=name)
+        return self.genres[key]
+
+
+def parse_row(row, genres):
+    # (unsaved Movie, [Genre], image file name or ''), ValueError for rows that can't be imported
+    if not isinstance(row, dict):
+        raise ValueError('expected an object with movie fields')
+    external_id = str(row.get('external_id') or '').strip()
+    if not external_id or len(external_id) > 64:
+        raise ValueError('external_id is required (up to 64 characters)')
+    title = str(row.get('title') or '').strip()
+    if not title:
+        raise ValueError('title is required')
+    try:
+        release_date = date.fromisoformat(str(row.get('release_date') or ''))
+        duration = int(row['duration']) if str(row.get('duration') or '').strip() else None
+    except (TypeError, ValueError):
+        raise ValueError('release_date must be YYYY-MM-DD and duration a number of minutes')
+    if duration is not None and duration < 0:
+        raise ValueError('duration must not be negative')
+    names = row.get('genres') or []
+    if isinstance(names, str):
+        names = names.split(GENRE_SEPARATOR)
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ValueError('genres must be a list of names')
+    names = [name.strip() for name in names if name.strip()]
+    if any(len(name) > GENRE_NAME_LENGTH for name in names):
+        raise ValueError(f'genre names are up to {GENRE_NAME_LENGTH} characters')
+    movie_genres = [genres.get(name) for name in names]
+    movie = Movie(
+        external_id=external_id,
+        title=title,
+        description=str(row.get('description') or ''),
+        release_date=release_date,
+        duration=duration,
+        is_highlight=str(row.get('is_highlight')).strip().lower() in TRUE_VALUES,
+        genre_mask=sum({genre.mask for genre in movie_genres}),
+    )
+    return movie, movie_genres, str(row.get('image') or '').strip()
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.images = 0
+        # [(line number, message)]
+        self.errors = []
+        self.seconds = 0.0
+
+    @property
+    def rows(self):
+        return self.created + self.updated
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def store_image(path, name):
+    # runs in the image worker threads, storage I/O only
+    field = Movie._meta.get_field('image')
+    with open(path, 'rb') as image_file:
+        return field.storage.save(name, File(image_file))
+
+
+def attach_images(movies, images_dir, existing, workers, result):
+    """
+    Copies the images of movies [(Movie, line, file name)] from images_dir into the media
+    storage in parallel. Files already attached under the same name are not copied again.
+    """
+    field = Movie._meta.get_field('image')
+    jobs = {}
+    with ThreadPoolExecutor(workers) as pool:
+        for movie, line, image in movies:
+            name = field.generate_filename(None, os.path.basename(image))
+            if existing.get(movie.external_id) == name and field.storage.exists(name):
+                continue
+            path = os.path.join(images_dir, image)
+            if not os.path.isfile(path):
+                result.errors.append((line, f'image {path} not found'))
+                continue
+            jobs[pool.submit(store_image, path, name)] = movie
+    for job, movie in jobs.items():
+        movie.image = job.result()
+    stored = list(jobs.values())
+    Movie.objects.bulk_update(stored, ['image'], batch_size=1000)
+    for movie in stored:
+        schedule_derivatives(movie)
+    result.images += len(stored)
+
+
+def import_batch(rows, genres, result, images_dir=None, workers=4):
+    """
+    Upserts one batch of (line, row) pairs on external_id: a single INSERT .. ON CONFLICT
+    for the movies, their genre links replaced in bulk. Rating aggregates are kept.
+    """
+    parsed = {}
+    for line, row in rows:
+        try:
+            movie, movie_genres, image = parse_row(row, genres)
+        except ValueError as error:
+            result.errors.append((line, str(error)))
+            continue
+        # a repeated external_id in one batch would hit the same row twice, the last one wins
+        parsed[movie.external_id] = (movie, movie_genres, line, image)
+    if not parsed:
+        return
+
+    existing = dict(Movie.objects.filter(external_id__in=parsed).values_list('external_id', 'image'))
+    through = Movie.genres.through
+    with transaction.atomic():
+        movies = Movie.objects.bulk_create(
+            [movie for movie, *_ in parsed.values()],
+            update_conflicts=True,
+            unique_fields=['external_id'],
+            update_fields=[*MOVIE_FIELDS, 'genre_mask', 'updated_at'],
+        )
+        movie_ids = [movie.pk for movie in movies]
+        through.objects.filter(movie_id__in=movie_ids).delete()
+        through.objects.bulk_create([
+            through(movie_id=movie.pk, genre_id=genre.pk)
+            for movie, movie_genres, *_ in parsed.values() for genre in set(movie_genres)
+        ])
+    result.updated += len(existing)
+    result.created += len(parsed) - len(existing)
+
+    with_images = [(movie, line, image) for movie, _, line, image in parsed.values() if image]
+    if with_images and images_dir:
+        attach_images(with_images, images_dir, existing, workers, result)
+
+    # bulk writes skip the Movie signals
+    get_search_backend().index(movie_ids)
+    invalidate(HIGHLIGHTS, LEADERBOARD, CATALOG, *[movie_namespace(movie_id) for movie_id in movie_ids])
+
+
+def import_movies(stream, fmt, images_dir=None, batch_size=1000, workers=4, progress=None):
+    # streams the file in batches, memory use doesn't grow with the file
+    result = ImportResult()
+    genres = GenreMap()
+    start = time.perf_counter()
+    for batch in chunked(read_rows(stream, fmt), batch_size):
+        import_batch(batch, genres, result, images_dir, workers)
+        result.seconds = time.perf_counter() - start
+        if progress:
+            progress(result)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def export_rows(queryset=None, chunk_size=2000):
+    # catalog rows with rating aggregates, genres decoded from genre_mask instead of joined
+    queryset = Movie.objects.all() if queryset is None else queryset
+    genre_names = {genre.bit: genre.name for genre in Genre.objects.all()}
+    columns = [field for field in EXPORT_FIELDS if field != 'genres'] + ['genre_mask']
+    for row in queryset.order_by('pk').values(*columns).iterator(chunk_size=chunk_size):
+        mask = row.pop('genre_mask')
+        row['genres'] = [name for bit, name in sorted(genre_names.items()) if mask >> bit & 1]
+        yield row
+
+
+def write_rows(rows, stream, fmt):
+    # returns number of written rows
+    written = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, EXPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, 'genres': GENRE_SEPARATOR.join(row['genres'])})
+            written += 1
+        return written
+    for row in rows:
+        stream.write(json.dumps({field: row[field] for field in EXPORT_FIELDS}, default=str) + '\n')
+        written += 1
+    return written
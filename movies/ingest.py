@@ -0,0 +1,171 @@
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .models import Movie, Rating
+from .ratings import lock_movies, rating_delta, shift_votes
+
+
+class RatingQueue:
+    """
+    Durable append-only vote log in its own SQLite file (WAL mode, so appends from all
+    web workers of the host don't wait for the flusher reading it). Votes stay there until
+    a flush has committed them to the main database.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        if not hasattr(self.local, 'connection'):
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS votes ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, movie_id INTEGER NOT NULL, '
+                'value INTEGER NOT NULL, queued_at REAL NOT NULL)'
+            )
+            self.local.connection = connection
+        return self.local.connection
+
+    def append(self, user_id, movie_id, value):
+        self.connection.execute(
+            'INSERT INTO votes (user_id, movie_id, value, queued_at) VALUES (?, ?, ?, ?)',
+            (user_id, movie_id, value, time.time()),
+        )
+
+    def peek(self, limit):
+        # oldest votes first: [(id, user_id, movie_id, value, queued_at)]
+        return self.connection.execute('SELECT * FROM votes ORDER BY id LIMIT ?', (limit,)).fetchall()
+
+    def ack(self, last_id):
+        self.connection.execute('DELETE FROM votes WHERE id <= ?', (last_id,))
+
+    def backlog(self):
+        # (pending votes, seconds the oldest one has waited)
+        pending, oldest = self.connection.execute('SELECT COUNT(*), MIN(queued_at) FROM votes').fetchone()
+        return pending, time.time() - oldest if oldest else 0.0
+
+
+_queues = {}
+
+
+def get_rating_queue():
+    path = str(settings.RATING_QUEUE_PATH)
+    if path not in _queues:
+        _queues[path] = RatingQueue(path)
+    return _queues[path]
+
+
+def queue_rating(user, movie_id, value):
+    # write-behind mode of record_rating: the movie is checked when the vote is flushed
+    get_rating_queue().append(user.pk, movie_id, value)
+
+
+def coalesce(rows):
+    # last vote per (user, movie) wins, rows come in queue order
+    return {(user_id, movie_id): value for _, user_id, movie_id, value, _ in rows}
+
+
+def apply_votes(votes):
+    """
+    Writes {(user_id, movie_id): value} with a batched upsert and shifts
+    the aggregates of each touched movie once. Votes of deleted users or movies are dropped.
+    Returns the number of ratings written.
+    """
+    user_ids = {user_id for user_id, _ in votes}
+    movie_ids = {movie_id for _, movie_id in votes}
+    live_users = set(get_user_model().objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    live_movies = set(Movie.objects.filter(pk__in=movie_ids).values_list('pk', flat=True))
+    return write_votes({
+        (user_id, movie_id): value for (user_id, movie_id), value in votes.items()
+        if user_id in live_users and movie_id in live_movies
+    })
+
+
+def write_votes(votes):
+    # apply_votes for votes of existing users and movies
+    if not votes:
+        return 0
+    with transaction.atomic():
+        written, deltas = upsert_votes(votes)
+        shift_votes(deltas)
+    return written
+
+
+def upsert_votes(votes, also_lock=()):
+    """
+    Writes {(user_id, movie_id): value} with one upsert and returns (written ratings,
+    {movie_id: aggregate delta}); the caller shifts the aggregates (shift_votes). Run it
+    inside a transaction, the movies stay locked until the aggregates follow. `also_lock`
+    are movies whose votes the caller changes otherwise, locked in the same id order.
+    """
+    user_ids = {user_id for user_id, _ in votes}
+    movie_ids = {movie_id for _, movie_id in votes}
+    # previous values are still read, the aggregates need them; under the movie locks a
+    # concurrent writer can't insert one of these votes before the upsert below
+    lock_movies(movie_ids | set(also_lock))
+    existing = {
+        (rating.user_id, rating.movie_id): rating
+        for rating in Rating.objects.select_for_update().filter(
+            user_id__in=user_ids, movie_id__in=movie_ids
+        ).only('user_id', 'movie_id', 'value')
+    }
+    ratings = []
+    deltas = defaultdict(Counter)
+    for (user_id, movie_id), value in votes.items():
+        rating = existing.get((user_id, movie_id))
+        old_value = rating.value if rating else None
+        if old_value == value:
+            continue
+        # update() keeps the negative counts that Counter's + would drop
+        deltas[movie_id].update(rating_delta(old_value, value))
+        ratings.append(Rating(user_id=user_id, movie_id=movie_id, value=value))
+
+    # one upsert for new and changed votes; bulk writes skip the Rating signals,
+    # so aggregates are shifted by the caller instead
+    Rating.objects.bulk_create(
+        ratings,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['user', 'movie'],
+        update_fields=['value'],
+    )
+    return len(ratings), deltas
+
+
+class FlushResult:
+    def __init__(self, queued=0, coalesced=0, written=0, seconds=0.0, max_staleness=0.0):
+        self.queued = queued
+        self.coalesced = coalesced
+        self.written = written
+        self.seconds = seconds
+        # age of the oldest flushed vote: how stale aggregates were at worst
+        self.max_staleness = max_staleness
+
+
+def flush_ratings(queue=None, batch_size=None):
+    # moves one batch from the queue to the database, the batch is acknowledged only after commit
+    queue = queue or get_rating_queue()
+    rows = queue.peek(batch_size or settings.RATING_FLUSH_BATCH_SIZE)
+    if not rows:
+        return FlushResult()
+    start = time.perf_counter()
+    votes = coalesce(rows)
+    written = apply_votes(votes)
+    queue.ack(rows[-1][0])
+    return FlushResult(
+        queued=len(rows),
+        coalesced=len(votes),
+        written=written,
+        seconds=time.perf_counter() - start,
+        max_staleness=time.time() - rows[0][4],
+    )
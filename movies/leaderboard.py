@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Min, Sum
+from django.db.models.functions import Cast
+
+from .cache import LEADERBOARD, invalidate
+from .models import Movie, TopMovie
+
+LEADERBOARD_SIZE = 250
+PRIOR_CACHE_KEY = 'leaderboard:prior'
+
+
+def weighted_score(rating_sum, rating_count, prior, min_votes):
+    # IMDb formula: (v / (v + m)) * R + (m / (v + m)) * C, where v * R is the stored rating sum
+    return (rating_sum + min_votes * prior) / (rating_count + min_votes)
+
+
+def global_prior(refresh=False):
+    # mean vote over the whole catalog (C), cached between full refreshes
+    prior = None if refresh else cache.get(PRIOR_CACHE_KEY)
+    if prior is None:
+        totals = Movie.objects.aggregate(votes=Sum('rating_count'), total=Sum('rating_sum'))
+        prior = totals['total'] / totals['votes'] if totals['votes'] else 0.0
+        cache.set(PRIOR_CACHE_KEY, prior, None)
+    return prior
+
+
+def ranked_movies(prior, min_votes):
+    # (movie id, weighted score) of the movies with enough votes, best first
+    score = (Cast(F('rating_sum'), FloatField()) + min_votes * prior) / (F('rating_count') + min_votes)
+    return (
+        Movie.objects.filter(rating_count__gte=max(min_votes, 1))
+        .annotate(score=score)
+        .order_by('-score', 'id')
+        .values_list('pk', 'score')
+    )
+
+
+def refresh_leaderboard():
+    # full rebuild from the movie aggregates, returns number of ranked movies
+    top = ranked_movies(global_prior(refresh=True), settings.TOP_MOVIES_MIN_VOTES)[:LEADERBOARD_SIZE]
+    entries = [TopMovie(movie_id=movie_id, score=movie_score) for movie_id, movie_score in top]
+    with transaction.atomic():
+        TopMovie.objects.all().delete()
+        TopMovie.objects.bulk_create(entries)
+    invalidate(LEADERBOARD)
+    return len(entries)
+
+
+def lock_board():
+    # incremental updates (on_commit callbacks of concurrent requests) take turns on the board,
+    # so two of them can't both take its last free place; a no-op on SQLite
+    list(TopMovie.objects.select_for_update().order_by('pk').values_list('pk', flat=True))
+
+
+def fill_board(prior, min_votes):
+    # tops the board up to LEADERBOARD_SIZE with the best unlisted movies
+    missing = LEADERBOARD_SIZE - TopMovie.objects.count()
+    if missing > 0:
+        candidates = ranked_movies(prior, min_votes).filter(top_entry__isnull=True)[:missing]
+        TopMovie.objects.bulk_create([TopMovie(movie_id=movie_id, score=score) for movie_id, score in candidates])
+
+
+def update_leaderboard(movie_id):
+    # incremental update after a vote, scored against the cached prior
+    stats = Movie.objects.filter(pk=movie_id).values('rating_sum', 'rating_count').first()
+    min_votes = settings.TOP_MOVIES_MIN_VOTES
+    prior = global_prior()
+    ranked = stats is not None and stats['rating_count'] >= max(min_votes, 1)
+    score = weighted_score(stats['rating_sum'], stats['rating_count'], prior, min_votes) if ranked else None
+    with transaction.atomic():
+        lock_board()
+        entry = TopMovie.objects.filter(movie_id=movie_id).first()
+        if entry is not None:
+            if ranked and score >= entry.score:
+                # rank or shown average of a listed movie changed
+                TopMovie.objects.filter(pk=entry.pk).update(score=score)
+            else:
+                # a listed movie that drops may have fallen behind unlisted ones:
+                # it leaves the board and the best unlisted movie (maybe itself) takes the place
+                entry.delete()
+                fill_board(prior, min_votes)
+            invalidate(LEADERBOARD)
+            return
+        if not ranked:
+            return
+        board = TopMovie.objects.aggregate(size=Count('id'), lowest=Min('score'))
+        if board['size'] < LEADERBOARD_SIZE:
+            TopMovie.objects.create(movie_id=movie_id, score=score)
+        elif score > board['lowest']:
+            TopMovie.objects.filter(pk__in=TopMovie.objects.order_by('score', '-movie_id').values('pk')[:1]).delete()
+            TopMovie.objects.create(movie_id=movie_id, score=score)
+        else:
+            return
+        invalidate(LEADERBOARD)
+
+
+def schedule_leaderboard_update(movie_id):
+    transaction.on_commit(lambda: update_leaderboard(movie_id))
+
+
+def schedule_leaderboard_updates(movie_ids):
+    # one on_commit callback for all movies of a bulk write
+    movie_ids = list(movie_ids)
+
+    def update():
+        for movie_id in movie_ids:
+            update_leaderboard(movie_id)
+    transaction.on_commit(update)
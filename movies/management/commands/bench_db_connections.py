@@ -0,0 +1,104 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+
+from conf.benchmark import LatencyStats, format_summary
+from movies.models import Movie
+
+# connection handling of each mode: settings applied to the database alias while it runs
+MODES = {
+    # Django's default: connect and authenticate on every request
+    'close': {'CONN_MAX_AGE': 0},
+    # one connection per worker, reused while it is younger than CONN_MAX_AGE
+    'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True},
+    # psycopg 3 pool shared by the worker's threads (PostgreSQL only)
+    'pool': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': True},
+}
+
+
+@contextmanager
+def connection_mode(alias, mode, pool_size=10):
+    # applies the mode's settings to the alias for one run; every thread's connection is
+    # built from this same settings dict. The pool is closed afterwards.
+    settings_dict = connections.settings[alias]
+    changes = dict(MODES[mode])
+    if mode == 'pool':
+        changes['OPTIONS'] = {**settings_dict.get('OPTIONS', {}), 'pool': {'min_size': min(2, pool_size), 'max_size': pool_size}}
+    previous = {name: settings_dict[name] for name in changes if name in settings_dict}
+    settings_dict.update(changes)
+    try:
+        yield
+    finally:
+        if mode == 'pool':
+            connections[alias].close_pool()
+        connections[alias].close()
+        for name in changes:
+            settings_dict.pop(name, None)
+        settings_dict.update(previous)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures per-request latency of the database connection modes (close after each request, persistent, '
+        'psycopg pool) at several worker counts. Each simulated request runs the request_started/finished '
+        'connection handling of Django around a few primary key lookups.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8],
+                            help='concurrent workers (threads) to measure, e.g. the gunicorn worker count')
+        parser.add_argument('--requests', type=int, default=500, help='simulated requests per worker count')
+        parser.add_argument('--queries', type=int, default=3, help='queries per simulated request')
+        parser.add_argument('--pool-size', type=int, default=10, help='max_size of the pool in pool mode')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        movie_ids = list(Movie.objects.using(alias).values_list('pk', flat=True)[:1000]) or [0]
+        connections[alias].close()
+        modes = options['modes']
+        if 'pool' in modes and connections[alias].vendor != 'postgresql':
+            self.stderr.write('pool mode needs PostgreSQL with psycopg 3, skipped')
+            modes = [mode for mode in modes if mode != 'pool']
+        if not modes:
+            raise CommandError('Nothing to measure.')
+
+        def simulated_request():
+            # what the request_started/request_finished signals do around a view
+            close_old_connections()
+            for _ in range(options['queries']):
+                Movie.objects.using(alias).filter(pk=random.choice(movie_ids)).values_list('pk', flat=True).first()
+            close_old_connections()
+
+        def worker(count):
+            stats = LatencyStats()
+            try:
+                for _ in range(count):
+                    start = time.perf_counter()
+                    simulated_request()
+                    stats.add(time.perf_counter() - start)
+            finally:
+                connections[alias].close()
+            return stats
+
+        self.stdout.write(
+            f"{options['requests']} requests of {options['queries']} queries per run, "
+            f"{connections[alias].vendor} database"
+        )
+        for workers in options['workers']:
+            for mode in modes:
+                shares = [options['requests'] // workers + (i < options['requests'] % workers) for i in range(workers)]
+                with connection_mode(alias, mode, options['pool_size']):
+                    start = time.perf_counter()
+                    with ThreadPoolExecutor(workers) as pool:
+                        results = list(pool.map(worker, shares))
+                    elapsed = time.perf_counter() - start
+                total = LatencyStats()
+                for stats in results:
+                    total.merge(stats)
+                self.stdout.write(format_summary(f'{mode} x{workers}', total.summary(elapsed)))
@@ -0,0 +1,73 @@
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from conf.benchmark import HttpSession, LatencyStats, format_summary
+from movies.models import Movie
+
+ENDPOINTS = {
+    'rate': lambda movie_id: ('POST', f'/movie/{movie_id}/rate/', {'rating': random.randint(1, 5)}),
+    'favorite': lambda movie_id: ('GET', f'/movie/{movie_id}/favorite/', None),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-tests the rate/favorite endpoints of a running server and reports req/s and latency percentiles. '
+        'Run it once against the WSGI (sync views) and once against the ASGI (ASYNC_VIEWS=True) deployment to compare.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000')
+        parser.add_argument('--username', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--requests', type=int, default=1000, help='total requests')
+        parser.add_argument('--concurrency', type=int, default=20, help='parallel clients')
+        parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+        parser.add_argument('--movies', type=int, nargs='+', help='movie ids to hit (default: up to 100 from the database)')
+
+    def handle(self, *args, **options):
+        movie_ids = options['movies'] or list(Movie.objects.values_list('pk', flat=True)[:100])
+        if not movie_ids:
+            raise CommandError('No movies to rate, pass --movies or seed the database.')
+
+        # one logged-in session per client thread
+        local = threading.local()
+        stats = defaultdict(LatencyStats)
+        lock = threading.Lock()
+
+        def session():
+            if not hasattr(local, 'session'):
+                local.session = HttpSession(options['base_url'])
+                if not local.session.login(options['username'], options['password']):
+                    raise CommandError(f"Login as {options['username']} failed.")
+            return local.session
+
+        def hit(number):
+            name = options['endpoints'][number % len(options['endpoints'])]
+            method, path, body = ENDPOINTS[name](random.choice(movie_ids))
+            client = session()
+            start = time.perf_counter()
+            status, _ = client.request(method, path, body)
+            elapsed = time.perf_counter() - start
+            with lock:
+                stats[name].add(elapsed, ok=status < 400)
+
+        self.stdout.write(
+            f"{options['requests']} requests, {options['concurrency']} clients -> {options['base_url']}"
+        )
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            # list() re-raises the first failure (e.g. a failed login)
+            list(pool.map(hit, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        total = LatencyStats()
+        for name in options['endpoints']:
+            self.stdout.write(format_summary(name, stats[name].summary(elapsed)))
+            total.merge(stats[name])
+        self.stdout.write(format_summary('total', total.summary(elapsed)))
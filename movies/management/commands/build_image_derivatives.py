@@ -0,0 +1,41 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from movies.images import process_image, stale_images
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates the resized WebP/AVIF/JPEG copies of stored movie images that have none yet, in parallel. '
+        'Run after deploying derivatives or changing IMAGE_DERIVATIVE_WIDTHS/FORMATS (with --all).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='threads, 0 processes images one by one')
+        parser.add_argument('--all', action='store_true',
+                            help='rebuild the derivative lists of every image, existing files are reused')
+
+    def handle(self, *args, **options):
+        jobs = list(stale_images(force=options['all']))
+        self.stdout.write(f'{len(jobs)} images to process with {options["workers"]} workers')
+
+        def run(job):
+            try:
+                return process_image(*job)
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        if options['workers']:
+            with ThreadPoolExecutor(options['workers']) as pool:
+                done = sum(pool.map(run, jobs))
+        else:
+            done = sum(process_image(*job) for job in jobs)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{done} processed, {len(jobs) - done} failed in {elapsed:.1f}s '
+            f'({done / elapsed if elapsed else 0:.1f} images/s)'
+        )
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.importing import FORMATS, export_rows, guess_format, write_rows
+
+
+class Command(BaseCommand):
+    help = 'Streams the catalog with rating aggregates to a CSV or JSONL file (or stdout), readable by import_movies.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='output file, "-" (default) writes to stdout')
+        parser.add_argument('--format', choices=FORMATS, help='default: from the file extension, jsonl for stdout')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='movies fetched per query')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or guess_format(options['path'])
+        start = time.perf_counter()
+        if options['path'] == '-':
+            written = write_rows(export_rows(chunk_size=options['chunk_size']), self.stdout, fmt)
+        else:
+            try:
+                with open(options['path'], 'w', newline='', encoding='utf-8') as output:
+                    written = write_rows(export_rows(chunk_size=options['chunk_size']), output, fmt)
+            except OSError as error:
+                raise CommandError(f'Cannot write {options["path"]}: {error}')
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{written} movies in {elapsed:.1f}s ({written / elapsed if elapsed else 0:.0f} rows/s)')
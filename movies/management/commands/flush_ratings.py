@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from movies.ingest import flush_ratings, get_rating_queue
+
+
+class Command(BaseCommand):
+    help = 'Writes queued votes (RATING_INGEST_MODE=queue) to the database in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='keep flushing until interrupted')
+        parser.add_argument('--interval', type=float, default=settings.RATING_FLUSH_INTERVAL,
+                            help='seconds to wait when the queue is empty')
+        parser.add_argument('--batch-size', type=int, default=settings.RATING_FLUSH_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        queue = get_rating_queue()
+        pending, oldest = queue.backlog()
+        self.stdout.write(f'{pending} votes queued in {queue.path}, oldest waited {oldest:.1f}s')
+
+        try:
+            while True:
+                result = flush_ratings(queue, options['batch_size'])
+                if result.queued:
+                    self.stdout.write(
+                        f'{result.queued} votes -> {result.coalesced} after coalescing -> {result.written} written '
+                        f'in {result.seconds * 1000:.0f} ms ({result.queued / result.seconds:.0f} votes/s), '
+                        f'max staleness {result.max_staleness:.1f}s'
+                    )
+                # a full batch means more votes are waiting
+                if result.queued < options['batch_size']:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,44 @@
+import sys
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.importing import FORMATS, guess_format, import_movies
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports movies from a CSV or JSONL file (or "-" for stdin), upserting on external_id in batches. '
+        'Genres are matched by name, images are copied from --images.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV/JSONL file, "-" reads stdin')
+        parser.add_argument('--format', choices=FORMATS, help='default: from the file extension, jsonl for stdin')
+        parser.add_argument('--images', help='directory the "image" column is relative to')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=4, help='threads copying images')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or guess_format(options['path'])
+
+        def progress(result):
+            self.stdout.write(f'{result.rows} rows, {result.rows_per_second:.0f} rows/s')
+
+        try:
+            # stdin isn't ours to close, call_command may run again in this process
+            stream = nullcontext(sys.stdin) if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        except OSError as error:
+            raise CommandError(f'Cannot read {options["path"]}: {error}')
+        with stream as rows:
+            result = import_movies(
+                rows, fmt, images_dir=options['images'], batch_size=options['batch_size'],
+                workers=options['workers'], progress=progress,
+            )
+
+        for line, message in result.errors:
+            self.stderr.write(f'line {line}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.created} created, {result.updated} updated, {result.images} images, '
+            f'{len(result.errors)} errors in {result.seconds:.1f}s ({result.rows_per_second:.0f} rows/s)'
+        ))
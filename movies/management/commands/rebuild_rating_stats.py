@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from movies.leaderboard import refresh_leaderboard
+from movies.models import Movie
+from movies.ratings import rebuild_rating_stats
+
+
+class Command(BaseCommand):
+    help = 'Recalculates denormalized rating aggregates (sum, count, average, histogram) of movies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('movie_ids', nargs='*', type=int, help='Only rebuild these movies')
+
+    def handle(self, *args, **options):
+        movies = Movie.objects.all()
+        if options['movie_ids']:
+            movies = movies.filter(pk__in=options['movie_ids'])
+
+        self.stdout.write('Rebuilding rating aggregates...')
+        updated = rebuild_rating_stats(movies)
+        self.stdout.write(f'Rating aggregates rebuilt for {updated} movies.')
+        refresh_leaderboard()
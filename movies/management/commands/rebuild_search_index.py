@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from movies.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of movies (tsvector on PostgreSQL, FTS5 table on SQLite)'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        self.stdout.write(f'Rebuilding search index with {type(backend).__name__}...')
+        backend.rebuild()
+        self.stdout.write('Search index rebuilt.')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from movies.leaderboard import refresh_leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the "Top 250" leaderboard with Bayesian-weighted scores (run periodically, e.g. from cron)'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Refreshing leaderboard...')
+        ranked = refresh_leaderboard()
+        self.stdout.write(f'Leaderboard refreshed, {ranked} movies ranked.')
@@ -0,0 +1,164 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve
+
+from conf.benchmark import HttpSession, LatencyStats, format_summary
+
+
+def load_traffic(lines):
+    """
+    Parses a JSONL request log: one {"method", "path", "body", "at"} object per line, where
+    "at" is the offset in seconds from the start of the recording. Returns (entries, skipped).
+    """
+    entries, skipped = [], 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            skipped += 1
+            continue
+        if not isinstance(entry, dict) or not entry.get('method') or not str(entry.get('path', '')).startswith('/'):
+            skipped += 1
+            continue
+        entries.append({
+            'method': entry['method'].upper(),
+            'path': entry['path'],
+            'body': entry.get('body'),
+            'at': float(entry.get('at') or 0),
+        })
+    return entries, skipped
+
+
+def endpoint_name(path):
+    # requests are grouped by url name, so /movie/1/ and /movie/2/ both count as movie_detail
+    path = urlsplit(path).path
+    try:
+        return resolve(path).view_name
+    except Resolver404:
+        return path
+
+
+class Command(BaseCommand):
+    help = (
+        'Replays a recorded JSONL request log against a running server and reports req/s, latency percentiles '
+        'and SQL queries per endpoint. Query counts need QUERY_INSPECTOR_HEADER=True on the server.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', help='JSONL file, one {"method", "path", "body", "at"} object per line')
+        parser.add_argument('--base-url', default='http://localhost:8000')
+        parser.add_argument('--username', help='log every client in (session for pages, JWT for /api/)')
+        parser.add_argument('--password')
+        parser.add_argument('--concurrency', type=int, default=10, help='parallel clients')
+        parser.add_argument('--repeat', type=int, default=1, help='replay the log this many times')
+        parser.add_argument('--think-time', type=float, default=0.0,
+                            help='each client waits up to this many seconds between its requests')
+        parser.add_argument('--rate', type=float, help='start at most this many requests per second overall')
+        parser.add_argument('--use-delays', action='store_true', help='keep the recorded "at" offsets')
+        parser.add_argument('--speed', type=float, default=1.0, help='time compression for --use-delays')
+        parser.add_argument('--save', help='write the per-endpoint summary to this JSON file')
+        parser.add_argument('--compare', help='fail when p95 or queries regress against this saved summary')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='allowed p95 growth for --compare, as a fraction')
+
+    def handle(self, *args, **options):
+        if options['username'] and not options['password']:
+            raise CommandError('--password is required with --username.')
+        try:
+            with open(options['log']) as log:
+                entries, skipped = load_traffic(log)
+        except OSError as error:
+            raise CommandError(f'Cannot read the request log: {error}')
+        if not entries:
+            raise CommandError(f"No replayable requests in {options['log']}.")
+        entries = entries * options['repeat']
+
+        local = threading.local()
+        stats = defaultdict(LatencyStats)
+        lock = threading.Lock()
+
+        def session():
+            if not hasattr(local, 'session'):
+                local.session = HttpSession(options['base_url'])
+                if options['username'] and not local.session.login(options['username'], options['password']):
+                    raise CommandError(f"Login as {options['username']} failed.")
+            return local.session
+
+        def wait(number, entry):
+            if options['rate']:
+                delay = start + number / options['rate'] - time.perf_counter()
+            elif options['use_delays']:
+                delay = start + entry['at'] / options['speed'] - time.perf_counter()
+            else:
+                delay = 0
+            if options['think_time']:
+                delay = max(delay, 0) + random.uniform(0, options['think_time'])
+            if delay > 0:
+                time.sleep(delay)
+
+        def hit(item):
+            number, entry = item
+            client = session()
+            wait(number, entry)
+            began = time.perf_counter()
+            status, headers = client.request(entry['method'], entry['path'], entry['body'])
+            elapsed = time.perf_counter() - began
+            queries = headers.get('X-Query-Count')
+            with lock:
+                stats[endpoint_name(entry['path'])].add(
+                    elapsed, ok=status < 400, queries=int(queries) if queries else None,
+                )
+
+        self.stdout.write(
+            f"{len(entries)} requests ({skipped} skipped lines), {options['concurrency']} clients -> {options['base_url']}"
+        )
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            # list() re-raises the first failure (e.g. a failed login)
+            list(pool.map(hit, enumerate(entries)))
+        elapsed = time.perf_counter() - start
+
+        summaries = {name: stats[name].summary(elapsed) for name in sorted(stats)}
+        total = LatencyStats()
+        for name, summary in summaries.items():
+            self.stdout.write(format_summary(name, summary))
+            total.merge(stats[name])
+        self.stdout.write(format_summary('total', total.summary(elapsed)))
+
+        if options['save']:
+            with open(options['save'], 'w') as output:
+                json.dump(summaries, output, indent=2)
+        if options['compare']:
+            self.compare(summaries, options['compare'], options['max_regression'])
+
+    def compare(self, summaries, path, max_regression):
+        try:
+            with open(path) as baseline_file:
+                baseline = json.load(baseline_file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Cannot read the baseline: {error}')
+
+        regressions = []
+        for name, summary in summaries.items():
+            before = baseline.get(name)
+            if not before:
+                continue
+            if before['p95_ms'] and summary['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+                regressions.append(f"{name}: p95 {before['p95_ms']:.1f} -> {summary['p95_ms']:.1f} ms")
+            # more queries per request is a code change (e.g. a new N+1), not noise
+            if before.get('queries') is not None and summary['queries'] is not None \
+                    and summary['queries'] > before['queries'] + 0.5:
+                regressions.append(f"{name}: queries {before['queries']:.1f} -> {summary['queries']:.1f}")
+        if regressions:
+            raise CommandError('Regressed against the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {path}.'))
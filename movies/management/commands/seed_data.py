@@ -1,13 +1,45 @@
 import os
 from django.core.management.base import BaseCommand
 from movies.models import Movie, Genre, Review, MovieImage
+from movies.seeding import GENRES, seed_catalog
 from django.core.files import File
 
 
 class Command(BaseCommand):
-    help = 'Seeds the database with example data'
+    help = (
+        'Seeds the database with example data. With --movies it generates a synthetic catalog of any size '
+        'instead (users, Zipf-distributed ratings, reviews and favorites) for benchmarks.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, help='generate this many synthetic movies instead of the examples')
+        parser.add_argument('--users', type=int, default=1000, help='synthetic users (seed_<n>)')
+        parser.add_argument('--ratings-per-user', type=int, default=50, help='mean votes per user')
+        parser.add_argument('--reviews-per-user', type=float, default=1, help='mean reviews per user')
+        parser.add_argument('--favorites-per-user', type=float, default=3, help='mean favorites per user')
+        parser.add_argument('--zipf', type=float, default=1.1, help='exponent of the movie popularity distribution')
+        parser.add_argument('--seed', type=int, default=0, help='random seed, equal seeds give equal data')
+        parser.add_argument('--password', help='password of the synthetic users (default: unusable)')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='rows per insert batch')
+
+    def handle(self, *args, **options):
+        if options['movies'] is not None:
+            counts = seed_catalog(
+                movies=options['movies'],
+                users=options['users'],
+                ratings_per_user=options['ratings_per_user'],
+                reviews_per_user=options['reviews_per_user'],
+                favorites_per_user=options['favorites_per_user'],
+                zipf_exponent=options['zipf'],
+                seed=options['seed'],
+                password=options['password'],
+                chunk_size=options['chunk_size'],
+                progress=self.stdout.write,
+            )
+            self.stdout.write(', '.join(f'{count} {name}' for name, count in counts.items()))
+            self.stdout.write('Seeding complete!')
+            return
 
-    def handle(self, *args, **kwargs):
         # Очистка базы данных
         self.stdout.write('Deleting old data...')
         Movie.objects.all().delete()
@@ -16,10 +48,7 @@ class Command(BaseCommand):
 
         # Создание жанров
         self.stdout.write('Creating genres...')
-        genres = ['Action', 'Comedy', 'Horror', 'Sci-Fi', 'Drama',
-                  'Crime', 'Romance', 'Adventure', 'Animation', 'Biography', 'Fantasy', 'Thriller']
-        for genre in genres:
-            Genre.objects.get_or_create(name=genre)
+        genres = {name: Genre.objects.get_or_create(name=name)[0] for name in GENRES}
 
         # Создание фильмов
         self.stdout.write('Creating movies...')
@@ -230,9 +259,7 @@ class Command(BaseCommand):
             m.save()
 
             # Привязка жанров
-            for genre_name in movie['genres']:
-                genre = Genre.objects.get(name=genre_name)
-                m.genres.add(genre)
+            m.genres.add(*(genres[genre_name] for genre_name in movie['genres']))
 
             # Загрузка дополнительных изображений
             for extra_image_path in movie.get('extra_images', []):
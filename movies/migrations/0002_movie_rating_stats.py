@@ -0,0 +1,83 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:20
+
+import logging
+
+from django.db import migrations, models
+from django.db.models import Count
+
+logger = logging.getLogger(__name__)
+
+
+def fill_rating_stats(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    Rating = apps.get_model('movies', 'Rating')
+
+    # value isn't range-checked by the database yet, legacy votes outside 1..5 have no histogram field
+    skipped = Rating.objects.exclude(value__range=(1, 5)).count()
+    if skipped:
+        logger.warning('%s ratings outside 1..5 left out of the movie aggregates.', skipped)
+    counts = (
+        Rating.objects.filter(value__range=(1, 5))
+        .values_list('movie_id', 'value').annotate(total=Count('id')).order_by()
+    )
+    stats = {}
+    for movie_id, value, total in counts:
+        movie_stats = stats.setdefault(movie_id, {'rating_sum': 0, 'rating_count': 0})
+        movie_stats['rating_sum'] += value * total
+        movie_stats['rating_count'] += total
+        movie_stats[f'votes_{value}'] = movie_stats.get(f'votes_{value}', 0) + total
+
+    for movie_id, movie_stats in stats.items():
+        movie_stats['rating_avg'] = movie_stats['rating_sum'] / movie_stats['rating_count']
+        Movie.objects.filter(pk=movie_id).update(**movie_stats)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_avg',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='votes_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='votes_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='votes_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='votes_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='votes_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rating_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, FloatField, Sum
+from django.db.models.functions import Cast
+
+
+def fill_leaderboard(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    TopMovie = apps.get_model('movies', 'TopMovie')
+
+    totals = Movie.objects.aggregate(votes=Sum('rating_count'), total=Sum('rating_sum'))
+    prior = totals['total'] / totals['votes'] if totals['votes'] else 0.0
+    min_votes = settings.TOP_MOVIES_MIN_VOTES
+    score = (Cast(F('rating_sum'), FloatField()) + min_votes * prior) / (F('rating_count') + min_votes)
+    top = (
+        Movie.objects.filter(rating_count__gte=max(min_votes, 1))
+        .annotate(score=score)
+        .order_by('-score', 'id')
+        .values_list('pk', 'score')[:250]
+    )
+    TopMovie.objects.bulk_create([TopMovie(movie_id=movie_id, score=movie_score) for movie_id, movie_score in top])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_movie_rating_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopMovie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(db_index=True)),
+                ('movie', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='top_entry', to='movies.movie')),
+            ],
+            options={
+                'ordering': ['-score', 'movie_id'],
+            },
+        ),
+        migrations.RunPython(fill_leaderboard, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0003_topmovie'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movie',
+            name='rating_avg',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['title', 'id'], name='movie_title_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['release_date', 'id'], name='movie_release_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['rating_avg', 'id'], name='movie_rating_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from movies.search import get_search_backend
+
+
+def install_search_index(apps, schema_editor):
+    get_search_backend(schema_editor.connection).install(schema_editor)
+
+
+def uninstall_search_index(apps, schema_editor):
+    get_search_backend(schema_editor.connection).uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0004_movie_keyset_indexes'),
+    ]
+
+    operations = [
+        # tsvector column + GIN index on postgres, FTS5 table on sqlite
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
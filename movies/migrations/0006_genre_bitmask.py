@@ -0,0 +1,52 @@
+from django.db import migrations, models
+
+# movies.models.MAX_GENRES when this migration was written, copied so later model edits can't change it:
+# bit 63 would overflow the signed BIGINT genre_mask
+MAX_GENRES = 63
+
+
+def fill_genre_masks(apps, schema_editor):
+    Genre = apps.get_model('movies', 'Genre')
+    Movie = apps.get_model('movies', 'Movie')
+
+    # same limit as Genre.save()
+    count = Genre.objects.count()
+    if count > MAX_GENRES:
+        raise ValueError(
+            f'{count} genres found, genre_mask fits only {MAX_GENRES}; merge or delete genres before migrating.'
+        )
+    for bit, genre in enumerate(Genre.objects.order_by('id')):
+        genre.bit = bit
+        genre.save(update_fields=['bit'])
+
+    masks = {}
+    for movie_id, bit in Movie.genres.through.objects.values_list('movie_id', 'genre__bit'):
+        masks[movie_id] = masks.get(movie_id, 0) | (1 << bit)
+    for movie_id, mask in masks.items():
+        Movie.objects.filter(pk=movie_id).update(genre_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_movie_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genre',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='genre_mask',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_genre_masks, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='genre',
+            name='bit',
+            field=models.PositiveSmallIntegerField(editable=False, unique=True),
+        ),
+    ]
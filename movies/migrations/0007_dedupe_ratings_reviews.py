@@ -0,0 +1,54 @@
+from django.db import migrations
+from django.db.models import Count, Max
+
+AGGREGATE_FIELDS = ['rating_sum', 'rating_count', 'rating_avg'] + [f'votes_{value}' for value in range(1, 6)]
+
+
+def drop_duplicates(model):
+    # keeps the newest row per (user, movie), returns ids of movies that lost rows
+    duplicates = (
+        model.objects.values('user_id', 'movie_id')
+        .annotate(keep=Max('id'), total=Count('id'))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    movie_ids = set()
+    for row in duplicates:
+        model.objects.filter(user_id=row['user_id'], movie_id=row['movie_id']).exclude(pk=row['keep']).delete()
+        movie_ids.add(row['movie_id'])
+    return movie_ids
+
+
+def dedupe(apps, schema_editor):
+    Movie = apps.get_model('movies', 'Movie')
+    Rating = apps.get_model('movies', 'Rating')
+    Review = apps.get_model('movies', 'Review')
+
+    drop_duplicates(Review)
+    movie_ids = drop_duplicates(Rating)
+
+    # removed votes were counted in the movie aggregates
+    counts = (
+        Rating.objects.filter(movie_id__in=movie_ids, value__range=(1, 5))
+        .values_list('movie_id', 'value').annotate(total=Count('id')).order_by()
+    )
+    stats = {movie_id: dict.fromkeys(AGGREGATE_FIELDS, 0) for movie_id in movie_ids}
+    for movie_id, value, total in counts:
+        stats[movie_id]['rating_sum'] += value * total
+        stats[movie_id]['rating_count'] += total
+        stats[movie_id][f'votes_{value}'] += total
+    for movie_id, movie_stats in stats.items():
+        if movie_stats['rating_count']:
+            movie_stats['rating_avg'] = movie_stats['rating_sum'] / movie_stats['rating_count']
+        Movie.objects.filter(pk=movie_id).update(**movie_stats)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_genre_bitmask'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_dedupe_ratings_reviews'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['user', '-created_at'], name='review_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['-created_at'], name='review_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usermovielist',
+            index=models.Index(fields=['user', 'name'], name='movielist_user_name_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.UniqueConstraint(fields=('user', 'movie'), name='rating_user_movie_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='review',
+            constraint=models.UniqueConstraint(fields=('user', 'movie'), name='review_user_movie_uniq'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.1.2 on 2026-10-18 16:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+FAVORITES_LIST = 'Favorites'
+
+
+def lists_to_favorites(apps, schema_editor):
+    # the "Favorites" lists become Favorite rows
+    Favorite = apps.get_model('movies', 'Favorite')
+    UserMovieList = apps.get_model('movies', 'UserMovieList')
+    links = UserMovieList.movies.through.objects.filter(usermovielist__name=FAVORITES_LIST)
+    Favorite.objects.bulk_create(
+        [Favorite(user_id=user_id, movie_id=movie_id)
+         for user_id, movie_id in links.values_list('usermovielist__user_id', 'movie_id').iterator()],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    UserMovieList.objects.filter(name=FAVORITES_LIST).delete()
+
+
+def favorites_to_lists(apps, schema_editor):
+    Favorite = apps.get_model('movies', 'Favorite')
+    UserMovieList = apps.get_model('movies', 'UserMovieList')
+    lists = {}
+    for favorite in Favorite.objects.order_by('user_id', 'created_at').iterator():
+        if favorite.user_id not in lists:
+            lists[favorite.user_id] = UserMovieList.objects.create(user_id=favorite.user_id, name=FAVORITES_LIST)
+        lists[favorite.user_id].movies.add(favorite.movie_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0008_review_rating_constraints'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Favorite',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='favorites', to='movies.movie')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'movie'), name='favorite_user_movie_uniq')],
+            },
+        ),
+        migrations.RunPython(lists_to_favorites, favorites_to_lists),
+    ]
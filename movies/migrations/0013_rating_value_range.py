@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:07
+
+import logging
+
+from django.conf import settings
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+
+def drop_invalid_votes(apps, schema_editor):
+    # votes outside 1..5 were never counted in the aggregates (0002 skipped them), the constraint rejects them
+    Rating = apps.get_model('movies', 'Rating')
+    deleted, _ = Rating.objects.exclude(value__range=(1, 5)).delete()
+    if deleted:
+        logger.warning('%s ratings outside 1..5 deleted.', deleted)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0012_movie_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_invalid_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.CheckConstraint(
+                condition=models.Q(('value__gte', 1), ('value__lte', 5)), name='rating_value_range',
+            ),
+        ),
+    ]
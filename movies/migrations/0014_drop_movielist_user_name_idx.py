@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 17:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0013_rating_value_range'),
+    ]
+
+    # favorites moved to Favorite (0009, unique (user, movie)), no query looks lists up by name
+    # anymore; user_id keeps its foreign key index
+    operations = [
+        migrations.RemoveIndex(
+            model_name='usermovielist',
+            name='movielist_user_name_idx',
+        ),
+    ]
@@ -1,13 +1,83 @@
-from django.db import models
+from django.db import models, transaction
 
 from conf import settings
 
 
 User = settings.AUTH_USER_MODEL
 
+RATING_VALUES = range(1, 6)
+# Movie.genre_mask is a signed 64-bit integer, the sign bit stays unused
+MAX_GENRES = 63
+# fields rendered by movie cards (home, catalog rows)
+CARD_FIELDS = ['id', 'title', 'description', 'image', 'image_derivatives', 'release_date', 'duration', 'rating_avg']
+
+
+class MovieQuerySet(models.QuerySet):
+    # named "shapes": each bundles what one kind of page touches, so rendering costs a fixed number of queries
+
+    def for_card(self):
+        return self.only(*CARD_FIELDS)
+
+    def with_cover(self):
+        # prefetched extra images behind Movie.cover_image
+        return self.prefetch_related(
+            models.Prefetch('extra_images', queryset=MovieImage.objects.order_by('id'), to_attr='cover_images')
+        )
+
+    def for_detail(self):
+        return self.prefetch_related('genres')
+
+
+class ReviewQuerySet(models.QuerySet):
+    def for_detail(self):
+        return self.select_related('user', 'updated_by')
+
+    def for_profile(self):
+        # user stays loaded, the user's related manager compares it with the profile owner
+        return self.select_related('movie').only('user', 'text', 'created_at', 'movie__id', 'movie__title')
+
+    def for_moderation(self):
+        return self.select_related('movie', 'user').only(
+            'text', 'created_at', 'movie__id', 'movie__title', 'user__id', 'user__username'
+        )
+
+
+class RatingQuerySet(models.QuerySet):
+    def delete(self):
+        # one DELETE, then each touched movie's aggregates shifted once (not once per vote)
+        from .ratings import shift_votes
+
+        with transaction.atomic(using=self.db):
+            deleted, deltas = self.delete_votes()
+            shift_votes(deltas)
+        return deleted
+
+    def delete_votes(self):
+        # delete() without shifting the aggregates: returns (delete() result, {movie_id: delta})
+        # for a caller that shifts them together with other vote changes (movies.ratings.shift_votes)
+        from .ratings import removal_deltas
+
+        deltas = removal_deltas(self)
+        return super().delete(), deltas
+
 
 class Genre(models.Model):
     name = models.CharField(max_length=100, unique=True)
+    # position of the genre in Movie.genre_mask
+    bit = models.PositiveSmallIntegerField(unique=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            used = set(Genre.objects.values_list('bit', flat=True))
+            free = [bit for bit in range(MAX_GENRES) if bit not in used]
+            if not free:
+                raise ValueError(f'Genre limit reached, genre_mask fits only {MAX_GENRES} genres')
+            self.bit = free[0]
+        super().save(*args, **kwargs)
+
+    @property
+    def mask(self):
+        return 1 << self.bit
 
     def __str__(self):
         return self.name
@@ -19,14 +89,51 @@ class Movie(models.Model):
     release_date = models.DateField()
     is_highlight = models.BooleanField(default=False)
     image = models.ImageField(upload_to='images/', blank=True, null=True)
+    # resized WebP/AVIF/JPEG copies of `image`, written by movies.images
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     genres = models.ManyToManyField(Genre, related_name='movies')
     duration = models.PositiveIntegerField(blank=True, null=True, help_text="Duration in minutes")
+    # bitmask of Genre.bit values, kept in sync with `genres` by movies.genres
+    genre_mask = models.BigIntegerField(default=0, editable=False)
+    # id of the movie in the catalog it was imported from, import_movies upserts on it
+    external_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # bumped by every change shown on the movie page (votes and reviews too), the page's Last-Modified/ETag
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # denormalized rating aggregates, kept in sync by movies.ratings
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0, db_index=True)
+    rating_avg = models.FloatField(default=0)
+    # per-value histogram (how many 1..5 votes the movie got)
+    votes_1 = models.PositiveIntegerField(default=0)
+    votes_2 = models.PositiveIntegerField(default=0)
+    votes_3 = models.PositiveIntegerField(default=0)
+    votes_4 = models.PositiveIntegerField(default=0)
+    votes_5 = models.PositiveIntegerField(default=0)
+
+    objects = MovieQuerySet.as_manager()
+
+    class Meta:
+        # (sort key, id) pairs used by the catalog keyset pagination
+        indexes = [
+            models.Index(fields=['title', 'id'], name='movie_title_keyset_idx'),
+            models.Index(fields=['release_date', 'id'], name='movie_release_keyset_idx'),
+            models.Index(fields=['rating_avg', 'id'], name='movie_rating_keyset_idx'),
+        ]
 
-    # TODO: maybe a common field (write it after save of Rating)
-    #  with average rating would be better? Need to think
     def average_rating(self):
-        ratings = self.rating.all()
-        return ratings.aggregate(models.Avg('value'))['value__avg'] or 0
+        return self.rating_avg
+
+    @property
+    def cover_image(self):
+        # first extra image for wide layouts, uses the with_cover() prefetch when present
+        images = getattr(self, 'cover_images', None)
+        if images is None:
+            images = self.extra_images.order_by('id')[:1]
+        return images[0] if images else None
+
+    def rating_histogram(self):
+        return {value: getattr(self, f'votes_{value}') for value in RATING_VALUES}
 
     # TODO: Recheck and implement to views and templates
     def review_count(self):
@@ -39,6 +146,7 @@ class Movie(models.Model):
 class MovieImage(models.Model):
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='extra_images')
     image = models.ImageField(upload_to='images/extra/')
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Extra image for {self.movie.title}"
@@ -53,6 +161,18 @@ class Review(models.Model):
     updated_by = models.ForeignKey(User, related_name="updated_reviews", null=True, blank=True,
                                    on_delete=models.SET_NULL)
 
+    objects = ReviewQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # one review per user and movie, also the index of the "own review" lookup
+            models.UniqueConstraint(fields=['user', 'movie'], name='review_user_movie_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='review_user_created_idx'),
+            models.Index(fields=['-created_at'], name='review_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}'s review for {self.movie.title}"
 
@@ -62,8 +182,59 @@ class Rating(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     value = models.PositiveSmallIntegerField()
 
+    objects = RatingQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'movie'], name='rating_user_movie_uniq'),
+            # the aggregates have a votes_N field per value
+            models.CheckConstraint(
+                condition=models.Q(value__gte=RATING_VALUES[0], value__lte=RATING_VALUES[-1]), name='rating_value_range',
+            ),
+        ]
+
+    def delete(self, using=None, keep_parents=False):
+        # through RatingQuerySet.delete: Rating has no delete signals, so cascades stay fast deletes
+        deleted = Rating.objects.using(using).filter(pk=self.pk).delete()
+        self.pk = None
+        return deleted
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the stored vote, signals use it to shift movie aggregates on save
+        instance._stored_vote = (instance.__dict__.get('movie_id'), instance.__dict__.get('value'))
+        return instance
+
+
+class TopMovie(models.Model):
+    # materialized "top 250", maintained by movies.leaderboard
+    movie = models.OneToOneField(Movie, on_delete=models.CASCADE, related_name='top_entry')
+    score = models.FloatField(db_index=True)
+
+    class Meta:
+        ordering = ['-score', 'movie_id']
+
+    def __str__(self):
+        return f"{self.movie.title} ({self.score:.2f})"
+
 
 class UserMovieList(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
     movies = models.ManyToManyField(Movie, related_name='user_lists')
+
+
+class Favorite(models.Model):
+    # a user's favorite movie, membership checks are single index lookups
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='favorites')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'movie'], name='favorite_user_movie_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.movie} in {self.user}'s favorites"
@@ -0,0 +1,71 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination over (sort_field, pk): every page is a range scan that starts right
+    after the last row of the previous one, so deep pages cost the same as the first.
+    """
+
+    def __init__(self, queryset, sort_field, descending=False, per_page=24):
+        self.queryset = queryset
+        self.sort_field = sort_field
+        self.descending = descending
+        self.per_page = per_page
+        if sort_field in queryset.query.annotations:
+            self.field = queryset.query.annotations[sort_field].output_field
+        else:
+            self.field = queryset.model._meta.get_field(sort_field)
+
+    def encode_cursor(self, obj):
+        position = [getattr(obj, self.sort_field), obj.pk]
+        raw = json.dumps(position, cls=DjangoJSONEncoder).encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    def decode_cursor(self, cursor):
+        # broken or foreign cursors fall back to the first page
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return self.field.to_python(value), int(pk)
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            return None
+
+    def get_page(self, cursor=None):
+        direction = '-' if self.descending else ''
+        queryset = self.queryset.order_by(f'{direction}{self.sort_field}', f'{direction}pk')
+
+        position = self.decode_cursor(cursor) if cursor else None
+        if position is not None:
+            value, pk = position
+            lookup = 'lt' if self.descending else 'gt'
+            queryset = queryset.filter(
+                Q(**{f'{self.sort_field}__{lookup}': value}) |
+                Q(**{self.sort_field: value, f'pk__{lookup}': pk})
+            )
+
+        # one extra row tells whether there is a next page
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = self.encode_cursor(rows[self.per_page - 1]) if len(rows) > self.per_page else None
+        return KeysetPage(rows[:self.per_page], next_cursor)
@@ -0,0 +1,97 @@
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce, Now, NullIf
+
+from .cache import CATALOG_RATINGS, invalidate, invalidate_throttled, movie_namespace
+from .leaderboard import schedule_leaderboard_updates
+from .models import Movie, Rating, RATING_VALUES
+
+
+def rating_delta(old_value=None, new_value=None):
+    # aggregate changes for one vote: old_value is None for a new vote, new_value is None for a removed one
+    delta = Counter()
+    if old_value is not None:
+        delta['rating_sum'] -= old_value
+        delta['rating_count'] -= 1
+        delta[f'votes_{old_value}'] -= 1
+    if new_value is not None:
+        delta['rating_sum'] += new_value
+        delta['rating_count'] += 1
+        delta[f'votes_{new_value}'] += 1
+    return delta
+
+
+def apply_rating_delta(movie_id, delta):
+    # single UPDATE with F() expressions, so concurrent votes can't overwrite each other
+    updates = {field: F(field) + value for field, value in delta.items() if value}
+    if updates:
+        new_sum = F('rating_sum') + delta.get('rating_sum', 0)
+        new_count = F('rating_count') + delta.get('rating_count', 0)
+        updates['rating_avg'] = Coalesce(Cast(new_sum, FloatField()) / NullIf(new_count, 0), 0.0)
+    # votes that cancel out still change what their voters see on the movie page
+    Movie.objects.filter(pk=movie_id).update(updated_at=Now(), **updates)
+
+
+def removal_deltas(ratings):
+    # {movie_id: aggregate delta} of deleting the ratings, one grouped query
+    deltas = defaultdict(Counter)
+    rows = ratings.order_by().values_list('movie_id', 'value').annotate(votes=Count('id'))
+    for movie_id, value, votes in rows:
+        for field, change in rating_delta(value, None).items():
+            deltas[movie_id][field] += change * votes
+    return deltas
+
+
+def shift_votes(deltas):
+    # {movie_id: delta} of a bulk write: one UPDATE per movie (ids of movies deleted meanwhile
+    # update nothing), one leaderboard callback and one cache bump for all of them
+    for movie_id, delta in deltas.items():
+        apply_rating_delta(movie_id, delta)
+    if deltas:
+        schedule_leaderboard_updates(deltas)
+        invalidate(*[movie_namespace(movie_id) for movie_id in deltas])
+        invalidate_throttled(CATALOG_RATINGS, settings.CATALOG_RATINGS_REFRESH)
+
+
+def lock_movies(movie_ids):
+    """
+    Row-locks the movies in id order. Every vote writer takes the lock before it reads the stored
+    votes, so a vote inserted by another writer can't appear between that read and the write and
+    be counted twice. A no-op on SQLite (development), which has no row locks.
+    """
+    list(Movie.objects.select_for_update().filter(pk__in=movie_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def record_rating(user, movie, value):
+    # post_save of Rating shifts movie aggregates inside this transaction
+    with transaction.atomic():
+        lock_movies([movie.pk])
+        rating, created = Rating.objects.update_or_create(user=user, movie=movie, defaults={'value': value})
+    return rating
+
+
+def rebuild_rating_stats(movies=None):
+    """
+    Recalculates aggregates from the Rating table, returns number of updated movies.
+    Two set-based UPDATEs with correlated subqueries, so the database does the work even
+    for catalogs with millions of votes.
+    """
+    movies = Movie.objects.all() if movies is None else movies
+    votes = Rating.objects.filter(movie=OuterRef('pk')).order_by().values('movie')
+
+    def total(aggregate, **filters):
+        return Coalesce(Subquery(votes.filter(**filters).annotate(total=aggregate).values('total')), 0)
+
+    with transaction.atomic():
+        updated = movies.update(
+            rating_sum=total(Sum('value')),
+            rating_count=total(Count('id')),
+            **{f'votes_{value}': total(Count('id'), value=value) for value in RATING_VALUES},
+        )
+        movies.update(updated_at=Now(), rating_avg=Coalesce(
+            Cast(F('rating_sum'), FloatField()) / NullIf(F('rating_count'), 0), 0.0
+        ))
+    return updated
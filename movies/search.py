@@ -0,0 +1,195 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Genre, Movie
+
+MOVIE_TABLE = Movie._meta.db_table
+GENRE_TABLE = Genre._meta.db_table
+MOVIE_GENRES_TABLE = Movie.genres.through._meta.db_table
+
+
+def search_terms(query):
+    # words only, quotes and operators of the engines' query languages are dropped
+    return re.findall(r'\w+', query.lower())
+
+
+class SimpleSearchBackend:
+    """Fallback for databases without full-text support: icontains scan, no ranking."""
+
+    def install(self, schema_editor):
+        pass
+
+    def uninstall(self, schema_editor):
+        pass
+
+    def index(self, movie_ids):
+        pass
+
+    def rebuild(self, db_connection=connection):
+        pass
+
+    def remove(self, movie_ids):
+        pass
+
+    def search(self, queryset, query):
+        # matching movies annotated with `search_rank` (higher is better)
+        return self.rank(self.filter(queryset, query), query)
+
+    def filter(self, queryset, query):
+        return queryset.filter(
+            Q(title__icontains=query) |
+            Q(description__icontains=query) |
+            Q(genres__name__icontains=query)
+        ).distinct()
+
+    def rank(self, queryset, query):
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class PostgresSearchBackend(SimpleSearchBackend):
+    """Weighted tsvector column (title > description > genres) behind a GIN index."""
+
+    config = 'english'
+
+    def install(self, schema_editor):
+        schema_editor.execute(f'ALTER TABLE {MOVIE_TABLE} ADD COLUMN search_vector tsvector')
+        schema_editor.execute(f'CREATE INDEX movie_search_vector_idx ON {MOVIE_TABLE} USING GIN (search_vector)')
+        self.rebuild(schema_editor.connection)
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f'ALTER TABLE {MOVIE_TABLE} DROP COLUMN search_vector')
+
+    def _update(self, db_connection, where='', params=()):
+        with db_connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {MOVIE_TABLE} m SET search_vector =
+                    setweight(to_tsvector(%s, coalesce(m.title, '')), 'A') ||
+                    setweight(to_tsvector(%s, coalesce(m.description, '')), 'B') ||
+                    setweight(to_tsvector(%s, coalesce((
+                        SELECT string_agg(g.name, ' ') FROM {GENRE_TABLE} g
+                        JOIN {MOVIE_GENRES_TABLE} mg ON mg.genre_id = g.id
+                        WHERE mg.movie_id = m.id
+                    ), '')), 'C')
+                {where}
+                """,
+                [self.config, self.config, self.config, *params],
+            )
+
+    def index(self, movie_ids):
+        if movie_ids:
+            self._update(connection, 'WHERE m.id = ANY(%s)', [list(movie_ids)])
+
+    def rebuild(self, db_connection=connection):
+        self._update(db_connection)
+
+    def tsquery(self, query):
+        # prefix match on every word: "dark kni" -> dark:* & kni:*
+        return ' & '.join(f'{term}:*' for term in search_terms(query))
+
+    def filter(self, queryset, query):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return queryset.none()
+        return queryset.filter(RawSQL(
+            f'"{MOVIE_TABLE}"."search_vector" @@ to_tsquery(%s, %s)',
+            [self.config, tsquery],
+            output_field=BooleanField(),
+        ))
+
+    def rank(self, queryset, query):
+        return queryset.annotate(search_rank=RawSQL(
+            # float8 keeps the rank exact when it is sent back in a pagination cursor
+            f'ts_rank("{MOVIE_TABLE}"."search_vector", to_tsquery(%s, %s))::double precision',
+            [self.config, self.tsquery(query)],
+            output_field=FloatField(),
+        ))
+
+
+class SQLiteSearchBackend(SimpleSearchBackend):
+    """FTS5 virtual table keyed by movie id, ranked with bm25."""
+
+    table = f'{MOVIE_TABLE}_fts'
+    # bm25 column weights: title, description, genres
+    weights = (10.0, 3.0, 1.0)
+
+    def install(self, schema_editor):
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {self.table} USING fts5('
+            f"title, description, genres, tokenize='unicode61 remove_diacritics 2')"
+        )
+        self.rebuild(schema_editor.connection)
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute(f'DROP TABLE {self.table}')
+
+    def _insert(self, cursor, where='', params=()):
+        cursor.execute(
+            f"""
+            INSERT INTO {self.table} (rowid, title, description, genres)
+            SELECT m.id, m.title, m.description, coalesce((
+                SELECT group_concat(g.name, ' ') FROM {GENRE_TABLE} g
+                JOIN {MOVIE_GENRES_TABLE} mg ON mg.genre_id = g.id
+                WHERE mg.movie_id = m.id
+            ), '')
+            FROM {MOVIE_TABLE} m {where}
+            """,
+            params,
+        )
+
+    def index(self, movie_ids):
+        if not movie_ids:
+            return
+        movie_ids = list(movie_ids)
+        placeholders = ', '.join(['%s'] * len(movie_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', movie_ids)
+            self._insert(cursor, f'WHERE m.id IN ({placeholders})', movie_ids)
+
+    def rebuild(self, db_connection=connection):
+        with db_connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            self._insert(cursor)
+
+    def remove(self, movie_ids):
+        if not movie_ids:
+            return
+        movie_ids = list(movie_ids)
+        placeholders = ', '.join(['%s'] * len(movie_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', movie_ids)
+
+    def match(self, query):
+        # prefix match on every word: "dark kni" -> "dark"* "kni"*
+        return ' '.join(f'"{term}"*' for term in search_terms(query))
+
+    def filter(self, queryset, query):
+        match = self.match(query)
+        if not match:
+            return queryset.none()
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [match])
+        )
+
+    def rank(self, queryset, query):
+        weights = ', '.join(str(weight) for weight in self.weights)
+        # bm25 is "lower is better", negated to sort like the postgres rank
+        return queryset.annotate(search_rank=RawSQL(
+            f'SELECT -bm25({self.table}, {weights}) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND rowid = "{MOVIE_TABLE}"."id"',
+            [self.match(query)],
+            output_field=FloatField(),
+        ))
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_search_backend(db_connection=connection):
+    return BACKENDS.get(db_connection.vendor, SimpleSearchBackend)()
@@ -0,0 +1,270 @@
+import io
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .leaderboard import refresh_leaderboard
+from .models import Favorite, Genre, Movie, Rating, Review, TopMovie, UserMovieList, MovieImage
+from .ratings import rebuild_rating_stats
+from .search import get_search_backend
+
+GENRES = ['Action', 'Comedy', 'Horror', 'Sci-Fi', 'Drama',
+          'Crime', 'Romance', 'Adventure', 'Animation', 'Biography', 'Fantasy', 'Thriller']
+USERNAME_PREFIX = 'seed_'
+TITLE_WORDS = (
+    'dark night star lost last city river shadow empire secret silent broken golden winter storm '
+    'return rise fall game dream iron glass ghost road blood heart king queen war sea fire moon'
+).split()
+REVIEW_PHRASES = (
+    'Loved every minute of it.', 'The pacing drags in the middle.', 'Great cast, weak script.',
+    'A must-see on the big screen.', 'Not as good as the original.', 'The ending caught me off guard.',
+    'Beautifully shot.', 'Too long by half an hour.', 'The soundtrack carries the whole film.',
+)
+# tables emptied before a synthetic load, children first
+CLEARED_MODELS = [
+    Favorite, Rating, Review, TopMovie, MovieImage, UserMovieList.movies.through,
+    Movie.genres.through, Movie, Genre,
+]
+
+
+class ZipfSampler:
+    """
+    Draws distinct items by popularity: the item of rank k is picked with probability
+    proportional to 1 / k**exponent, so a few blockbusters get most of the votes.
+    """
+
+    def __init__(self, items, exponent, rng):
+        self.items = items
+        self.rng = rng
+        self.cum_weights = list(accumulate(1 / rank ** exponent for rank in range(1, len(items) + 1)))
+
+    def sample(self, count):
+        count = min(count, len(self.items))
+        if count > len(self.items) // 2:
+            # rejection sampling stalls when most items are wanted
+            return self.rng.sample(self.items, count)
+        # a dict keeps the draw order, a set of ids would make the rest of the run depend on the ids
+        picked = {}
+        while len(picked) < count:
+            picked.update(dict.fromkeys(self.rng.choices(self.items, cum_weights=self.cum_weights, k=count - len(picked))))
+        return list(picked)
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def insert_rows(model, columns, rows, db_connection=connection):
+    # COPY on PostgreSQL, executemany elsewhere; one transaction per chunk
+    table = db_connection.ops.quote_name(model._meta.db_table)
+    column_list = ', '.join(db_connection.ops.quote_name(column) for column in columns)
+    with transaction.atomic(using=db_connection.alias), db_connection.cursor() as cursor:
+        if db_connection.vendor == 'postgresql':
+            data = ''.join('\t'.join(copy_value(value) for value in row) + '\n' for row in rows)
+            sql = f'COPY {table} ({column_list}) FROM STDIN'
+            if hasattr(cursor, 'copy_expert'):
+                cursor.copy_expert(sql, io.StringIO(data))
+            else:
+                with cursor.copy(sql) as copy:
+                    copy.write(data)
+        else:
+            placeholders = ', '.join(['%s'] * len(columns))
+            cursor.executemany(f'INSERT INTO {table} ({column_list}) VALUES ({placeholders})', rows)
+
+
+class BulkLoader:
+    """Buffers rows per model and writes them with insert_rows() once a buffer holds chunk_size rows."""
+
+    def __init__(self, chunk_size, db_connection=connection):
+        self.chunk_size = chunk_size
+        self.connection = db_connection
+        self.buffers = {}
+        self.columns = {}
+        self.counts = {}
+
+    def add(self, model, columns, row):
+        buffer = self.buffers.setdefault(model, [])
+        self.columns[model] = columns
+        buffer.append(row)
+        if len(buffer) >= self.chunk_size:
+            self.flush(model)
+
+    def flush(self, model=None):
+        for name in [model] if model else list(self.buffers):
+            rows = self.buffers.pop(name, None)
+            if rows:
+                insert_rows(name, self.columns[name], rows, self.connection)
+                self.counts[name] = self.counts.get(name, 0) + len(rows)
+
+
+@contextmanager
+def fast_load(models, db_connection=connection):
+    """
+    Bulk load mode: secondary indexes are dropped for the load and built once at the end,
+    and commits skip the fsync. Unique constraints are dropped too, except on SQLite where
+    they live in the table definition and dropping one means copying the whole table.
+    """
+    if db_connection.in_atomic_block:
+        # schema changes would stay locked in the caller's transaction (SQLite refuses them there)
+        yield
+        return
+    drop_constraints = db_connection.vendor != 'sqlite'
+    with db_connection.schema_editor() as editor:
+        for model in models:
+            for index in model._meta.indexes:
+                editor.remove_index(model, index)
+            for constraint in model._meta.constraints if drop_constraints else ():
+                editor.remove_constraint(model, constraint)
+    with db_connection.cursor() as cursor:
+        if db_connection.vendor == 'postgresql':
+            cursor.execute('SET synchronous_commit TO OFF')
+        elif db_connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA synchronous')
+            synchronous = cursor.fetchone()[0]
+            cursor.execute('PRAGMA synchronous = OFF')
+    try:
+        yield
+    finally:
+        with db_connection.cursor() as cursor:
+            if db_connection.vendor == 'postgresql':
+                cursor.execute('RESET synchronous_commit')
+            elif db_connection.vendor == 'sqlite':
+                cursor.execute(f'PRAGMA synchronous = {synchronous}')
+        with db_connection.schema_editor() as editor:
+            for model in models:
+                for index in model._meta.indexes:
+                    editor.add_index(model, index)
+                for constraint in model._meta.constraints if drop_constraints else ():
+                    editor.add_constraint(model, constraint)
+
+
+def clear_catalog(db_connection=connection):
+    # raw deletes, the ORM collector would load every rating to run its signals
+    tables = [db_connection.ops.quote_name(model._meta.db_table) for model in CLEARED_MODELS]
+    with transaction.atomic(using=db_connection.alias), db_connection.cursor() as cursor:
+        if db_connection.vendor == 'postgresql':
+            cursor.execute(f'TRUNCATE {", ".join(tables)} RESTART IDENTITY CASCADE')
+        else:
+            for table in tables:
+                cursor.execute(f'DELETE FROM {table}')
+    get_user_model().objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+
+def seed_catalog(movies, users, ratings_per_user=50, reviews_per_user=1, favorites_per_user=3,
+                 zipf_exponent=1.1, seed=0, password=None, chunk_size=10000, progress=None):
+    """
+    Replaces the catalog with a synthetic one. The same seed always produces the same data.
+    Vote counts per user are exponentially distributed around ratings_per_user, movies are
+    picked by Zipfian popularity; reviews and favorites come from each user's rated movies.
+    Returns {model name: created rows}.
+    """
+    progress = progress or (lambda message: None)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    User = get_user_model()
+
+    progress('Deleting old data...')
+    clear_catalog()
+    genres = [Genre.objects.create(name=name) for name in GENRES]
+    loader = BulkLoader(chunk_size)
+
+    progress(f'Creating {movies} movies...')
+    first_release = date(1950, 1, 1)
+    movie_ids = []
+    for chunk in chunked(range(movies), chunk_size):
+        batch, links = [], []
+        for number in chunk:
+            movie_genres = rng.sample(genres, rng.randint(1, 3))
+            words = rng.sample(TITLE_WORDS, rng.randint(1, 3))
+            batch.append(Movie(
+                title=f"{' '.join(words).title()} {number + 1}",
+                description=f"A {' and '.join(genre.name.lower() for genre in movie_genres)} story about "
+                            f"{' '.join(rng.sample(TITLE_WORDS, 4))}.",
+                release_date=first_release + timedelta(days=rng.randrange(75 * 365)),
+                duration=rng.randint(75, 200),
+                is_highlight=rng.random() < 0.001,
+                genre_mask=sum(genre.mask for genre in movie_genres),
+            ))
+            links.append(movie_genres)
+        Movie.objects.bulk_create(batch)
+        for movie, movie_genres in zip(batch, links):
+            movie_ids.append(movie.pk)
+            for genre in movie_genres:
+                loader.add(Movie.genres.through, ['movie_id', 'genre_id'], (movie.pk, genre.pk))
+    loader.flush()
+
+    progress(f'Creating {users} users...')
+    # one hash for everybody, hashing per user would take longer than the whole load
+    password_hash = make_password(password)
+    user_ids = []
+    for chunk in chunked(range(users), chunk_size):
+        batch = [User(username=f'{USERNAME_PREFIX}{number + 1}', password=password_hash) for number in chunk]
+        User.objects.bulk_create(batch)
+        user_ids += [user.pk for user in batch]
+
+    progress(f'Creating ~{users * ratings_per_user} ratings...')
+    popularity = movie_ids[:]
+    rng.shuffle(popularity)
+    sampler = ZipfSampler(popularity, zipf_exponent, rng)
+    quality = {movie_id: rng.uniform(1.5, 4.5) for movie_id in movie_ids}
+    now = timezone.now()
+    rating_columns = ['user_id', 'movie_id', 'value']
+    review_columns = ['user_id', 'movie_id', 'text', 'created_at']
+    favorite_columns = ['user_id', 'movie_id', 'created_at']
+
+    def moment():
+        return connection.ops.adapt_datetimefield_value(now - timedelta(seconds=rng.randrange(365 * 24 * 3600)))
+
+    def some(items, mean):
+        # random subset, its size exponentially distributed around mean
+        if not mean:
+            return []
+        return rng.sample(items, min(len(items), round(rng.expovariate(1 / mean))))
+
+    with fast_load([Rating, Review, Favorite]):
+        for user_id in user_ids:
+            picked = sampler.sample(max(1, round(rng.expovariate(1 / ratings_per_user)))) if ratings_per_user else []
+            votes = [(movie_id, min(5, max(1, round(rng.gauss(quality[movie_id], 1))))) for movie_id in picked]
+            for movie_id, value in votes:
+                loader.add(Rating, rating_columns, (user_id, movie_id, value))
+            for movie_id, value in some(votes, reviews_per_user):
+                text = ' '.join(rng.sample(REVIEW_PHRASES, rng.randint(1, 3)))
+                loader.add(Review, review_columns, (user_id, movie_id, text, moment()))
+            for movie_id in some([movie_id for movie_id, value in votes if value >= 4], favorites_per_user):
+                loader.add(Favorite, favorite_columns, (user_id, movie_id, moment()))
+        loader.flush()
+        progress('Rebuilding indexes...')
+
+    progress('Updating rating aggregates, leaderboard and search index...')
+    rebuild_rating_stats()
+    refresh_leaderboard()
+    get_search_backend().rebuild()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    cache.clear()
+
+    counts = {
+        'movies': len(movie_ids),
+        'users': len(user_ids),
+        'ratings': loader.counts.get(Rating, 0),
+        'reviews': loader.counts.get(Review, 0),
+        'favorites': loader.counts.get(Favorite, 0),
+    }
+    progress(f'Loaded {sum(counts.values())} rows in {time.perf_counter() - started:.1f}s')
+    return counts
@@ -0,0 +1,124 @@
+from django.conf import settings
+from django.db.models.functions import Now
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import CATALOG, CATALOG_RATINGS, HIGHLIGHTS, LEADERBOARD, invalidate, invalidate_throttled, movie_namespace
+from .genres import update_genre_masks
+from .images import schedule_derivatives
+from .leaderboard import schedule_leaderboard_update
+from .models import Genre, Movie, MovieImage, Rating, Review
+from .ratings import apply_rating_delta, rating_delta, rebuild_rating_stats, removal_deltas, shift_votes
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Rating)
+def add_rating_to_stats(sender, instance, created, **kwargs):
+    if created:
+        apply_rating_delta(instance.movie_id, rating_delta(None, instance.value))
+    elif not hasattr(instance, '_stored_vote'):
+        # instance wasn't loaded from db, so the previous vote is unknown
+        rebuild_rating_stats(Movie.objects.filter(pk=instance.movie_id))
+    else:
+        old_movie_id, old_value = instance._stored_vote
+        if old_movie_id == instance.movie_id:
+            apply_rating_delta(instance.movie_id, rating_delta(old_value, instance.value))
+        else:
+            apply_rating_delta(old_movie_id, rating_delta(old_value, None))
+            apply_rating_delta(instance.movie_id, rating_delta(None, instance.value))
+            schedule_leaderboard_update(old_movie_id)
+            invalidate(movie_namespace(old_movie_id))
+    instance._stored_vote = (instance.movie_id, instance.value)
+    schedule_leaderboard_update(instance.movie_id)
+    # catalog cards show and sort by the average, they may catch up a little later;
+    # the leaderboard invalidates itself
+    invalidate(movie_namespace(instance.movie_id))
+    invalidate_throttled(CATALOG_RATINGS, settings.CATALOG_RATINGS_REFRESH)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def remember_user_votes(sender, instance, **kwargs):
+    # the user's ratings go in the cascade's single DELETE (Rating has no delete signals),
+    # their votes leave the aggregates once per movie after it
+    instance._removed_votes = removal_deltas(Rating.objects.filter(user=instance))
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_votes_deleted(sender, instance, **kwargs):
+    shift_votes(getattr(instance, '_removed_votes', {}))
+
+
+@receiver(post_save, sender=Movie)
+def index_movie(sender, instance, **kwargs):
+    get_search_backend().index([instance.pk])
+    invalidate(HIGHLIGHTS, LEADERBOARD, CATALOG, movie_namespace(instance.pk))
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=MovieImage)
+def image_saved(sender, instance, **kwargs):
+    schedule_derivatives(instance)
+
+
+@receiver(post_delete, sender=Movie)
+def unindex_movie(sender, instance, **kwargs):
+    get_search_backend().remove([instance.pk])
+    invalidate(HIGHLIGHTS, LEADERBOARD, CATALOG, movie_namespace(instance.pk))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed(sender, instance, **kwargs):
+    # reviews are part of the movie page, its Last-Modified/ETag follows them
+    Movie.objects.filter(pk=instance.movie_id).update(updated_at=Now())
+    invalidate(movie_namespace(instance.movie_id))
+
+
+@receiver(post_save, sender=MovieImage)
+@receiver(post_delete, sender=MovieImage)
+def movie_image_changed(sender, instance, **kwargs):
+    # extra images are only shown as carousel covers
+    invalidate(HIGHLIGHTS)
+
+
+def genres_changed(movie_ids):
+    movie_ids = list(movie_ids)
+    update_genre_masks(movie_ids)
+    get_search_backend().index(movie_ids)
+    invalidate(CATALOG, *[movie_namespace(movie_id) for movie_id in movie_ids])
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # genre.movies.clear() doesn't report which movies lost the genre
+        instance._cleared_movie_ids = list(instance.movies.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        if not reverse:
+            movie_ids = [instance.pk]
+        elif action == 'post_clear':
+            movie_ids = getattr(instance, '_cleared_movie_ids', [])
+        else:
+            movie_ids = pk_set
+        genres_changed(movie_ids)
+
+
+@receiver(post_save, sender=Genre)
+def index_renamed_genre(sender, instance, created, **kwargs):
+    if created:
+        invalidate(CATALOG)
+    else:
+        movie_ids = list(instance.movies.values_list('pk', flat=True))
+        Movie.objects.filter(pk__in=movie_ids).update(updated_at=Now())
+        get_search_backend().index(movie_ids)
+        invalidate(CATALOG, *[movie_namespace(movie_id) for movie_id in movie_ids])
+
+
+@receiver(pre_delete, sender=Genre)
+def remember_genre_movies(sender, instance, **kwargs):
+    instance._deleted_movie_ids = list(instance.movies.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+def genre_deleted(sender, instance, **kwargs):
+    genres_changed(getattr(instance, '_deleted_movie_ids', []))
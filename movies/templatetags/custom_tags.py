@@ -1,8 +1,52 @@
 from django import template
+from django.utils.html import format_html, format_html_join
+
+from movies.images import FORMATS, current_derivatives
+from users import roles
+from users.activity import ACTIONS
 
 register = template.Library()
 
 
 @register.filter
 def is_moderator(user):
-    return user.is_superuser or user.groups.filter(name='Moderators').exists()
+    return roles.is_moderator(user)
+
+
+@register.filter
+def activity_label(action):
+    return ACTIONS.get(action, action)
+
+
+@register.filter
+def srcset(item, fmt='jpeg'):
+    # "url 160w, url 320w" of the item's image derivatives in one format, '' while there are none
+    storage = item.image.storage
+    return ', '.join(f'{storage.url(name)} {width}w' for width, name in current_derivatives(item).get(fmt, []))
+
+
+@register.simple_tag
+def picture(item, sizes='100vw', **attrs):
+    """
+    <picture> with AVIF/WebP sources and a JPEG <img> for a Movie or MovieImage, so the browser
+    downloads the smallest copy that fills `sizes`. Falls back to the original image while
+    derivatives are being generated. Other keyword arguments become <img> attributes.
+    """
+    if not item or not item.image:
+        return ''
+    attrs.setdefault('loading', 'lazy')
+    derivatives = current_derivatives(item)
+    if not derivatives.get('jpeg'):
+        return format_html('<img src="{}"{}>', item.image.url, format_html_join('', ' {}="{}"', attrs.items()))
+    sources = format_html_join(
+        '', '<source type="{}" srcset="{}" sizes="{}">',
+        ((FORMATS[fmt][1], srcset(item, fmt), sizes) for fmt in FORMATS if fmt != 'jpeg' and derivatives.get(fmt)),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        sources,
+        item.image.storage.url(derivatives['jpeg'][-1][1]),
+        srcset(item, 'jpeg'),
+        sizes,
+        format_html_join('', ' {}="{}"', attrs.items()),
+    )
@@ -1,12 +1,54 @@
+import gzip
 import json
+import os
+import tempfile
+import threading
 from datetime import date
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
+from asgiref.sync import iscoroutinefunction
+
+from django.apps import apps as django_apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase, Client
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image as PILImage
+from prometheus_client import REGISTRY
+from rest_framework_simplejwt.tokens import RefreshToken
 
-from movies.models import Genre, Movie, Review, Rating, UserMovieList
+from conf import dbpool, storage as storage_module
+from conf.benchmark import LatencyStats, percentile
+from conf.dbpool import register_pool_metrics
+from conf.middleware import MetricsTokenAuthMiddleware, QueryInspectorMiddleware
+from conf.queries import QueryBudgetExceeded, record_queries
+from conf.testing import QueryInspectorMixin
+from movies import views
+from movies.models import MAX_GENRES, Favorite, Genre, Movie, Review, Rating, UserMovieList
 from movies.models import MovieImage
+from movies.cache import CATALOG, CATALOG_RATINGS, invalidate, throttle_key, versions
+from movies.ingest import flush_ratings, get_rating_queue, queue_rating, write_votes
+from movies.favorites import favorite_ids, toggle_favorite
+from movies.importing import read_rows
+from movies.genres import filter_by_genres, genre_facets
+from movies.leaderboard import refresh_leaderboard
+from movies.management.commands.replay_traffic import endpoint_name, load_traffic
+from movies.pagination import KeysetPaginator
+from movies.models import TopMovie
+from movies.ratings import record_rating, rebuild_rating_stats
+from movies.search import get_search_backend
 
 User = get_user_model()
 
@@ -90,9 +132,1070 @@ class UserMovieListModelTest(TestCase):
         self.assertIn(self.movie, user_list.movies.all())
 
 
+class RatingStatsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.other_user = User.objects.create_user(username="otheruser", password="password")
+        self.movie = Movie.objects.create(
+            title="Inception",
+            description="A mind-bending thriller.",
+            release_date=date(2010, 7, 16),
+        )
+
+    def test_record_rating_updates_aggregates(self):
+        record_rating(self.user, self.movie, 4)
+        record_rating(self.other_user, self.movie, 5)
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_count, 2)
+        self.assertEqual(self.movie.rating_sum, 9)
+        self.assertEqual(self.movie.average_rating(), 4.5)
+        self.assertEqual(self.movie.rating_histogram(), {1: 0, 2: 0, 3: 0, 4: 1, 5: 1})
+
+    def test_changed_vote_moves_histogram(self):
+        record_rating(self.user, self.movie, 4)
+        record_rating(self.user, self.movie, 2)
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_count, 1)
+        self.assertEqual(self.movie.rating_avg, 2)
+        self.assertEqual(self.movie.votes_4, 0)
+        self.assertEqual(self.movie.votes_2, 1)
+
+    def test_deleted_rating_is_removed_from_aggregates(self):
+        rating = record_rating(self.user, self.movie, 3)
+        rating.delete()
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_count, 0)
+        self.assertEqual(self.movie.rating_avg, 0)
+
+    def test_deleting_user_shifts_aggregates_once_per_movie(self):
+        movies = [self.movie] + [
+            Movie.objects.create(title=f"Movie {i}", description="", release_date=date(2010, 1, 1)) for i in range(2)
+        ]
+        voters = [User.objects.create_user(username=f"voter{i}") for i in range(20)]
+        Rating.objects.bulk_create([
+            Rating(user=user, movie=movie, value=1 + i % 5) for i, user in enumerate(voters + [self.user])
+            for movie in movies
+        ])
+        rebuild_rating_stats()
+        with CaptureQueriesContext(connection) as queries:
+            self.user.delete()
+        # votes grouped per movie, the rating DELETE, one aggregate UPDATE per movie
+        self.assertEqual(sum('GROUP BY' in query['sql'] for query in queries), 1)
+        self.assertEqual(sum(query['sql'].startswith('DELETE FROM "movies_rating"') for query in queries), 1)
+        self.assertEqual(sum(query['sql'].startswith('UPDATE "movies_movie"') for query in queries), len(movies))
+
+        expected = {movie.pk: (movie.rating_count, movie.rating_sum) for movie in Movie.objects.all()}
+        rebuild_rating_stats()
+        self.assertEqual({movie.pk: (movie.rating_count, movie.rating_sum) for movie in Movie.objects.all()}, expected)
+        self.assertEqual(Movie.objects.get(pk=self.movie.pk).rating_count, 20)
+
+    def test_deleting_movie_skips_its_ratings_aggregates(self):
+        record_rating(self.user, self.movie, 3)
+        record_rating(self.other_user, self.movie, 4)
+        with CaptureQueriesContext(connection) as queries:
+            self.movie.delete()
+        self.assertFalse(any(query['sql'].startswith('UPDATE "movies_movie"') for query in queries))
+        self.assertFalse(Rating.objects.exists())
+
+    def test_rating_filters_skip_unrated_movies(self):
+        cache.clear()
+        unrated = Movie.objects.create(title="Unrated", description="-", release_date=date(2011, 1, 1))
+        record_rating(self.user, self.movie, 2)
+        for params in [{"rating_max": "3"}, {"rating_min": "0"}]:
+            movies = list(self.client.get(reverse("catalog"), params).context["movies"])
+            self.assertEqual(movies, [self.movie])
+        self.assertIn(unrated, self.client.get(reverse("catalog")).context["movies"])
+
+    def test_database_rejects_out_of_range_votes(self):
+        for value in (0, 6):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                Rating.objects.create(user=self.user, movie=self.movie, value=value)
+
+    def test_rebuild_rating_stats(self):
+        Rating.objects.create(movie=self.movie, user=self.user, value=1)
+        Rating.objects.create(movie=self.movie, user=self.other_user, value=4)
+        rebuild_rating_stats()
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_count, 2)
+        self.assertEqual(self.movie.rating_avg, 2.5)
+        self.assertEqual(self.movie.votes_1, 1)
+
+
+@override_settings(TOP_MOVIES_MIN_VOTES=2)
+class LeaderboardTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f"user{i}", password="password") for i in range(4)]
+        self.single_vote = Movie.objects.create(title="Unknown", description="-", release_date=date(2020, 1, 1))
+        self.popular = Movie.objects.create(title="Popular", description="-", release_date=date(2020, 1, 1))
+
+    def vote(self, movie, values):
+        with self.captureOnCommitCallbacks(execute=True):
+            for user, value in zip(self.users, values):
+                record_rating(user, movie, value)
+
+    def test_weighted_rank_beats_single_vote(self):
+        self.vote(self.popular, [5, 5, 4, 5])
+        self.vote(self.single_vote, [5])
+        refresh_leaderboard()
+        self.assertEqual([entry.movie for entry in TopMovie.objects.all()], [self.popular])
+
+    def test_leaderboard_updates_incrementally(self):
+        self.vote(self.popular, [3, 3, 3])
+        self.assertTrue(TopMovie.objects.filter(movie=self.popular).exists())
+        self.vote(self.single_vote, [5, 5, 5])
+        self.assertEqual(TopMovie.objects.first().movie, self.single_vote)
+
+    def test_dropping_movie_makes_room_for_a_better_one(self):
+        with mock.patch("movies.leaderboard.LEADERBOARD_SIZE", 1):
+            self.vote(self.popular, [5, 5, 5])
+            self.vote(self.single_vote, [4, 4, 4])
+            self.assertEqual([entry.movie for entry in TopMovie.objects.all()], [self.popular])
+            self.vote(self.popular, [1, 1, 1])
+            self.assertEqual([entry.movie for entry in TopMovie.objects.all()], [self.single_vote])
+
+    def test_home_reads_leaderboard(self):
+        self.vote(self.popular, [4, 4])
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, reverse("movie_detail", args=[self.popular.id]))
+        self.assertNotContains(response, reverse("movie_detail", args=[self.single_vote.id]))
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # duplicated sort keys check that ties are broken by id
+        for i in range(7):
+            Movie.objects.create(
+                title=f"Movie {i % 3}",
+                description="-",
+                release_date=date(2000 + i % 2, 1, 1),
+                rating_avg=i % 4,
+            )
+
+    def walk(self, sort_field, descending):
+        paginator = KeysetPaginator(Movie.objects.all(), sort_field, descending=descending, per_page=3)
+        seen, cursor = [], None
+        while True:
+            page = paginator.get_page(cursor)
+            seen.extend(movie.pk for movie in page)
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_pages_cover_every_sort_option(self):
+        for sort_field in ['title', 'release_date', 'rating_avg']:
+            for descending in [False, True]:
+                direction = '-' if descending else ''
+                expected = list(
+                    Movie.objects.order_by(f'{direction}{sort_field}', f'{direction}pk').values_list('pk', flat=True)
+                )
+                self.assertEqual(self.walk(sort_field, descending), expected)
+
+    def test_invalid_cursor_returns_first_page(self):
+        paginator = KeysetPaginator(Movie.objects.all(), 'title', per_page=3)
+        self.assertEqual(list(paginator.get_page('broken')), list(paginator.get_page()))
+
+    def test_catalog_more_returns_next_fragment(self):
+        response = self.client.get(reverse("catalog"), {"sort": "year", "order": "desc"})
+        self.assertEqual(len(response.context["movies"]), 7)
+        self.assertIsNone(response.context["next_query"])
+
+        with mock.patch("movies.views.CATALOG_PAGE_SIZE", 5):
+            response = self.client.get(reverse("catalog"), {"sort": "year"})
+            more = self.client.get(reverse("catalog_more") + "?" + response.context["next_query"]).json()
+        self.assertIsNone(more["next_query"])
+        self.assertEqual(more["html"].count("/movie/"), 2)
+
+
+class MovieSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.thriller = Genre.objects.create(name="Thriller")
+        self.inception = Movie.objects.create(
+            title="Inception", description="A thief enters dreams.", release_date=date(2010, 7, 16)
+        )
+        self.dreams = Movie.objects.create(
+            title="Dreamscape", description="Inception of a nightmare.", release_date=date(1984, 8, 15)
+        )
+        self.other = Movie.objects.create(title="Titanic", description="A ship.", release_date=date(1997, 12, 19))
+
+    def search(self, query):
+        return list(get_search_backend().search(Movie.objects.all(), query).order_by('-search_rank', 'pk'))
+
+    def test_title_match_ranks_first(self):
+        self.assertEqual(self.search("inception"), [self.inception, self.dreams])
+
+    def test_prefix_match(self):
+        self.assertEqual(self.search("drea"), [self.dreams, self.inception])
+
+    def test_index_follows_genres(self):
+        self.other.genres.add(self.thriller)
+        self.assertEqual(self.search("thriller"), [self.other])
+        self.thriller.name = "Disaster"
+        self.thriller.save()
+        self.assertEqual(self.search("thriller"), [])
+        self.assertEqual(self.search("disaster"), [self.other])
+        self.other.genres.clear()
+        self.assertEqual(self.search("disaster"), [])
+
+    def test_index_follows_movie_changes(self):
+        self.other.title = "Inception 2"
+        self.other.save()
+        self.assertIn(self.other, self.search("inception"))
+        self.other.delete()
+        self.assertEqual(self.search("inception"), [self.inception, self.dreams])
+
+    def test_catalog_sorts_search_by_relevance(self):
+        response = self.client.get(reverse("catalog"), {"search": "Inception"})
+        self.assertEqual(response.context["sort_option"], "relevance")
+        self.assertEqual(list(response.context["movies"]), [self.inception, self.dreams])
+        response = self.client.get(reverse("catalog"), {"search": "!!!"})
+        self.assertEqual(list(response.context["movies"]), [])
+
+    def test_relevance_pages(self):
+        paginator = KeysetPaginator(
+            get_search_backend().search(Movie.objects.all(), "inception"), "search_rank", descending=True, per_page=1
+        )
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        self.assertEqual(list(first) + list(second), [self.inception, self.dreams])
+        self.assertFalse(second.has_next)
+
+
+class GenreBitmaskTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.action = Genre.objects.create(name="Action")
+        self.drama = Genre.objects.create(name="Drama")
+        self.comedy = Genre.objects.create(name="Comedy")
+        self.both = Movie.objects.create(title="Both", description="-", release_date=date(2000, 1, 1))
+        self.both.genres.add(self.action, self.drama)
+        self.drama_only = Movie.objects.create(title="Drama", description="-", release_date=date(2000, 1, 1))
+        self.drama.movies.add(self.drama_only)
+        self.plain = Movie.objects.create(title="Plain", description="-", release_date=date(2000, 1, 1))
+
+    def test_genres_get_distinct_bits(self):
+        self.assertEqual(len({self.action.bit, self.drama.bit, self.comedy.bit}), 3)
+
+    def test_migration_refuses_too_many_genres(self):
+        fill_genre_masks = import_module('movies.migrations.0006_genre_bitmask').fill_genre_masks
+        Genre.objects.bulk_create([Genre(name=f"Genre {bit}", bit=bit) for bit in range(3, MAX_GENRES + 1)])
+        with self.assertRaisesMessage(ValueError, f'genre_mask fits only {MAX_GENRES}'):
+            fill_genre_masks(django_apps, None)
+
+    def test_mask_follows_genres(self):
+        self.both.refresh_from_db()
+        self.assertEqual(self.both.genre_mask, self.action.mask | self.drama.mask)
+        self.both.genres.remove(self.action)
+        self.both.refresh_from_db()
+        self.assertEqual(self.both.genre_mask, self.drama.mask)
+        self.drama.delete()
+        self.both.refresh_from_db()
+        self.assertEqual(self.both.genre_mask, 0)
+
+    def test_any_and_all_filters(self):
+        movies = Movie.objects.order_by('pk')
+        self.assertEqual(list(filter_by_genres(movies, [self.action, self.drama])), [self.both, self.drama_only])
+        self.assertEqual(list(filter_by_genres(movies, [self.action, self.drama], match_all=True)), [self.both])
+        self.assertEqual(list(filter_by_genres(movies, [])), [self.both, self.drama_only, self.plain])
+
+    def test_facet_counts(self):
+        facets = genre_facets(Movie.objects.all(), [self.action, self.drama, self.comedy])
+        self.assertEqual(facets, {self.action.pk: 1, self.drama.pk: 2, self.comedy.pk: 0})
+
+    def test_catalog_genre_filter(self):
+        response = self.client.get(reverse("catalog"), {"genres": [self.action.pk, self.drama.pk], "genre_mode": "all"})
+        self.assertEqual(list(response.context["movies"]), [self.both])
+        self.assertContains(response, "Drama (2)")
+
+
+class QueryInspectorTest(QueryInspectorMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(6):
+            movie = Movie.objects.create(
+                title=f"Movie {i}", description="-", release_date=date(2000, 1, 1), is_highlight=True
+            )
+            MovieImage.objects.create(movie=movie, image="images/extra/test.jpg")
+
+    def test_repeated_queries_are_reported_with_origin(self):
+        with record_queries() as recorder:
+            for movie in Movie.objects.all():
+                list(movie.extra_images.all())
+        [(shape, times, origin)] = recorder.repeated()
+        self.assertEqual(times, 6)
+        self.assertIn("movies_movieimage", shape)
+        self.assertIn("movies/tests.py", origin)
+
+    def test_in_lists_share_one_shape(self):
+        with record_queries(threshold=2) as recorder:
+            list(Movie.objects.filter(pk__in=[1, 2]))
+            list(Movie.objects.filter(pk__in=[1, 2, 3]))
+        self.assertEqual(len(recorder.repeated()), 1)
+
+    def test_mixin_fails_on_repeated_queries(self):
+        with self.assertRaises(self.failureException):
+            self.assertNoRepeatedQueries(lambda: [list(movie.extra_images.all()) for movie in Movie.objects.all()])
+
+    def test_view_over_budget_fails(self):
+        with mock.patch.object(views.home, "query_budget", 1):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse("home"))
+
+    def test_queries_are_exported_to_prometheus(self):
+        def observed():
+            return REGISTRY.get_sample_value("django_http_request_queries_by_view_count", {"view": "catalog"}) or 0
+
+        before = observed()
+        self.client.get(reverse("catalog"))
+        self.assertEqual(observed(), before + 1)
+
+    @override_settings(QUERY_INSPECTOR_HEADER=True)
+    async def test_async_requests_stay_in_the_event_loop(self):
+        async def view(request):
+            return HttpResponse(str(await Movie.objects.acount()))
+
+        # built on an async chain, the middlewares are coroutines themselves: Django doesn't adapt them
+        middleware = MetricsTokenAuthMiddleware(QueryInspectorMiddleware(view))
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = await middleware(AsyncRequestFactory().get("/"))
+        self.assertEqual((response.content, response["X-Query-Count"]), (b"6", "1"))
+        self.assertEqual((await middleware(AsyncRequestFactory().get("/metrics"))).status_code, 403)
+
+
+class ViewQueryCountTest(QueryInspectorMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.moderator = User.objects.create_user(username="moderator", password="password")
+        self.moderator.groups.add(Group.objects.get_or_create(name="Moderators")[0])
+        self.genre = Genre.objects.create(name="Action")
+        self.movie = Movie.objects.create(title="Detail", description="-", release_date=date(2000, 1, 1))
+        self.movie.genres.add(self.genre)
+        self.add_movies(1)
+
+    def add_movies(self, count):
+        movies = []
+        for i in range(count):
+            movie = Movie.objects.create(
+                title=f"Movie {i}", description="-", release_date=date(2000, 1, 1), is_highlight=True
+            )
+            movie.genres.add(self.genre)
+            MovieImage.objects.create(movie=movie, image="images/extra/test.jpg")
+            author = User.objects.create_user(username=f"author{movie.pk}", password="password")
+            # every new movie adds a row to each page under test
+            Review.objects.create(movie=self.movie, user=author, text="-", updated_by=self.moderator)
+            Review.objects.create(movie=movie, user=self.user, text="-")
+            record_rating(self.user, movie, 4)
+            Favorite.objects.create(user=self.user, movie=movie)
+            movies.append(movie)
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_leaderboard()
+        return movies
+
+    def query_counts(self, url, login=None):
+        # number of queries for the page with few and with many rows
+        counts = []
+        for extra_movies in (0, 4):
+            self.add_movies(extra_movies)
+            if login:
+                self.client.login(username=login, password="password")
+            # steady state: role cache warmed by an earlier request
+            self.client.get(url)
+            with record_queries() as recorder:
+                response = self.assertNoRepeatedQueries(self.client.get, url)
+            self.assertEqual(response.status_code, 200)
+            counts.append(recorder.count)
+        return counts
+
+    def assertConstantQueries(self, url, login=None):
+        few, many = self.query_counts(url, login)
+        self.assertEqual(few, many)
+
+    def test_home(self):
+        self.assertConstantQueries(reverse("home"))
+
+    def test_catalog(self):
+        self.assertConstantQueries(reverse("catalog"))
+
+    def test_movie_detail(self):
+        self.assertConstantQueries(reverse("movie_detail", args=[self.movie.pk]), login="testuser")
+
+    def test_profile(self):
+        self.assertConstantQueries(reverse("profile"), login="testuser")
+
+    def test_moderation_dashboard(self):
+        self.assertConstantQueries(reverse("moderation_dashboard"), login="moderator")
+
+
+class PageCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.movie = Movie.objects.create(
+            title="Inception", description="-", release_date=date(2010, 7, 16), is_highlight=True
+        )
+        MovieImage.objects.create(movie=self.movie, image="images/extra/test.jpg")
+
+    def test_catalog_pages_are_cached_by_normalized_params(self):
+        self.client.get(reverse("catalog"), {"sort": "title", "search": ""})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("catalog"), {"search": " ", "sort": "title"})
+        self.assertEqual(list(response.context["movies"]), [self.movie])
+
+    def test_catalog_sees_new_movies_and_votes(self):
+        record_rating(self.user, self.movie, 3)
+        self.client.get(reverse("catalog"))
+        other = Movie.objects.create(title="Titanic", description="-", release_date=date(1997, 12, 19))
+        response = self.client.get(reverse("catalog"), {"sort": "rating", "order": "desc"})
+        self.assertEqual(list(response.context["movies"]), [self.movie, other])
+
+        # votes refresh cached pages at most once per CATALOG_RATINGS_REFRESH, the first one did
+        with self.captureOnCommitCallbacks(execute=True):
+            record_rating(self.user, other, 4)
+        response = self.client.get(reverse("catalog"), {"sort": "rating", "order": "desc"})
+        self.assertEqual(list(response.context["movies"]), [self.movie, other])
+        cache.delete(throttle_key(CATALOG_RATINGS))
+        response = self.client.get(reverse("catalog"), {"sort": "rating", "order": "desc"})
+        self.assertEqual(list(response.context["movies"]), [other, self.movie])
+
+    def test_votes_dont_drop_catalog_data_they_dont_change(self):
+        record_rating(self.user, self.movie, 3)
+        before = versions(CATALOG, CATALOG_RATINGS)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_rating(self.user, self.movie, 5)
+        # genres and unfiltered facets live under CATALOG, the held back vote bumps nothing yet
+        self.assertEqual(versions(CATALOG, CATALOG_RATINGS), before)
+        cache.delete(throttle_key(CATALOG_RATINGS))
+        after = versions(CATALOG, CATALOG_RATINGS)
+        self.assertEqual(after[CATALOG], before[CATALOG])
+        self.assertNotEqual(after[CATALOG_RATINGS], before[CATALOG_RATINGS])
+        # applied once
+        self.assertEqual(versions(CATALOG_RATINGS), {CATALOG_RATINGS: after[CATALOG_RATINGS]})
+
+    @override_settings(TOP_MOVIES_MIN_VOTES=1)
+    def test_home_fragments(self):
+        self.client.get(reverse("home"))
+        with self.assertNumQueries(0):
+            self.client.get(reverse("home"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_rating(self.user, self.movie, 4)
+        self.assertContains(self.client.get(reverse("home")), "4.0")
+
+        self.movie.title = "Inception (2010)"
+        self.movie.save()
+        self.assertContains(self.client.get(reverse("home")), "Inception (2010)")
+
+    def test_detail_fragments_follow_reviews(self):
+        url = reverse("movie_detail", args=[self.movie.id])
+        self.assertContains(self.client.get(url), "No reviews yet.")
+        review = Review.objects.create(movie=self.movie, user=self.user, text="Dreams within dreams")
+        self.assertContains(self.client.get(url), "Dreams within dreams")
+        review.delete()
+        self.assertContains(self.client.get(url), "No reviews yet.")
+
+    def test_invalidate_after_commit(self):
+        first = versions(CATALOG)[CATALOG]
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate(CATALOG)
+            second = versions(CATALOG)[CATALOG]
+        self.assertNotEqual(first, second)
+        self.assertNotEqual(second, versions(CATALOG)[CATALOG])
+
+
+class FavoriteTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.movies = [
+            Movie.objects.create(title=f"Movie {i}", description="-", release_date=date(2000, 1, 1)) for i in range(3)
+        ]
+        Favorite.objects.create(user=self.user, movie=self.movies[1])
+
+    def test_favorite_ids(self):
+        ids = [movie.pk for movie in self.movies]
+        with self.assertNumQueries(1):
+            self.assertEqual(favorite_ids(self.user, ids), {self.movies[1].pk})
+        with self.assertNumQueries(0):
+            self.assertEqual(favorite_ids(AnonymousUser(), ids), set())
+
+    def test_toggle_view(self):
+        self.client.login(username="testuser", password="password")
+        url = reverse("toggle_favorite", args=[self.movies[0].id])
+        self.assertEqual(self.client.get(url).json()["status"], "added")
+        self.assertTrue(Favorite.objects.filter(user=self.user, movie=self.movies[0]).exists())
+        self.assertEqual(self.client.get(url).json()["status"], "removed")
+        self.assertFalse(Favorite.objects.filter(user=self.user, movie=self.movies[0]).exists())
+
+    def test_catalog_shows_heart_state(self):
+        self.client.login(username="testuser", password="password")
+        response = self.client.get(reverse("catalog"))
+        self.assertEqual(response.context["favorite_ids"], {self.movies[1].pk})
+        self.assertContains(response, "bi bi-heart-fill", count=1)
+
+    def test_detail_and_profile(self):
+        self.client.login(username="testuser", password="password")
+        response = self.client.get(reverse("movie_detail", args=[self.movies[1].id]))
+        self.assertTrue(response.context["is_favorite"])
+        response = self.client.get(reverse("profile"))
+        self.assertEqual(list(response.context["favorites"]), [self.movies[1]])
+
+
+class ConditionalRequestTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.movie = Movie.objects.create(title="Inception", description="-", release_date=date(2010, 7, 16))
+        self.url = reverse("movie_detail", args=[self.movie.id])
+
+    def assertNotModified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_detail_not_modified_skips_the_view(self):
+        response = self.client.get(self.url)
+        self.assertIn("no-cache", response["Cache-Control"])
+        with self.assertNumQueries(1):
+            self.assertNotModified(self.url, response["ETag"])
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(reverse("movie_detail", args=[0])).status_code, 404)
+
+    def test_detail_etag_follows_votes_reviews_and_favorites(self):
+        self.client.login(username="testuser", password="password")
+        etag = self.client.get(self.url)["ETag"]
+        self.assertNotModified(self.url, etag)
+        changes = [
+            lambda: record_rating(self.user, self.movie, 4),
+            lambda: Review.objects.create(movie=self.movie, user=self.user, text="Dreams within dreams"),
+            lambda: toggle_favorite(self.user, self.movie.pk),
+        ]
+        for change in changes:
+            change()
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+            etag = response["ETag"]
+        self.assertContains(response, "Dreams within dreams")
+
+    def test_detail_etag_differs_per_user(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.client.login(username="testuser", password="password")
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_catalog_not_modified_without_queries(self):
+        url = reverse("catalog")
+        etag = self.client.get(url, {"sort": "title"})["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(f"{url}?sort=title", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(url, {"sort": "year"}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        Movie.objects.create(title="Titanic", description="-", release_date=date(1997, 12, 19))
+        self.assertEqual(self.client.get(url, {"sort": "title"}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class AsyncEndpointTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.movie = Movie.objects.create(title="Inception", description="-", release_date=date(2010, 7, 16))
+        self.factory = AsyncRequestFactory()
+
+    def request(self, method, path, user, **kwargs):
+        request = getattr(self.factory, method)(path, **kwargs)
+
+        async def auser():
+            return user
+
+        request.auser = auser
+        return request
+
+    async def test_rate_movie(self):
+        request = self.request("post", "/", self.user, data={"rating": 4}, content_type="application/json")
+        response = await views.arate_movie(request, self.movie.id)
+        self.assertEqual(response.status_code, 200)
+        rating = await Rating.objects.aget(user=self.user, movie=self.movie)
+        self.assertEqual(rating.value, 4)
+        movie = await Movie.objects.aget(pk=self.movie.pk)
+        self.assertEqual((movie.rating_count, movie.rating_sum), (1, 4))
+
+    async def test_rate_movie_rejects_bad_input(self):
+        request = self.request("post", "/", self.user, data={"rating": 9}, content_type="application/json")
+        self.assertEqual((await views.arate_movie(request, self.movie.id)).status_code, 400)
+        request = self.request("post", "/", AnonymousUser(), data={"rating": 3}, content_type="application/json")
+        self.assertEqual((await views.arate_movie(request, self.movie.id)).status_code, 401)
+        self.assertFalse(await Rating.objects.aexists())
+
+    async def test_toggle_favorite(self):
+        for expected in ["added", "removed"]:
+            response = await views.atoggle_favorite(self.request("get", "/", self.user), self.movie.id)
+            self.assertEqual(json.loads(response.content)["status"], expected)
+
+
+class RatingIngestTest(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(RATING_QUEUE_PATH=os.path.join(tmp.name, "queue.sqlite3"))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.queue = get_rating_queue()
+        self.users = [User.objects.create_user(username=f"user{i}", password="password") for i in range(2)]
+        self.movie = Movie.objects.create(title="Inception", description="-", release_date=date(2010, 7, 16))
+        self.other = Movie.objects.create(title="Titanic", description="-", release_date=date(1997, 12, 19))
+
+    def test_votes_are_coalesced_per_user_and_movie(self):
+        first, second = self.users
+        record_rating(first, self.other, 2)
+        for user, movie, value in [(first, self.movie, 1), (first, self.movie, 5), (second, self.movie, 3),
+                                   (first, self.other, 4)]:
+            queue_rating(user, movie.pk, value)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = flush_ratings(self.queue)
+        self.assertEqual((result.queued, result.coalesced, result.written), (4, 3, 3))
+        self.assertEqual(Rating.objects.get(user=first, movie=self.movie).value, 5)
+        self.assertEqual(Rating.objects.get(user=first, movie=self.other).value, 4)
+
+        self.movie.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.movie.rating_count, self.movie.rating_sum, self.movie.votes_5), (2, 8, 1))
+        self.assertEqual((self.other.rating_count, self.other.rating_sum, self.other.votes_2), (1, 4, 0))
+        self.assertEqual(self.queue.backlog()[0], 0)
+
+    def test_votes_for_deleted_movies_are_dropped(self):
+        queue_rating(self.users[0], self.other.pk, 5)
+        self.other.delete()
+        result = flush_ratings(self.queue)
+        self.assertEqual((result.queued, result.written), (1, 0))
+        self.assertFalse(Rating.objects.exists())
+        self.assertEqual(self.queue.backlog()[0], 0)
+
+    def test_movies_are_locked_before_votes_are_read(self):
+        record_rating(self.users[0], self.movie, 2)
+        with CaptureQueriesContext(connection) as queries:
+            write_votes({(self.users[0].pk, self.movie.pk): 4, (self.users[1].pk, self.other.pk): 3})
+        statements = [query["sql"] for query in queries]
+        lock = next(i for i, sql in enumerate(statements) if sql.startswith('SELECT "movies_movie"."id"'))
+        read = next(i for i, sql in enumerate(statements) if sql.startswith('SELECT "movies_rating"'))
+        self.assertLess(lock, read)
+        if connection.features.has_select_for_update:
+            self.assertIn("FOR UPDATE", statements[lock])
+        self.movie.refresh_from_db()
+        self.assertEqual((self.movie.rating_count, self.movie.rating_sum), (1, 4))
+
+    @override_settings(RATING_INGEST_MODE="queue")
+    def test_rate_view_queues_votes(self):
+        self.client.login(username="user0", password="password")
+        response = self.client.post(
+            reverse("rate_movie", args=[self.movie.id]), {"rating": 4}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(Rating.objects.exists())
+
+        call_command("flush_ratings", stdout=StringIO())
+        self.assertEqual(Rating.objects.get().value, 4)
+
+
+@skipUnless(connection.vendor == "postgresql", "needs row locks and concurrent connections")
+class ConcurrentVoteTest(TransactionTestCase):
+    def test_vote_inserted_between_read_and_upsert_is_counted_once(self):
+        user = User.objects.create_user(username="voter", password="password")
+        movie = Movie.objects.create(title="Inception", description="-", release_date=date(2010, 7, 16))
+        votes_read, proceed = threading.Event(), threading.Event()
+        bulk_create = Rating.objects.bulk_create
+
+        def paused_bulk_create(*args, **kwargs):
+            # the flusher has read the stored votes, another request votes now
+            votes_read.set()
+            proceed.wait(5)
+            return bulk_create(*args, **kwargs)
+
+        def flusher():
+            try:
+                with mock.patch.object(Rating.objects, "bulk_create", paused_bulk_create):
+                    write_votes({(user.pk, movie.pk): 4})
+            finally:
+                connection.close()
+
+        def request():
+            try:
+                votes_read.wait(5)
+                record_rating(user, movie, 2)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=flusher), threading.Thread(target=request)]
+        for thread in threads:
+            thread.start()
+        # the request waits for the flusher's movie lock instead of inserting the vote
+        threads[1].join(0.5)
+        self.assertTrue(threads[1].is_alive())
+        proceed.set()
+        for thread in threads:
+            thread.join(10)
+
+        movie.refresh_from_db()
+        self.assertEqual((movie.rating_count, movie.rating_sum, movie.votes_2, movie.votes_4), (1, 2, 1, 0))
+
+
+@skipUnless(connection.vendor in ("postgresql", "sqlite"), "EXPLAIN output differs per database")
+class HotQueryPlanTest(TestCase):
+    """Hot lookups of movies/views.py must be answered from an index, not a table scan."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="password")
+        self.movie = Movie.objects.create(title="Inception", description="-", release_date=date(2010, 7, 16))
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == "postgresql":
+            # tiny test tables are always cheaper to scan, rule that out to see the usable plan
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            plan = queryset.explain()
+            self.assertRegex(plan, r"Index (Only )?Scan|Bitmap Index Scan")
+            self.assertIn(index_name, plan)
+        else:
+            plan = queryset.explain()
+            # sqlite keeps unique constraints as table constraints with generated index names
+            self.assertRegex(plan, rf"USING (COVERING )?INDEX ({index_name}|sqlite_autoindex_)")
+
+    def test_own_review_and_rating(self):
+        # write_or_edit_review, add_review, movie_detail
+        self.assertUsesIndex(
+            Review.objects.filter(user=self.user, movie=self.movie).order_by("pk")[:1], "review_user_movie_uniq"
+        )
+        self.assertUsesIndex(
+            Rating.objects.filter(user=self.user, movie=self.movie).order_by("pk")[:1], "rating_user_movie_uniq"
+        )
+
+    def test_favorites(self):
+        # movie_detail, toggle_favorite and catalog heart state
+        self.assertUsesIndex(Favorite.objects.filter(user=self.user, movie=self.movie), "favorite_user_movie_uniq")
+        self.assertUsesIndex(
+            Favorite.objects.filter(user=self.user, movie_id__in=[1, 2, 3]).values("movie_id"),
+            "favorite_user_movie_uniq",
+        )
+
+    def test_review_listings(self):
+        # user_profile, moderation_dashboard, movie_detail
+        self.assertUsesIndex(self.user.review_set.for_profile().order_by("-created_at")[:5], "review_user_created_idx")
+        self.assertUsesIndex(Review.objects.for_moderation().order_by("-created_at")[:10], "review_created_idx")
+        self.assertUsesIndex(self.movie.reviews.for_detail(), "movies_review_movie_id")
+
+    def test_catalog_keyset_pages(self):
+        for sort_field, index_name in [
+            ("title", "movie_title_keyset_idx"),
+            ("release_date", "movie_release_keyset_idx"),
+            ("rating_avg", "movie_rating_keyset_idx"),
+        ]:
+            queryset = KeysetPaginator(Movie.objects.for_card(), sort_field, per_page=24).queryset
+            self.assertUsesIndex(queryset.order_by(sort_field, "pk")[:25], index_name)
+
+
+class LatencyStatsTest(TestCase):
+    def test_percentiles(self):
+        stats = LatencyStats()
+        for ms in range(1, 101):
+            stats.add(ms / 1000, ok=ms != 100)
+        summary = stats.summary(elapsed=2)
+        self.assertEqual(summary["rps"], 50)
+        self.assertEqual(summary["errors"], 1)
+        self.assertAlmostEqual(summary["p50_ms"], 50)
+        self.assertAlmostEqual(summary["p99_ms"], 99)
+        self.assertEqual(percentile([], 99), 0.0)
+        self.assertIsNone(summary["queries"])
+
+    def test_query_counts(self):
+        stats = LatencyStats()
+        stats.add(0.01, queries=4)
+        stats.add(0.01, queries=6)
+        stats.add(0.01)
+        self.assertEqual(stats.summary(elapsed=1)["queries"], 5)
+
+
+class DatabaseConnectionTest(TestCase):
+    def test_bench_db_connections(self):
+        out, err = StringIO(), StringIO()
+        call_command("bench_db_connections", workers=[1, 2], requests=4, queries=1, stdout=out, stderr=err)
+        self.assertIn("close x1: 4 requests, 0 errors", out.getvalue())
+        self.assertIn("persistent x2: 4 requests, 0 errors", out.getvalue())
+        self.assertIn("pool mode needs PostgreSQL", err.getvalue())
+        self.assertNotIn("pool", connection.settings_dict.get("OPTIONS", {}))
+        self.assertEqual(connection.settings_dict["CONN_MAX_AGE"], settings.DATABASES["default"]["CONN_MAX_AGE"])
+
+    def test_pool_metrics(self):
+        stats = {"pool_min": 2, "pool_max": 10, "pool_size": 6, "pool_available": 1, "requests_num": 40}
+        register_pool_metrics()
+        register_pool_metrics()
+        with mock.patch.object(dbpool, "pool_stats", return_value=stats):
+            sample = REGISTRY.get_sample_value
+            self.assertEqual(sample("django_db_pool_saturation", {"alias": "default"}), 0.5)
+            self.assertEqual(sample("django_db_pool_requests_num_total", {"alias": "default"}), 40)
+            self.assertEqual(sample("django_db_pool_requests_waiting", {"alias": "default"}), 0)
+        # without a pool nothing is exported
+        self.assertIsNone(REGISTRY.get_sample_value("django_db_pool_saturation", {"alias": "default"}))
+
+
+class SeedCatalogTest(TestCase):
+    def seed(self):
+        call_command(
+            "seed_data", movies=60, users=30, ratings_per_user=8, reviews_per_user=2, favorites_per_user=2,
+            seed=7, chunk_size=25, stdout=StringIO(),
+        )
+        return sorted(
+            (user.replace("seed_", ""), title, value)
+            for user, title, value in Rating.objects.values_list("user__username", "movie__title", "value")
+        )
+
+    def test_synthetic_catalog(self):
+        first = self.seed()
+        self.assertEqual(Movie.objects.count(), 60)
+        self.assertEqual(User.objects.filter(username__startswith="seed_").count(), 30)
+        self.assertTrue(Review.objects.exists())
+        self.assertEqual(
+            Movie.objects.aggregate(votes=Sum("rating_count"))["votes"], Rating.objects.count()
+        )
+        # genre masks match the m2m rows
+        movie = Movie.objects.prefetch_related("genres").first()
+        self.assertEqual(movie.genre_mask, sum(genre.mask for genre in movie.genres.all()))
+        # favorites only come from the user's own good votes
+        for user_id, movie_id in Favorite.objects.values_list("user_id", "movie_id"):
+            self.assertGreaterEqual(Rating.objects.get(user_id=user_id, movie_id=movie_id).value, 4)
+
+        # same seed, same data
+        self.assertEqual(self.seed(), first)
+        self.assertEqual(User.objects.filter(username__startswith="seed_").count(), 30)
+
+
+class ImportExportTest(TestCase):
+    CSV = (
+        "external_id,title,description,release_date,duration,is_highlight,genres,image\n"
+        "tt1,Alien,In space no one can hear you scream.,1979-05-25,117,true,Sci-Fi|Horror,alien.png\n"
+        "tt2,Heat,A heist.,1995-12-15,,false,Crime,\n"
+        ",No id,-,2000-01-01,,,,\n"
+        "tt3,Bad date,-,someday,,,,\n"
+    )
+
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.TemporaryDirectory()
+        self.images = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        self.addCleanup(self.images.cleanup)
+        with open(os.path.join(self.images.name, "alien.png"), "wb") as image:
+            image.write(b"png")
+        Genre.objects.create(name="Sci-Fi")
+
+    def import_movies(self, path, **options):
+        out, err = StringIO(), StringIO()
+        with override_settings(MEDIA_ROOT=self.media.name):
+            call_command("import_movies", path, images=self.images.name, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def write(self, name, content):
+        path = os.path.join(self.images.name, name)
+        with open(path, "w") as data:
+            data.write(content)
+        return path
+
+    def test_import_upserts_on_external_id(self):
+        out, err = self.import_movies(self.write("movies.csv", self.CSV))
+        self.assertIn("2 created, 0 updated, 1 images, 2 errors", out)
+        self.assertIn("line 4: external_id is required", err)
+        self.assertIn("line 5: release_date", err)
+        alien = Movie.objects.get(external_id="tt1")
+        self.assertTrue(alien.is_highlight)
+        self.assertEqual(alien.image.name, "images/alien.png")
+        self.assertEqual({genre.name for genre in alien.genres.all()}, {"Sci-Fi", "Horror"})
+        self.assertEqual(alien.genre_mask, sum(genre.mask for genre in alien.genres.all()))
+        self.assertEqual(get_search_backend().search(Movie.objects.all(), "scream").get(), alien)
+
+        user = User.objects.create_user(username="voter", password="password")
+        record_rating(user, alien, 5)
+        update = '{"external_id": "tt1", "title": "Alien (1979)", "release_date": "1979-05-25", ' \
+                 '"genres": ["Horror"], "image": "alien.png"}\n{broken\n'
+        out, err = self.import_movies(self.write("update.jsonl", update), batch_size=1)
+        self.assertIn("0 created, 1 updated, 0 images, 1 errors", out)
+        alien.refresh_from_db()
+        self.assertEqual(alien.title, "Alien (1979)")
+        self.assertEqual([genre.name for genre in alien.genres.all()], ["Horror"])
+        self.assertEqual(alien.rating_count, 1)
+        self.assertEqual(Movie.objects.count(), 2)
+
+    def test_bad_genres_and_durations_are_row_errors(self):
+        rows = [
+            {"external_id": "tt4", "title": "Numbers", "release_date": "2000-01-01", "genres": [1, "Drama"]},
+            {"external_id": "tt5", "title": "Object", "release_date": "2000-01-01", "genres": {"name": "Drama"}},
+            {"external_id": "tt6", "title": "Negative", "release_date": "2000-01-01", "duration": -5},
+            {"external_id": "tt7", "title": "Fine", "release_date": "2000-01-01", "duration": 90},
+        ]
+        path = self.write("bad.jsonl", "".join(json.dumps(row) + "\n" for row in rows))
+        out, err = self.import_movies(path)
+        self.assertIn("1 created, 0 updated, 0 images, 3 errors", out)
+        self.assertIn("line 1: genres must be a list of names", err)
+        self.assertIn("line 2: genres must be a list of names", err)
+        self.assertIn("line 3: duration must not be negative", err)
+        self.assertEqual(list(Movie.objects.values_list("external_id", flat=True)), ["tt7"])
+
+    def test_import_from_stdin_leaves_it_open(self):
+        row = '{"external_id": "tt9", "title": "Heat", "release_date": "1995-12-15"}\n'
+        for expected in ("1 created", "1 updated"):
+            stdin = StringIO(row)
+            with mock.patch("sys.stdin", stdin):
+                out, _ = self.import_movies("-")
+            self.assertIn(expected, out)
+            self.assertFalse(stdin.closed)
+
+    def test_export_round_trip(self):
+        self.import_movies(self.write("movies.csv", self.CSV))
+        for fmt in ("csv", "jsonl"):
+            path = os.path.join(self.images.name, f"export.{fmt}")
+            call_command("export_movies", path, stdout=StringIO())
+            with open(path, newline="") as export:
+                rows = [row for _, row in read_rows(export, fmt)]
+            self.assertEqual([row["external_id"] for row in rows], ["tt1", "tt2"])
+            self.assertIn("rating_count", rows[0])
+            out, err = self.import_movies(path)
+            self.assertIn("0 created, 2 updated", out)
+            self.assertEqual(err, "")
+        alien = Movie.objects.get(external_id="tt1")
+        self.assertEqual({genre.name for genre in alien.genres.all()}, {"Sci-Fi", "Horror"})
+
+
+@override_settings(IMAGE_DERIVATIVE_WORKERS=0, IMAGE_DERIVATIVE_WIDTHS=[160, 320, 640])
+class ImageDerivativeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(MEDIA_ROOT=media.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def upload(self, name="poster.png", size=(400, 600), color="red"):
+        buffer = BytesIO()
+        PILImage.new("RGB", size, color).save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def create_movie(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Movie.objects.create(
+                title="Poster", description="-", release_date=date(2020, 1, 1), image=self.upload(), **fields
+            )
+
+    def test_derivatives_on_upload(self):
+        movie = self.create_movie()
+        movie.refresh_from_db()
+        derivatives = movie.image_derivatives
+        self.assertEqual(derivatives["source"], movie.image.name)
+        self.assertEqual([width for width, _ in derivatives["jpeg"]], [160, 320])
+        self.assertEqual([width for width, _ in derivatives["webp"]], [160, 320])
+        for _, name in derivatives["webp"]:
+            self.assertTrue(movie.image.storage.exists(name))
+        with PILImage.open(movie.image.storage.path(derivatives["webp"][0][1])) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ("WEBP", (160, 240)))
+
+        # content-hashed names: the same picture reuses the same files
+        other = self.create_movie()
+        other.refresh_from_db()
+        self.assertEqual(other.image_derivatives["webp"], derivatives["webp"])
+
+        html = Template("{% load custom_tags %}{% picture movie sizes='80px' alt=movie.title %}").render(
+            Context({"movie": movie})
+        )
+        self.assertIn('<source type="image/webp" srcset="/media/derivatives/', html)
+        self.assertIn(' 320w" sizes="80px">', html)
+        self.assertIn('alt="Poster" loading="lazy"', html)
+
+    def test_original_until_derivatives_exist(self):
+        movie = Movie.objects.create(title="Poster", description="-", release_date=date(2020, 1, 1), image=self.upload())
+        html = Template("{% load custom_tags %}{% picture movie %}").render(Context({"movie": movie}))
+        self.assertEqual(html, f'<img src="{movie.image.url}" loading="lazy">')
+
+        out = StringIO()
+        call_command("build_image_derivatives", workers=0, stdout=out)
+        self.assertIn("1 processed, 0 failed", out.getvalue())
+        movie.refresh_from_db()
+        self.assertIn("webp", movie.image_derivatives)
+        # a replaced image makes the stored derivatives stale
+        movie.image = self.upload("new.png", color="blue")
+        self.assertEqual(Template("{% load custom_tags %}{{ movie|srcset:'webp' }}").render(Context({"movie": movie})), "")
+
+
+class CompressedStaticFilesTest(TestCase):
+    def test_collectstatic_writes_hashed_and_compressed_copies(self):
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        storages = {**settings.STORAGES, "staticfiles": {"BACKEND": "conf.storage.CompressedManifestStaticFilesStorage"}}
+        with override_settings(STATIC_ROOT=static_root.name, STORAGES=storages, STATICFILES_DIRS=[]):
+            call_command("collectstatic", interactive=False, verbosity=0)
+            url = staticfiles_storage.url("styles.css")
+            hashed = staticfiles_storage.stored_name("styles.css")
+            path = staticfiles_storage.path(hashed)
+        self.assertRegex(url, r"^/static/styles\.[0-9a-f]{12}\.css$")
+        with open(path, "rb") as css, gzip.open(path + ".gz") as compressed:
+            self.assertEqual(compressed.read(), css.read())
+        self.assertEqual(os.path.exists(path + ".br"), storage_module.brotli is not None)
+        # images are compressed already
+        self.assertFalse(any(name.endswith(".png.gz") for name in os.listdir(static_root.name)))
+
+
+class ReplayTrafficTest(TestCase):
+    def test_load_traffic_skips_broken_lines(self):
+        entries, skipped = load_traffic([
+            '{"at": 0.5, "method": "get", "path": "/catalog/?sort=rating"}',
+            '',
+            'not json',
+            '{"method": "GET"}',
+            '{"method": "POST", "path": "/movie/1/rate/", "body": {"rating": 4}}',
+        ])
+        self.assertEqual(skipped, 2)
+        self.assertEqual(entries[0], {"method": "GET", "path": "/catalog/?sort=rating", "body": None, "at": 0.5})
+        self.assertEqual(entries[1]["body"], {"rating": 4})
+
+    def test_sample_paths_return_distinct_pages(self):
+        # every sampled GET must reach a page of its own, e.g. no query parameter the view ignores
+        cache.clear()
+        admin = User.objects.create_superuser(username="admin", password="password")
+        User.objects.bulk_create([User(username=f"user{i}") for i in range(120)])
+        genre = Genre.objects.create(name="Sci-Fi")
+        for pk, title in [(1, "Star Wars"), (2, "Alien"), (3, "Heat")]:
+            Movie.objects.create(pk=pk, title=title, description="-", release_date=date(1980 + pk, 1, 1))
+        Movie.objects.get(pk=2).genres.add(genre)
+        record_rating(admin, Movie.objects.get(pk=3), 5)
+        self.client.force_login(admin)
+        token = str(RefreshToken.for_user(admin).access_token)
+
+        with open(os.path.join(settings.BASE_DIR, "docs", "traffic_sample.jsonl")) as log:
+            entries, skipped = load_traffic(log)
+        self.assertEqual(skipped, 0)
+        pages = {}
+        for entry in entries:
+            if entry["method"] != "GET" or entry["path"] in pages:
+                continue
+            response = self.client.get(entry["path"], HTTP_AUTHORIZATION=f"Bearer {token}")
+            self.assertEqual(response.status_code, 200, entry["path"])
+            # API pages echo their own query in the "next" link, compare the rows
+            pages[entry["path"]] = response.json()["results"] if "/api/" in entry["path"] else response.content
+        duplicates = [path for path, content in pages.items() if list(pages.values()).count(content) > 1]
+        self.assertEqual(duplicates, [])
+
+    def test_endpoint_names(self):
+        self.assertEqual(endpoint_name("/movie/7/?tab=reviews"), "movie_detail")
+        self.assertEqual(endpoint_name("/movie/7/rate/"), "rate_movie")
+        self.assertEqual(endpoint_name("/api/users/?page=2"), "user-list")
+        self.assertEqual(endpoint_name("/no/such/page/"), "/no/such/page/")
+
+
 # urls tests
 class EndpointTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = Client()
         self.user = User.objects.create_user(username="testuser", password="password")
         self.genre = Genre.objects.create(name="Action")
@@ -114,11 +1217,17 @@ class EndpointTests(TestCase):
         self.assertContains(response, "Inception")
 
     def test_add_review_view(self):
-        self.client.login(username="testuser", password="password")
+        User.objects.create_user(username="otheruser", password="password")
+        self.client.login(username="otheruser", password="password")
         response = self.client.post(reverse("add_review", args=[self.movie.id]), {"text": "Great movie!"})
         self.assertEqual(response.status_code, 302)  # Redirect
         self.assertEqual(Review.objects.filter(movie=self.movie).count(), 2)
 
+    def test_add_review_view_updates_own_review(self):
+        self.client.login(username="testuser", password="password")
+        self.client.post(reverse("add_review", args=[self.movie.id]), {"text": "Even better the second time"})
+        self.assertEqual(Review.objects.get(movie=self.movie).text, "Even better the second time")
+
     def test_toggle_favorite_view(self):
         self.client.login(username="testuser", password="password")
         response = self.client.get(reverse("toggle_favorite", args=[self.movie.id]))
@@ -7,14 +7,23 @@ from . import views
 urlpatterns = [
     path('', views.home, name='home'),
     path('catalog/', views.movie_catalog, name='catalog'),
+    path('catalog/more/', views.catalog_more, name='catalog_more'),
     path('movie/<int:movie_id>/', views.movie_detail, name='movie_detail'),
     path('movie/<int:movie_id>/add_review/', views.add_review, name='add_review'),
     path('profile/', views.user_profile, name='profile'),
     path('profile/<int:user_id>/', views.user_profile, name='user_profile'),
 
     # TODO: recheck necessity of these paths below
-    path('movie/<int:movie_id>/favorite/', views.toggle_favorite, name='toggle_favorite'),
-    path('movie/<int:movie_id>/rate/', views.rate_movie, name='rate_movie'),
+    path(
+        'movie/<int:movie_id>/favorite/',
+        views.atoggle_favorite if settings.ASYNC_VIEWS else views.toggle_favorite,
+        name='toggle_favorite',
+    ),
+    path(
+        'movie/<int:movie_id>/rate/',
+        views.arate_movie if settings.ASYNC_VIEWS else views.rate_movie,
+        name='rate_movie',
+    ),
     path('movie/<int:movie_id>/review/', views.write_or_edit_review, name='write_review'),
     path('movie/<int:movie_id>/review/<int:review_id>/', views.write_or_edit_review, name='edit_review'),
     path('movie/review/<int:review_id>/delete/', views.delete_review, name='delete_review'),
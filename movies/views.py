@@ -1,112 +1,211 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.core.paginator import Paginator
-from django.db.models import Avg, Q, F
+from django.db.models import Q
 from django.http import JsonResponse, HttpResponse
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import aget_object_or_404, render, get_object_or_404, redirect
+from django.template.loader import render_to_string
 from django.utils.timezone import now
 
+from conf.queries import query_budget
+from users.activity import ACTIONS, record_activity
+from users.models import ActivityEvent
+from users.roles import is_moderator
+
+from .cache import (
+    CATALOG, CATALOG_RATINGS, HIGHLIGHTS, LEADERBOARD, cached, conditional_page, favorites_namespace, fragment_context,
+    movie_namespace, normalized_query, versions,
+)
+from . import favorites
 from .forms import ReviewForm
-from .models import Movie, Review, Rating, UserMovieList, Genre
+from .genres import filter_by_genres, genre_facets
+from .ingest import queue_rating
+from .leaderboard import LEADERBOARD_SIZE
+from .models import CARD_FIELDS, RATING_VALUES, Movie, Review, Rating, Genre, TopMovie
+from .pagination import KeysetPaginator
+from .search import get_search_backend
+from .ratings import record_rating
 
 User = get_user_model()
 
+CATALOG_PAGE_SIZE = 24
+CATALOG_SORT_FIELDS = {
+    'title': 'title',
+    'year': 'release_date',
+    'rating': 'rating_avg',
+    'relevance': 'search_rank',
+}
+# parameters that pick a page or its order but don't change the genre facet counts
+CATALOG_FACET_IGNORE = ('genres', 'genre_mode', 'sort', 'order', 'cursor')
+
 
-# TODO: move to permissions.py?
-def is_moderator(user):
-    return user.is_superuser or user.groups.filter(name='Moderators').exists()
+def _catalog_sort(request):
+    # search results are ranked by relevance unless another sort is picked
+    searching = bool(request.GET.get('search', '').strip())
+    sort_option = request.GET.get('sort', 'relevance' if searching else 'title')
+    if sort_option not in CATALOG_SORT_FIELDS or (sort_option == 'relevance' and not searching):
+        sort_option = 'title'
+    default_order = 'desc' if sort_option == 'relevance' else 'asc'
+    return sort_option, request.GET.get('order', default_order)
 
 
 # start page
+@query_budget(5)
 def home(request):
-    highlighted_movies = Movie.objects.filter(is_highlight=True)[:8]
-    # TODO: recheck for a better way to do it
+    highlighted_movies = Movie.objects.filter(is_highlight=True).for_card().with_cover()[:8]
     top_movies = (
-        Movie.objects.annotate(average_rating=Avg('rating__value'))
-        .order_by(F('average_rating').desc(nulls_last=True))[:250]
+        TopMovie.objects.select_related('movie')
+        .only('score', *[f'movie__{field}' for field in CARD_FIELDS])[:LEADERBOARD_SIZE]
     )
 
+    # both querysets are lazy, cached fragments don't evaluate them
     return render(request, 'home_1.html', {
         'highlighted_movies': highlighted_movies,
-        'top_movies': top_movies
+        'top_movies': top_movies,
+        **fragment_context(highlights=HIGHLIGHTS, leaderboard=LEADERBOARD),
     })
 
 
-def movie_catalog(request):
+def _filter_catalog(request):
+    # catalog queryset with search and sidebar filters applied, except genres (not sorted)
     search_query = request.GET.get('search', '').strip()
-    sort_option = request.GET.get('sort', 'title')
-    sort_order = request.GET.get('order', 'asc')
-
-    movies = Movie.objects.annotate(average_rating=Avg('rating__value'))
-    all_genres = Genre.objects.all()
+    movies = Movie.objects.for_card()
 
     if search_query:
-        movies = movies.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(genres__name__icontains=search_query)
-        ).distinct()
+        movies = get_search_backend().filter(movies, search_query)
 
     # Retrieve filter parameters
     rating_min = request.GET.get('rating_min')
     rating_max = request.GET.get('rating_max')
     year_min = request.GET.get('year_min')
     year_max = request.GET.get('year_max')
-    selected_genres = request.GET.getlist('genres')
-    print(selected_genres)
     # Apply filters
+    if rating_min or rating_max:
+        # rating_avg of a movie without votes is 0, not a rating
+        movies = movies.filter(rating_count__gt=0)
     if rating_min:
-        movies = movies.filter(average_rating__gte=rating_min)
+        movies = movies.filter(rating_avg__gte=rating_min)
     if rating_max:
-        movies = movies.filter(average_rating__lte=rating_max)
+        movies = movies.filter(rating_avg__lte=rating_max)
     if year_min:
         movies = movies.filter(release_date__year__gte=year_min)
     if year_max:
         movies = movies.filter(release_date__year__lte=year_max)
-    if selected_genres:
-        movies = movies.filter(genres__id__in=selected_genres).distinct()
-
-    # Сортировка
-    if sort_option == 'rating':
-        movies = movies.annotate(average_rating=Avg('rating__value'))
-        # TODO: recheck for a better way to do it (also in home view)
-        movies = movies.order_by(
-            F('average_rating').desc(nulls_last=True) if sort_order == 'desc' else F('average_rating').asc(
-                nulls_first=True)
+    return movies
+
+
+def _filter_catalog_genres(request, movies, all_genres):
+    selected_genres = request.GET.getlist('genres')
+    genres = [genre for genre in all_genres if str(genre.pk) in selected_genres]
+    return filter_by_genres(movies, genres, match_all=request.GET.get('genre_mode') == 'all')
+
+
+def _catalog_genres():
+    return cached(CATALOG, 'genres', lambda: list(Genre.objects.all()))
+
+
+def _catalog_stamp(request):
+    # catalog pages change with the catalog versions and the user's favorites (heart icons)
+    favorites_key = favorites_namespace(request.user.pk)
+    current = versions(CATALOG, CATALOG_RATINGS, favorites_key)
+    return [
+        current[CATALOG], current[CATALOG_RATINGS], current[favorites_key],
+        normalized_query(request.GET), is_moderator(request.user),
+    ], None
+
+
+def _catalog_page(request, all_genres):
+    # one keyset page of the sorted catalog and the query string for the next one
+    def get_page():
+        movies = _filter_catalog_genres(request, _filter_catalog(request), all_genres)
+        sort_option, sort_order = _catalog_sort(request)
+        if sort_option == 'relevance':
+            movies = get_search_backend().rank(movies, request.GET.get('search', '').strip())
+        paginator = KeysetPaginator(
+            movies,
+            CATALOG_SORT_FIELDS[sort_option],
+            descending=sort_order == 'desc',
+            per_page=CATALOG_PAGE_SIZE,
         )
-    elif sort_option == 'year':
-        movies = movies.order_by('-release_date' if sort_order == 'desc' else 'release_date')
-    else:
-        movies = movies.order_by('-title' if sort_order == 'desc' else 'title')
+        return paginator.get_page(request.GET.get('cursor'))
+
+    page = cached((CATALOG, CATALOG_RATINGS), f'page?{normalized_query(request.GET)}', get_page)
+
+    next_query = None
+    if page.has_next:
+        params = request.GET.copy()
+        params['cursor'] = page.next_cursor
+        next_query = params.urlencode()
+    return page, next_query
+
+
+@query_budget(6)
+@conditional_page(_catalog_stamp)
+def movie_catalog(request):
+    all_genres = _catalog_genres()
+    # facet counts ignore the genre selection itself, like any "OR" facet;
+    # they follow the votes only when rating filters are set
+    rating_filtered = request.GET.get('rating_min') or request.GET.get('rating_max')
+    facets = cached(
+        (CATALOG, CATALOG_RATINGS) if rating_filtered else CATALOG,
+        f'facets?{normalized_query(request.GET, ignore=CATALOG_FACET_IGNORE)}',
+        lambda: genre_facets(_filter_catalog(request), all_genres),
+    )
+    for genre in all_genres:
+        genre.facet_count = facets[genre.pk]
+
+    page, next_query = _catalog_page(request, all_genres)
+    sort_option, sort_order = _catalog_sort(request)
 
     return render(request, 'catalog.html', {
-        'movies': movies,
-        'search_query': search_query,
+        'movies': page,
+        'favorite_ids': favorites.favorite_ids(request.user, [movie.pk for movie in page]),
+        'next_query': next_query,
+        'search_query': request.GET.get('search', '').strip(),
         'sort_option': sort_option,
         'sort_order': sort_order,
         'all_genres': all_genres,
-        'selected_genres': selected_genres,
+        'selected_genres': request.GET.getlist('genres'),
+        'genre_mode': request.GET.get('genre_mode', 'any'),
     })
 
 
+@conditional_page(_catalog_stamp)
+def catalog_more(request):
+    # infinite scroll: next page of catalog rows as an HTML fragment
+    page, next_query = _catalog_page(request, _catalog_genres())
+    html = render_to_string('catalog_rows.html', {
+        'movies': page,
+        'favorite_ids': favorites.favorite_ids(request.user, [movie.pk for movie in page]),
+    }, request=request)
+    return JsonResponse({'html': html, 'next_query': next_query})
+
+
 @login_required
+@query_budget(12)
 def user_profile(request, user_id=None):
     if not user_id:
         profile_user = request.user
     else:
-        if not (is_moderator(request.user) or request.user.is_superuser):
+        if not is_moderator(request.user):
             return HttpResponse('Unauthorized', status=401)
         profile_user = get_object_or_404(User, id=user_id)
 
-    reviews = profile_user.review_set.all().order_by('-created_at')
-    ratings = profile_user.rating_set.all().order_by('-id')
-    favorite_list = UserMovieList.objects.filter(user=profile_user, name="Favorites").first()
-    favorites = favorite_list.movies.all() if favorite_list else []
+    reviews = profile_user.review_set.for_profile().order_by('-created_at')
+    ratings = (
+        profile_user.rating_set.select_related('movie')
+        .only('user', 'value', 'movie__id', 'movie__title').order_by('-id')
+    )
+    favorite_movies = Movie.objects.filter(favorites__user=profile_user).only('id', 'title').order_by('title')
 
     # Pagination
     review_paginator = Paginator(reviews, 5)  # Show 5 reviews per page
     rating_paginator = Paginator(ratings, 5)  # Show 5 ratings per page
-    favorite_paginator = Paginator(favorites, 5)  # Show 5 favorites per page
+    favorite_paginator = Paginator(favorite_movies, 5)  # Show 5 favorites per page
 
     review_page = request.GET.get('review_page', 1)
     rating_page = request.GET.get('rating_page', 1)
@@ -125,19 +224,29 @@ def user_profile(request, user_id=None):
 
 
 # Detailed page and its handling
+def _movie_stamp(request, movie_id):
+    # updated_at follows votes and reviews too, a single indexed lookup instead of the page's queries
+    updated_at = Movie.objects.filter(pk=movie_id).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        return None, None
+    favorites_key = favorites_namespace(request.user.pk)
+    return [updated_at.isoformat(), versions(favorites_key)[favorites_key], is_moderator(request.user)], updated_at
+
+
+@query_budget(12)
+@conditional_page(_movie_stamp)
 def movie_detail(request, movie_id):
+    # genres and reviews are loaded by the template fragments, only when they aren't cached
     movie = get_object_or_404(Movie, id=movie_id)
     user = request.user
 
     is_favorite = False
     user_rating = None
-    reviews = movie.reviews.all()
+    reviews = movie.reviews.for_detail()
 
     if user.is_authenticated:
         # info for context
-        favorite_list = UserMovieList.objects.filter(user=user, name="Favorites").first()
-        if favorite_list and movie in favorite_list.movies.all():
-            is_favorite = True
+        is_favorite = favorites.is_favorite(user, movie.pk)
 
         user_rating_obj = Rating.objects.filter(user=request.user, movie=movie).first()
         user_rating = user_rating_obj.value if user_rating_obj else None
@@ -149,13 +258,16 @@ def movie_detail(request, movie_id):
         'average_rating': movie.average_rating(),  # or None
         'reviews': reviews,
         'is_moderator': is_moderator(user),
+        **fragment_context(movie=movie_namespace(movie.pk)),
     })
 
 
 def add_review(request, movie_id):
     movie = get_object_or_404(Movie, id=movie_id)
     if request.method == 'POST':
-        form = ReviewForm(request.POST)
+        # one review per user and movie, posting again replaces its text
+        review = Review.objects.filter(user=request.user, movie=movie).first()
+        form = ReviewForm(request.POST, instance=review)
         if form.is_valid():
             review = form.save(commit=False)
             review.movie = movie
@@ -169,38 +281,61 @@ def add_review(request, movie_id):
 
 def toggle_favorite(request, movie_id):
     # handling fav button
-    movie = get_object_or_404(Movie, id=movie_id)
-    user = request.user
-
-    favorite_list, created = UserMovieList.objects.get_or_create(user=user, name="Favorites")
-
-    if movie in favorite_list.movies.all():
-        favorite_list.movies.remove(movie)
-        return JsonResponse({'status': 'removed'})
-    else:
-        favorite_list.movies.add(movie)
-        return JsonResponse({'status': 'added'})
+    movie = get_object_or_404(Movie.objects.only('id'), id=movie_id)
+    added = favorites.toggle_favorite(request.user, movie.pk)
+    return JsonResponse({'status': 'added' if added else 'removed'})
 
 
 def rate_movie(request, movie_id):
     # handling rate button
     if request.method == 'POST':
-        import json
         data = json.loads(request.body)
         rating_value = data.get('rating')
 
         if rating_value and 1 <= int(rating_value) <= 5:
+            if settings.RATING_INGEST_MODE == 'queue':
+                queue_rating(request.user, movie_id, int(rating_value))
+                return JsonResponse({'status': 'success', 'message': 'Rating submitted'}, status=202)
             movie = get_object_or_404(Movie, id=movie_id)
-            Rating.objects.update_or_create(
-                user=request.user,
-                movie=movie,
-                defaults={'value': int(rating_value)}
-            )
+            record_rating(request.user, movie, int(rating_value))
             return JsonResponse({'status': 'success', 'message': 'Rating submitted'})
         return JsonResponse({'status': 'error', 'message': 'Invalid rating value'}, status=400)
     return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=400)
 
 
+async def atoggle_favorite(request, movie_id):
+    # async twin of toggle_favorite for ASGI workers (settings.ASYNC_VIEWS)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'Login required'}, status=401)
+    movie = await aget_object_or_404(Movie.objects.only('id'), id=movie_id)
+    added = await favorites.atoggle_favorite(user, movie.pk)
+    return JsonResponse({'status': 'added' if added else 'removed'})
+
+
+async def arate_movie(request, movie_id):
+    # async twin of rate_movie for ASGI workers (settings.ASYNC_VIEWS)
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=400)
+    try:
+        rating_value = int(json.loads(request.body).get('rating'))
+    except (ValueError, TypeError, AttributeError):
+        rating_value = None
+    if rating_value not in RATING_VALUES:
+        return JsonResponse({'status': 'error', 'message': 'Invalid rating value'}, status=400)
+
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'status': 'error', 'message': 'Login required'}, status=401)
+    if settings.RATING_INGEST_MODE == 'queue':
+        await sync_to_async(queue_rating, thread_sensitive=False)(user, movie_id, rating_value)
+        return JsonResponse({'status': 'success', 'message': 'Rating submitted'}, status=202)
+    movie = await aget_object_or_404(Movie.objects.only('id'), id=movie_id)
+    # the vote and its aggregate updates share a transaction, which the async ORM can't open
+    await sync_to_async(record_rating)(user, movie, rating_value)
+    return JsonResponse({'status': 'success', 'message': 'Rating submitted'})
+
+
 @login_required
 def write_or_edit_review(request, movie_id, review_id=None):
     movie = get_object_or_404(Movie, id=movie_id)
@@ -244,8 +379,7 @@ def delete_review(request, review_id):
     review = get_object_or_404(Review, id=review_id)
 
     # checking permissions
-    if (review.user != request.user and not request.user.is_superuser
-            and not request.user.groups.filter(name="Moderators").exists()):
+    if review.user != request.user and not is_moderator(request.user):
         return HttpResponse('Unauthorized', status=401)
 
     if request.method == "POST":
@@ -257,6 +391,7 @@ def delete_review(request, review_id):
 
 # views for moderators
 @user_passes_test(is_moderator)
+@query_budget(10)
 def moderation_dashboard(request):
     search_query = request.GET.get('search', '').strip()
 
@@ -265,13 +400,13 @@ def moderation_dashboard(request):
         users = User.objects.all()
         if search_query:
             users = users.filter(Q(username__icontains=search_query) | Q(email__icontains=search_query))
-        reviews = Review.objects.filter(user__in=users).order_by('-created_at')
+        reviews = Review.objects.for_moderation().filter(user__in=users).order_by('-created_at')
     else:
         # Only show regular users and their reviews for moderators
         users = User.objects.filter(is_superuser=False).exclude(groups__name='Moderators')
         if search_query:
             users = users.filter(Q(username__icontains=search_query) | Q(email__icontains=search_query))
-        reviews = Review.objects.filter(
+        reviews = Review.objects.for_moderation().filter(
             user__in=users
         ).order_by('-created_at')
 
@@ -284,19 +419,48 @@ def moderation_dashboard(request):
 
     paginated_users = user_paginator.get_page(user_page)
     paginated_reviews = review_paginator.get_page(review_page)
+    activity, activity_next_query = _activity_page(request, users, search_query)
 
     return render(request, 'moderation_dashboard.html', {
         'users': paginated_users,
         'reviews': paginated_reviews,
         'search_query': search_query,
+        'activity': activity,
+        'activity_next_query': activity_next_query,
+        'actions': ACTIONS,
+        'selected_action': request.GET.get('action', ''),
     })
 
 
+def _activity_page(request, users, search_query):
+    # newest audit events, by user and action through the (user|action, -created_at) indexes
+    events = ActivityEvent.objects.select_related('actor').only(
+        'username', 'action', 'message', 'created_at', 'user_id', 'actor__username',
+    )
+    if request.GET.get('activity_user', '').isdigit():
+        events = events.filter(user_id=request.GET['activity_user'])
+    if search_query or not request.user.is_superuser:
+        # moderators only see events of the users they moderate
+        events = events.filter(user__in=users)
+    if request.GET.get('action') in ACTIONS:
+        events = events.filter(action=request.GET['action'])
+    page = KeysetPaginator(events, 'created_at', descending=True, per_page=20).get_page(
+        request.GET.get('activity_cursor'),
+    )
+    next_query = None
+    if page.has_next:
+        params = request.GET.copy()
+        params['activity_cursor'] = page.next_cursor
+        next_query = params.urlencode()
+    return page, next_query
+
+
 @user_passes_test(is_moderator)
 def toggle_user_status(request, user_id):
     user = get_object_or_404(User, id=user_id)
     user.is_active = not user.is_active
     user.save()
+    record_activity('user_status', user, actor=request.user, message=f'is_active = {user.is_active}')
     return redirect('moderation_dashboard')
 
 
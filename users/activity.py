@@ -0,0 +1,191 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+
+from .models import ActivityEvent, CustomUser
+
+logger = logging.getLogger('user_activity')
+
+# action -> label on the moderation dashboard
+ACTIONS = {
+    'login': 'Logged in',
+    'login_failed': 'Failed login',
+    'register': 'Registered',
+    'user_created': 'User created',
+    'user_updated': 'User updated',
+    'password_changed': 'Password changed',
+    'user_status': 'Status changed',
+    'user_groups': 'Groups changed',
+    'user_deleted': 'User deleted',
+    'user_export': 'Users exported',
+    'group_created': 'Group created',
+    'group_updated': 'Group updated',
+    'group_deleted': 'Group deleted',
+    'batch': 'API batch',
+}
+
+
+def live_user_ids(user_ids):
+    return set(CustomUser.objects.filter(pk__in=user_ids - {None}).values_list('pk', flat=True))
+
+
+def write_events(events):
+    """
+    Saves ActivityEvents with bulk INSERTs. Users deleted since an event was recorded are
+    unlinked from it, their username stays. Returns the number of written events.
+    """
+    if not events:
+        return 0
+    user_ids = {event.user_id for event in events} | {event.actor_id for event in events}
+    for attempt in range(2):
+        live_users = live_user_ids(user_ids)
+        for event in events:
+            if event.user_id not in live_users:
+                event.user_id = None
+            if event.actor_id not in live_users:
+                event.actor_id = None
+            event.pk = None
+        try:
+            with transaction.atomic():
+                ActivityEvent.objects.bulk_create(events, batch_size=1000)
+            return len(events)
+        except IntegrityError:
+            # a user deleted between the check and the commit fails the (deferred) foreign key of
+            # the whole batch; checked again, the batch is written with that user unlinked
+            if attempt:
+                raise
+
+
+class ActivityWriter:
+    """
+    Bounded in-process queue of unsaved ActivityEvents and the daemon thread writing them:
+    a request only puts its event on the queue, the thread bulk_creates up to batch_size
+    events at once, collected for at most `interval` seconds. When the database falls behind
+    and the queue is full, events are dropped (counted) instead of slowing requests down.
+    """
+
+    def __init__(self, queue_size=10000, batch_size=500, interval=1.0):
+        self.queue = queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.written = 0
+        self.dropped = 0
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def put(self, event):
+        self.start()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        # lazily, and again in a forked worker process, which has the queue but not the thread
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self.run, name='activity-writer', daemon=True)
+                self.thread.start()
+
+    def take(self, wait, linger):
+        # up to batch_size events: waits `wait` seconds for the first one, then `linger` for more
+        try:
+            events = [self.queue.get(timeout=wait)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + linger
+        while len(events) < self.batch_size:
+            try:
+                events.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return events
+
+    def write(self, events):
+        try:
+            self.written += write_events(events)
+        except Exception:
+            # a failing batch must not stop the thread, the events are lost like dropped ones
+            self.dropped += len(events)
+            logger.exception('Writing %s activity events failed.', len(events))
+        finally:
+            # like the end of a request: drops connections past CONN_MAX_AGE or broken ones
+            close_old_connections()
+
+    def run(self):
+        try:
+            while not self.stopping.is_set():
+                events = self.take(self.interval, self.interval)
+                if events:
+                    self.write(events)
+        finally:
+            connection.close()
+
+    def flush(self):
+        # writes everything queued so far in the calling thread
+        while events := self.take(0, 0):
+            self.write(events)
+
+    def stop(self, timeout=5):
+        # at exit: lets the thread finish its batch, then writes the rest
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.flush()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_activity_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = ActivityWriter(
+                    settings.ACTIVITY_QUEUE_SIZE, settings.ACTIVITY_BATCH_SIZE, settings.ACTIVITY_FLUSH_INTERVAL,
+                )
+                atexit.register(_writer.stop)
+    return _writer
+
+
+def record_activity(action, user=None, actor=None, message='', username='', **details):
+    """
+    Records `action` on `user` done by `actor` (anonymous users count as none), `details`
+    are stored as JSON. With ACTIVITY_LOG_ASYNC the event goes to the background writer,
+    otherwise it's saved right away.
+    """
+    user_id = getattr(user, 'pk', None)
+    actor_id = getattr(actor, 'pk', None)
+    event = ActivityEvent(
+        user_id=user_id,
+        username=username or (user.get_username() if user_id else ''),
+        actor_id=actor_id if actor_id != user_id else None,
+        action=action,
+        message=message[:255],
+        details=details,
+    )
+    if settings.ACTIVITY_LOG_ASYNC:
+        get_activity_writer().put(event)
+    else:
+        write_events([event])
+
+
+def prune_events(before, batch_size=10000):
+    # deletes events older than `before` in batches of short transactions, returns how many
+    deleted = 0
+    while True:
+        ids = list(ActivityEvent.objects.filter(created_at__lt=before).order_by().values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += ActivityEvent.objects.filter(pk__in=ids).delete()[0]
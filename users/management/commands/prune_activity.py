@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from users.activity import prune_events
+from users.models import ActivityEvent
+
+
+class Command(BaseCommand):
+    help = 'Deletes activity events older than the retention period, in small batches (run it daily, e.g. from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ACTIVITY_RETENTION_DAYS,
+                            help='events older than this many days are deleted')
+        parser.add_argument('--batch-size', type=int, default=10000, help='events deleted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='only count the events that would be deleted')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1.')
+        before = timezone.now() - timedelta(days=options['days'])
+        if options['dry_run']:
+            count = ActivityEvent.objects.filter(created_at__lt=before).count()
+            self.stdout.write(f'{count} events older than {before:%Y-%m-%d %H:%M} would be deleted')
+            return
+        deleted = prune_events(before, options['batch_size'])
+        self.stdout.write(f'{deleted} events older than {before:%Y-%m-%d %H:%M} deleted')
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager, Group
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -55,3 +56,29 @@ class CustomUser(AbstractUser):
 
     def __str__(self):
         return self.username
+
+
+class ActivityEvent(models.Model):
+    # audit log of account and API actions, written in batches by users.activity
+    user = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.SET_NULL,
+                             related_name='activity_events')
+    # kept when the user is deleted, also the name tried by failed logins
+    username = models.CharField(max_length=150, blank=True)
+    # admin or moderator who acted on `user`, empty when users act on themselves
+    actor = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    action = models.CharField(max_length=32)
+    message = models.CharField(max_length=255, blank=True)
+    details = models.JSONField(default=dict, blank=True)
+    # time of the action, not of the (delayed) write
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # moderation dashboard filters, newest first; created_at alone for prune_activity
+            models.Index(fields=['user', '-created_at'], name='activity_user_created_idx'),
+            models.Index(fields=['action', '-created_at'], name='activity_action_created_idx'),
+            models.Index(fields=['created_at'], name='activity_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.username} at {self.created_at:%Y-%m-%d %H:%M:%S}"
@@ -0,0 +1,38 @@
+from django.core.cache import cache
+
+MODERATORS = 'Moderators'
+ROLE_CACHE_TIMEOUT = 60 * 60
+
+
+def role_cache_key(user_id):
+    return f'roles:{user_id}'
+
+
+def group_names(user):
+    """
+    Names of the user's groups. Memoized on the user object for the rest of the request
+    and shared between requests through the cache, which users.signals clears on changes.
+    """
+    if not user.is_authenticated:
+        return frozenset()
+    names = getattr(user, '_group_names', None)
+    if names is None:
+        key = role_cache_key(user.pk)
+        names = cache.get(key)
+        if names is None:
+            names = frozenset(user.groups.values_list('name', flat=True))
+            cache.set(key, names, ROLE_CACHE_TIMEOUT)
+        user._group_names = names
+    return names
+
+
+def has_role(user, group_name):
+    return group_name in group_names(user)
+
+
+def is_moderator(user):
+    return user.is_superuser or has_role(user, MODERATORS)
+
+
+def forget_roles(user_ids):
+    cache.delete_many([role_cache_key(user_id) for user_id in user_ids])
@@ -1,7 +1,15 @@
-from django.db.models.signals import post_migrate
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_login_failed
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_migrate, post_save, pre_delete
 from django.dispatch import receiver
 from django.apps import apps
 
+from .activity import record_activity
+from .roles import forget_roles
+
+User = get_user_model()
+
 
 @receiver(post_migrate)
 def create_default_groups(sender, **kwargs):
@@ -11,3 +19,38 @@ def create_default_groups(sender, **kwargs):
 
     for group_name in default_groups:
         group.objects.get_or_create(name=group_name)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # user.groups.add(...) and friends
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            instance.__dict__.pop('_group_names', None)
+            forget_roles([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        # group.user_set.add(...)
+        forget_roles(pk_set)
+    elif action == 'pre_clear':
+        # the members are gone once the clear is done
+        forget_roles(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    # a new user may reuse the id of a deleted one
+    if created:
+        forget_roles([instance.pk])
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    # renaming or deleting a group changes the roles of all its members
+    forget_roles(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(user_login_failed)
+def login_failed(sender, credentials, **kwargs):
+    # wrong passwords of the login page and the API token endpoint alike
+    record_activity('login_failed', username=str(credentials.get('username', ''))[:150])
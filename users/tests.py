@@ -1,9 +1,21 @@
 import json
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-from django.test import TestCase, Client
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, Client
+from django.utils import timezone
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 from django.contrib.messages import get_messages
+from django.core.cache import cache
+
+from users import activity
+from users.activity import ActivityWriter, record_activity, write_events
+from users.models import ActivityEvent
+from users.roles import is_moderator
 
 CustomUser = get_user_model()
 
@@ -172,3 +184,129 @@ class UserDetailViewTest(TestCase):
         response = self.client.post(register_url, data)
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Registration failed. Please correct the errors below.')
+
+
+class RoleCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='testuser', password='testpassword123')
+        self.moderators, _ = Group.objects.get_or_create(name='Moderators')
+
+    def fresh_user(self):
+        # same user as loaded by the auth middleware on the next request
+        return CustomUser.objects.get(pk=self.user.pk)
+
+    def test_role_checks_are_cached(self):
+        self.assertFalse(is_moderator(self.fresh_user()))
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertFalse(is_moderator(user))
+            self.assertFalse(is_moderator(user))
+
+    def test_adding_to_group_invalidates(self):
+        self.assertFalse(is_moderator(self.fresh_user()))
+        self.user.groups.add(self.moderators)
+        self.assertTrue(is_moderator(self.fresh_user()))
+        self.user.groups.remove(self.moderators)
+        self.assertFalse(is_moderator(self.fresh_user()))
+
+    def test_group_side_changes_invalidate(self):
+        self.assertFalse(is_moderator(self.fresh_user()))
+        self.moderators.user_set.add(self.user)
+        self.assertTrue(is_moderator(self.fresh_user()))
+        self.moderators.user_set.clear()
+        self.assertFalse(is_moderator(self.fresh_user()))
+
+    def test_renaming_group_invalidates(self):
+        self.user.groups.add(self.moderators)
+        self.assertTrue(is_moderator(self.fresh_user()))
+        self.moderators.name = 'Former moderators'
+        self.moderators.save()
+        self.assertFalse(is_moderator(self.fresh_user()))
+
+    def test_page_render_runs_no_role_queries(self):
+        self.user.groups.add(self.moderators)
+        self.client.login(username='testuser', password='testpassword123')
+        self.client.get(reverse('home'))
+        # session, user, the two page counts and the activity page: the view decorator and
+        # base template ask for the role again, both answered from the cache
+        with self.assertNumQueries(5):
+            self.client.get(reverse('moderation_dashboard') + '?search=nobody')
+
+
+class ActivityLogTest(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', password='testpassword123')
+        self.admin_user = CustomUser.objects.create_superuser(username='admin', password='adminpassword123')
+
+    def test_logins_are_recorded(self):
+        self.client.post(reverse('login'), {'username': 'testuser', 'password': 'wrong'})
+        self.client.post(reverse('login'), {'username': 'testuser', 'password': 'testpassword123'})
+        events = list(ActivityEvent.objects.order_by('id').values_list('action', 'user_id', 'username'))
+        self.assertEqual(events, [('login_failed', None, 'testuser'), ('login', self.user.pk, 'testuser')])
+
+    def test_deleted_user_keeps_events(self):
+        self.client.login(username='admin', password='adminpassword123')
+        self.client.post(reverse('user_detail', kwargs={'pk': self.user.pk}), {'delete_user': str(self.user.pk)})
+        event = ActivityEvent.objects.get(action='user_deleted')
+        self.assertEqual((event.user_id, event.username, event.actor_id), (None, 'testuser', self.admin_user.pk))
+
+    def test_writer_batches_events(self):
+        writer = ActivityWriter(queue_size=3, batch_size=2)
+        deleted = CustomUser.objects.create_user(username='gone')
+        # flushed here instead of by the thread, which has its own connection
+        with mock.patch.object(writer, 'start'):
+            for user in [self.user, deleted, self.user, self.user]:
+                writer.put(ActivityEvent(action='login', user=user, username=user.username))
+        deleted.delete()
+        # per batch of two: the live user check and one INSERT, in a savepoint inside the test transaction
+        with self.assertNumQueries(8):
+            writer.flush()
+        self.assertEqual((writer.written, writer.dropped), (3, 1))
+        self.assertEqual(list(ActivityEvent.objects.filter(user__isnull=True).values_list('username', flat=True)), ['gone'])
+
+    def test_prune_activity(self):
+        record_activity('login', self.user)
+        ActivityEvent.objects.create(action='login', user=self.user, created_at=timezone.now() - timedelta(days=100))
+        out = StringIO()
+        call_command('prune_activity', '--days', '90', '--batch-size', '1', stdout=out)
+        self.assertIn('1 events', out.getvalue())
+        self.assertEqual(ActivityEvent.objects.count(), 1)
+
+    def test_dashboard_filters_activity(self):
+        record_activity('login', self.user)
+        record_activity('user_status', self.user, actor=self.admin_user, message='is_active = False')
+        record_activity('login', self.admin_user)
+        moderators, _ = Group.objects.get_or_create(name='Moderators')
+        moderator = CustomUser.objects.create_user(username='moderator', password='moderatorpassword123')
+        moderator.groups.add(moderators)
+
+        self.client.login(username='admin', password='adminpassword123')
+        response = self.client.get(reverse('moderation_dashboard'), {'action': 'login'})
+        self.assertEqual([event.username for event in response.context['activity']], ['admin', 'testuser'])
+        response = self.client.get(reverse('moderation_dashboard'), {'activity_user': self.user.pk})
+        self.assertEqual([event.action for event in response.context['activity']], ['user_status', 'login'])
+        self.assertContains(response, 'Status changed')
+
+        # moderators don't see the activity of admins
+        self.client.login(username='moderator', password='moderatorpassword123')
+        response = self.client.get(reverse('moderation_dashboard'))
+        self.assertEqual({event.username for event in response.context['activity']}, {'testuser'})
+
+
+class ActivityRaceTest(TransactionTestCase):
+    # the foreign keys are checked at commit, which a TestCase never reaches
+
+    def test_user_deleted_after_the_check_doesnt_lose_the_batch(self):
+        user = CustomUser.objects.create_user(username='testuser')
+        deleted = CustomUser.objects.create_user(username='gone')
+        events = [ActivityEvent(action='login', user_id=one.pk, username=one.username) for one in (user, deleted)]
+        stale = {user.pk, deleted.pk}
+        deleted.delete()
+        # the first check still sees the deleted user, as if it was deleted right after it
+        with mock.patch.object(activity, 'live_user_ids', side_effect=[stale, {user.pk}]):
+            self.assertEqual(write_events(events), 2)
+        rows = ActivityEvent.objects.order_by('username').values_list('username', 'user_id')
+        self.assertEqual(list(rows), [('gone', None), ('testuser', user.pk)])
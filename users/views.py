@@ -6,6 +6,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import Group
 from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, redirect, render
+from .activity import record_activity
 from .forms import UserLoginForm, UserRegistrationForm, UserForm, GroupForm
 from .models import CustomUser
 
@@ -28,6 +29,7 @@ def login_view(request):
             if user is not None:
                 login(request, user)
                 logger.info(f"User {user.username} logged in successfully.")
+                record_activity('login', user)
                 # if user.is_staff:
                 #     return redirect('admin_user_list')
                 # else:
@@ -50,6 +52,7 @@ def register(request):
             user.groups.add(default_group)
             messages.success(request, 'Registration successful. You can now log in.')
             logger.info(f"User {user.username} registered successfully and assigned to 'Users' group.")
+            record_activity('register', user)
             login(request, user)
             return redirect('/')
         else:
@@ -87,6 +90,7 @@ def admin_user_list(request):
                     user.groups.add(group)
 
                 logger.info(f"User {user.username} created successfully.")
+                record_activity('user_created', user, actor=request.user, groups=[int(pk) for pk in group_ids])
                 return redirect('admin_user_list')
             else:
                 logger.error(f"Failed to create user: {user_form.errors}")
@@ -94,8 +98,9 @@ def admin_user_list(request):
         elif 'create_group' in request.POST:
             group_form = GroupForm(request.POST)
             if group_form.is_valid():
-                group_form.save()
+                group = group_form.save()
                 logger.info("Group created successfully.")
+                record_activity('group_created', request.user, message=group.name, group=group.pk)
                 return redirect('admin_user_list')
             else:
                 logger.error(f"Failed to create group: {group_form.errors}")
@@ -116,6 +121,7 @@ def admin_user_list(request):
                 user.save()
 
                 logger.info(f"User {user.username} {field} updated to {value}.")
+                record_activity('user_status', user, actor=request.user, message=f'{field} = {value}')
                 return JsonResponse({"success": True})
             except Exception as e:
                 logger.error(f"Error updating user status: {e}")
@@ -126,6 +132,7 @@ def admin_user_list(request):
             try:
                 user_to_delete = get_object_or_404(CustomUser, pk=user_id)
                 username = user_to_delete.username
+                record_activity('user_deleted', user_to_delete, actor=request.user)
                 user_to_delete.delete()
                 logger.info(f"User {username} deleted successfully.")
             except Exception as e:
@@ -152,6 +159,7 @@ def user_detail(request, pk):
     if request.method == 'POST':
         if 'delete_user' in request.POST:
             if request.user.is_staff:
+                record_activity('user_deleted', user, actor=request.user)
                 user.delete()
                 messages.success(request, 'User has been successfully deleted.')
                 logger.info(f"User {user.username} deleted by admin {request.user.username}")
@@ -174,10 +182,12 @@ def user_detail(request, pk):
                 user_data.set_password(new_password)
                 messages.success(request, 'Password has been successfully updated.')
                 logger.info(f"User {user.username} updated their password.")
+                record_activity('password_changed', user, actor=request.user)
                 login(request, user_data)
             else:
                 messages.success(request, 'User details have been successfully updated.')
                 logger.info(f"User {user.username} details updated successfully.")
+                record_activity('user_updated', user, actor=request.user)
 
             user_data.save()  # Save changes to the database
 
@@ -187,6 +197,7 @@ def user_detail(request, pk):
                 user.groups.set(group_ids)  # Update groups directly through the standard groups field
                 messages.success(request, 'User groups have been successfully updated.')
                 logger.info(f"User {user.username} groups updated by admin {request.user.username}.")
+                record_activity('user_groups', user, actor=request.user, groups=[int(pk) for pk in group_ids])
 
             return redirect('user_detail', pk=pk)
 